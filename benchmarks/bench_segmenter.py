@@ -0,0 +1,104 @@
+"""セグメント分割のベンチマーク
+
+従来の _split_long_text (文字列の連結と残りのコピーを繰り返す実装) と
+longtalker.segmenter.iter_segments を同じ入力で比べ、結果が一致することと
+入力サイズに対する処理時間の伸び方を表示する。
+
+    python benchmarks/bench_segmenter.py [最大サイズ(MB)]
+"""
+import os
+import re
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from longtalker.segmenter import MAX_CHARS_PER_AUDIO, split_long_text
+
+
+def legacy_split_long_text(original_text):
+    """main.py にあった従来の実装 (比較用にそのまま残している)"""
+    segments = []
+    sentences = re.split(r'(。)', original_text)
+    current_segment = ""
+
+    for i in range(0, len(sentences), 2):
+        sentence = sentences[i].strip()
+        if i + 1 < len(sentences):
+            sentence += sentences[i+1]
+        if not sentence:
+            continue
+
+        if len(current_segment) + len(sentence) <= MAX_CHARS_PER_AUDIO:
+            current_segment += sentence
+        else:
+            if current_segment:
+                segments.append(current_segment.strip())
+            current_segment = sentence
+
+    if current_segment:
+        segments.append(current_segment.strip())
+
+    final_segments = []
+    for segment in segments:
+        while len(segment) > MAX_CHARS_PER_AUDIO:
+            split_point = MAX_CHARS_PER_AUDIO
+            temp_split_segment = segment[:split_point]
+            last_space_index = temp_split_segment.rfind(' ')
+            if last_space_index != -1 and last_space_index > split_point * 0.8:
+                 split_point = last_space_index
+
+            final_segments.append(segment[:split_point].strip())
+            segment = segment[split_point:].strip()
+        if segment:
+            final_segments.append(segment.strip())
+    return final_segments
+
+
+def make_text(size, rng):
+    """日本語の文、「。」の無い英文、空白や改行が混ざったテキストを作る"""
+    words = ["これは", "長い", "テキスト", "です", "the", "quick", "brown", "fox", "jumps", "\n", "　", "  "]
+    pieces = []
+    length = 0
+    while length < size:
+        if rng.random() < 0.3:
+            piece = "。"
+        else:
+            piece = rng.choice(words) + (" " if rng.random() < 0.5 else "")
+        pieces.append(piece)
+        length += len(piece)
+    return "".join(pieces)
+
+
+def timed(func, text):
+    start = time.perf_counter()
+    result = func(text)
+    return result, time.perf_counter() - start
+
+
+def main():
+    max_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+    rng = random.Random(0)
+
+    # 小さな入力で結果が一致することを確認する
+    for _ in range(2000):
+        text = make_text(rng.randint(0, 2000), rng)
+        assert split_long_text(text) == legacy_split_long_text(text), repr(text)
+
+    print(f"{'入力':>10} {'種類':>8} {'従来(s)':>10} {'新(s)':>10} {'新/MB(s)':>10}")
+    size = 256 * 1024
+    while size <= max_mb * 1024 * 1024:
+        for kind, text in [
+            ("日本語", make_text(size, rng)),
+            ("句点なし", ("the quick brown fox jumps over the lazy dog " * (size // 44 + 1))[:size]),
+        ]:
+            old, old_time = timed(legacy_split_long_text, text)
+            new, new_time = timed(split_long_text, text)
+            assert old == new
+            print(f"{size // 1024:>8}KB {kind:>8} {old_time:>10.3f} {new_time:>10.3f} {new_time / (size / 2**20):>10.3f}")
+        size *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,7 @@ package.domain = org.example
 source.dir = .
 source.include_exts = py,png,jpg,kv,mp3
 version = 0.1
-requirements = python3,kivy==2.1.0,pillow,gtts,pyjnius
+requirements = python3,kivy==2.1.0,pillow,gtts,pyjnius,sqlite3
 orientation = portrait
 
 [android]
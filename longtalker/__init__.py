@@ -0,0 +1 @@
+"""LongTalker の共通ロジック (Kivy版 main.py と Tkinter版 main_tkinter.py で共有する)"""
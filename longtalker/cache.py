@@ -0,0 +1,129 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+CACHE_DIR_NAME = ".synth_cache" # AUDIO_DIR_NAME の下に作るキャッシュフォルダ名
+DEFAULT_CACHE_MAX_BYTES = 200 * 1024 * 1024 # キャッシュの上限サイズ (200MB)
+
+
+def normalize_text(text):
+    """キャッシュキー用にテキストを正規化する (全角/半角の揺れと空白の違いを吸収)"""
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(text, lang, tld="com", slow=False):
+    """セグメントのテキストとgTTSのパラメータから内容アドレス (SHA-256) を作る"""
+    payload = json.dumps([normalize_text(text), lang, tld, bool(slow)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def link_or_copy(src, dest):
+    """srcをdestにハードリンクする。できないファイルシステムではコピーする"""
+    tmp = f"{dest}.tmp{os.getpid()}_{threading.get_ident()}" # 複数のプロセスで同じキャッシュを使っても重ならない
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+
+
+class SynthesisCache:
+    """合成済みMP3を内容アドレスで保存するディスクキャッシュ (サイズ上限付きLRU)
+
+    LRUの順番はファイルの更新時刻で永続化し、起動時に一度だけフォルダを走査する。
+    ヒット時はネットワークを使わず、キャッシュからハードリンク (またはコピー) で出力先に置く。
+    max_bytes=None なら追加だけして削除しない。複数のプロセスで同じフォルダを使うときは
+    各プロセスをこれにして、終わってから1つのプロセスで trim() する
+    (プロセスごとのLRUの順番と合計サイズで互いのエントリーを削除し合わないように)。
+    """
+
+    def __init__(self, audio_dir, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.cache_dir = os.path.join(audio_dir, CACHE_DIR_NAME)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> サイズ (古い順)
+        self._total_bytes = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        found = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(".mp3"):
+                    st = entry.stat()
+                    found.append((st.st_mtime, entry.name[:-4], st.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def fetch(self, key, dest):
+        """キャッシュにあればdestに置いてTrueを返す。なければFalse"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return False
+            self._entries.move_to_end(key)
+        path = self._path(key)
+        try:
+            link_or_copy(path, dest)
+            os.utime(path) # LRUの順番を次回起動時にも残す
+        except OSError:
+            # 他の処理で消されていた場合はミス扱いにする
+            with self._lock:
+                self._total_bytes -= self._entries.pop(key, 0)
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, key, src):
+        """合成したファイルをキャッシュに登録し、上限を超えたら古いものから削除する"""
+        path = self._path(key)
+        link_or_copy(src, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._total_bytes += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+        if self.max_bytes is not None:
+            self.trim()
+
+    def trim(self):
+        """合計サイズが上限を超えていれば、古いものから削除する"""
+        evicted = []
+        with self._lock:
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
+
+    def describe(self):
+        """ステータス表示用の短い文字列"""
+        s = self.stats()
+        return f"キャッシュ: ヒット {s['hits']} / ミス {s['misses']}"
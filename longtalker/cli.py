@@ -0,0 +1,225 @@
+"""コマンドラインからの一括合成 (GUIを使わずにテキストファイルをまとめて音声にする)
+
+    python -m longtalker synth docs/*.txt
+    python -m longtalker synth "docs/**/*.txt" --lang en --processes 4 --threads 8
+    cat memo.txt | python -m longtalker synth -
+    python -m longtalker synth --resume
+    python -m longtalker unpack generated_audio/<フォルダ名>
+
+ドキュメントごとにGUIと同じ分割・フォルダ名・マニフェストでセッションを作り、
+プロセスプールに振り分けて合成する (各プロセスは SynthesisEngine のスレッドでネットワーク待ちを重ねる)。
+終わったら文字数とセグメント数のスループットを表示し、結果をレポート (JSON) に書く。
+読み込めなかったファイルや合成できなかったセグメントがあれば終了コードは 1 (ほかのドキュメントは続けて合成する)。
+unpack はコンテナ (session.ltc) にまとめたセッションを従来の形 (001.mp3 ...) に書き出す。
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from longtalker.cache import SynthesisCache
+from longtalker.library import AudioLibrary
+from longtalker.manifest import (
+    SEGMENT_DONE, SessionJournal, build_manifest, create_session_dir, find_incomplete_sessions,
+    load_resume_plan, read_manifest, segment_filenames,
+)
+from longtalker.segmenter import MAX_CHARS_PER_AUDIO, SEGMENT_MODE_GTTS, SEGMENT_MODE_SENTENCE, split_long_text
+
+DEFAULT_AUDIO_DIR = "generated_audio"
+DEFAULT_THREADS = 4 # 1プロセスあたりの同時合成数 (SynthesisEngine の max_in_flight)
+REPORT_NAME = "synth_report.json" # 出力先フォルダに書くレポートの既定のファイル名
+
+_engine = None # ワーカープロセスごとの SynthesisEngine (_init_worker で作る)
+
+
+def _failed_result(session_dir, error, source=None):
+    return {"input": source, "session_dir": session_dir, "error": error, "failed": None, "chars": 0,
+            "segments": 0, "seconds": 0.0}
+
+
+def _session_source(session_dir):
+    """セッションの入力元 (ファイルのパスか stdin)。CLI以外で作ったセッションならNone"""
+    return (read_manifest(session_dir) or {}).get("source")
+
+
+def _expand_inputs(inputs):
+    """ファイル・グロブ・"-" (標準入力) を (タイトル, テキスト) の列にする
+
+    読み込めなかったファイル (存在しない、UTF-8でないなど) は飛ばし、レポート用の結果として2つ目に返す。
+    """
+    documents = []
+    failures = []
+    for item in inputs:
+        if item == "-":
+            documents.append(("stdin", sys.stdin.read()))
+            continue
+        paths = sorted(glob.glob(item, recursive=True)) if glob.has_magic(item) else [item]
+        if not paths:
+            print(f"一致するファイルがありません: {item}", file=sys.stderr)
+        for path in paths:
+            if os.path.isdir(path):
+                continue
+            try:
+                with open(path, encoding="utf-8") as f:
+                    documents.append((path, f.read()))
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"NG {path}: 読み込めません: {e}", file=sys.stderr)
+                failures.append(_failed_result(None, f"読み込めません: {e}", source=path))
+    return documents, failures
+
+
+def _prepare_documents(documents, audio_dir, lang_code, max_chars, mode, library):
+    """ドキュメントごとにセッションフォルダとマニフェストを作り、セッションフォルダのリストを返す"""
+    session_dirs = []
+    for title, text in documents:
+        text = text.strip()
+        segments = split_long_text(text, max_chars, mode=mode)
+        if not segments:
+            print(f"分割可能なテキストが見つかりません: {title}", file=sys.stderr)
+            continue
+        session_dir = create_session_dir(audio_dir, text)
+        filenames = segment_filenames(session_dir, len(segments))
+        manifest = build_manifest(text, segments, lang_code, filenames, packing=mode == SEGMENT_MODE_GTTS)
+        manifest["source"] = title # レポートで、--resume で合成し直すのがどのファイルかを示す
+        SessionJournal(session_dir, manifest)
+        library.record_session(session_dir, manifest, title=os.path.basename(title) if title != "stdin" else text[:40])
+        session_dirs.append(session_dir)
+    return session_dirs
+
+
+def _init_worker(audio_dir, threads, use_cache):
+    # ワーカープロセスの初期化: 接続プールとキャッシュはプロセス内のジョブで使い回す
+    # キャッシュは追加だけにして、上限を超えた分は全部終わってから親プロセスで削除する
+    global _engine
+    from longtalker.engine import SynthesisEngine
+    from longtalker.transport import BatchedTransport
+    cache = SynthesisCache(audio_dir, max_bytes=None) if use_cache else None
+    transport = BatchedTransport(pool_size=threads)
+    _engine = SynthesisEngine(max_in_flight=threads, cache=cache, transport=transport)
+
+
+def _synthesize_session(session_dir):
+    """ワーカープロセスで1つのセッションの残りのセグメントを合成し、結果を辞書で返す"""
+    from longtalker.timing import build_timing_index, write_timing_index
+    started = time.monotonic()
+    plan = load_resume_plan(session_dir)
+    if plan is None:
+        return _failed_result(session_dir, "マニフェストがありません")
+    todo = [i for i in range(len(plan.segments)) if i not in plan.done]
+    journal = SessionJournal(session_dir, plan.manifest)
+    job = _engine.submit(
+        plan.segments, plan.manifest["lang"], plan.filenames, lookahead=None, done=plan.done,
+        packing=plan.manifest.get("packing", False), journal=journal,
+    )
+    job.join()
+    segments = journal.manifest["segments"]
+    failed = [i + 1 for i, segment in enumerate(segments) if segment.get("status") != SEGMENT_DONE]
+    synthesized = [i for i in todo if i + 1 not in failed]
+    if not failed:
+        write_timing_index(session_dir, build_timing_index(plan.segments, plan.filenames))
+    return {
+        "input": plan.manifest.get("source"),
+        "session_dir": session_dir,
+        "error": str(job.error) if job.error is not None else None,
+        "failed": failed,
+        "chars": sum(len(plan.segments[i]) for i in synthesized),
+        "segments": len(synthesized),
+        "seconds": round(time.monotonic() - started, 3),
+    }
+
+
+def run_synth(args):
+    os.makedirs(args.out, exist_ok=True)
+    library = AudioLibrary(args.out)
+    session_dirs = find_incomplete_sessions(args.out) if args.resume else []
+    inputs = args.inputs or ([] if args.resume or sys.stdin.isatty() else ["-"])
+    documents, results = _expand_inputs(inputs)
+    session_dirs += _prepare_documents(documents, args.out, args.lang, args.max_chars, args.mode, library)
+    if not session_dirs and not results:
+        print("合成するドキュメントがありません", file=sys.stderr)
+        return 2
+
+    processes = max(1, min(args.processes, len(session_dirs)))
+    print(f"{len(session_dirs)} 個のドキュメントを {processes} プロセス × {args.threads} スレッドで合成します...")
+    started = time.monotonic()
+    with ProcessPoolExecutor(
+        max_workers=processes, initializer=_init_worker, initargs=(args.out, args.threads, not args.no_cache),
+    ) as pool:
+        futures = {pool.submit(_synthesize_session, session_dir): session_dir for session_dir in session_dirs}
+        for n, future in enumerate(as_completed(futures), 1):
+            try:
+                result = future.result()
+            except Exception as e: # ワーカープロセスごと失敗した場合
+                result = _failed_result(futures[future], str(e), source=_session_source(futures[future]))
+            results.append(result)
+            mark = "NG" if result["error"] or result["failed"] != [] else "OK"
+            print(f"[{n}/{len(session_dirs)}] {mark} {result['input'] or '-'} ({os.path.basename(result['session_dir'])}): "
+                  f"{result['segments']} セグメント, {result['seconds']:.1f} 秒")
+            if mark == "OK":
+                library.refresh_session(result["session_dir"])
+    elapsed = time.monotonic() - started
+    if not args.no_cache:
+        SynthesisCache(args.out).trim() # ディスク上のサイズを数え直してから削除する
+
+    chars = sum(r["chars"] for r in results)
+    segments = sum(r["segments"] for r in results)
+    failures = [r for r in results if r["error"] or r["failed"] != []]
+    print(f"合計: {chars} 文字, {segments} セグメント, {elapsed:.1f} 秒 "
+          f"({chars / elapsed if elapsed else 0:.1f} 文字/秒, {segments / elapsed if elapsed else 0:.2f} セグメント/秒)")
+
+    report_path = args.report or os.path.join(args.out, REPORT_NAME)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "finished": datetime.now().isoformat(timespec="seconds"),
+            "seconds": round(elapsed, 3),
+            "chars": chars,
+            "segments": segments,
+            "chars_per_second": round(chars / elapsed, 2) if elapsed else None,
+            "segments_per_second": round(segments / elapsed, 3) if elapsed else None,
+            "failed_documents": len(failures),
+            "documents": sorted(results, key=lambda r: r["session_dir"] or r["input"]),
+        }, f, ensure_ascii=False, indent=1)
+    print(f"レポート: {report_path}")
+    if failures:
+        print(f"{len(failures)} 個のドキュメントが読み込めないか、合成できなかったセグメントがあります "
+              f"(合成の失敗は --resume で続きから合成できます)", file=sys.stderr)
+        return 1
+    return 0
+
+
+def run_unpack(args):
+    from longtalker.container import unpack_session
+    for session_dir in args.sessions:
+        print(f"{session_dir}: {unpack_session(session_dir)} 個のMP3ファイルを書き出しました")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m longtalker", description="LongTalker のコマンドライン")
+    commands = parser.add_subparsers(dest="command", required=True)
+    synth = commands.add_parser("synth", help="テキストファイルをまとめて音声に合成する")
+    synth.add_argument("inputs", nargs="*", help="テキストファイル、グロブ (** も可)、または - (標準入力)")
+    synth.add_argument("--lang", default="ja", help="言語コード (既定: ja)")
+    synth.add_argument("--out", default=DEFAULT_AUDIO_DIR, help=f"出力先フォルダ (既定: {DEFAULT_AUDIO_DIR})")
+    synth.add_argument("--mode", choices=(SEGMENT_MODE_SENTENCE, SEGMENT_MODE_GTTS), default=SEGMENT_MODE_SENTENCE,
+                       help="セグメントの分割方法 (既定: sentence)")
+    synth.add_argument("--max-chars", type=int, default=MAX_CHARS_PER_AUDIO, help="1セグメントの最大文字数")
+    synth.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="ワーカープロセス数")
+    synth.add_argument("--threads", type=int, default=DEFAULT_THREADS, help="1プロセスあたりの同時合成数")
+    synth.add_argument("--no-cache", action="store_true", help="合成キャッシュを使わない")
+    synth.add_argument("--resume", action="store_true", help="出力先の途中で終わったセッションも続きから合成する")
+    synth.add_argument("--report", help=f"レポートの書き出し先 (既定: <出力先>/{REPORT_NAME})")
+    synth.set_defaults(func=run_synth)
+    unpack = commands.add_parser("unpack", help="コンテナにまとめたセッションをセグメントごとのMP3ファイルに書き出す")
+    unpack.add_argument("sessions", nargs="+", help="セッションフォルダ")
+    unpack.set_defaults(func=run_unpack)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
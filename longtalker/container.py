@@ -0,0 +1,238 @@
+import io
+import os
+import mmap
+import struct
+from collections import namedtuple
+
+from longtalker.manifest import read_manifest, session_segment_files
+
+CONTAINER_NAME = "session.ltc" # セッションフォルダ内のコンテナのファイル名
+
+_FILE_MAGIC = b"LTC1"
+_RECORD = struct.Struct(">4sII") # b"SEGM", セグメント番号 (0始まり), 長さ
+_RECORD_MAGIC = b"SEGM"
+_ENTRY = struct.Struct(">IQI") # セグメント番号, データの位置, 長さ
+_FOOTER = struct.Struct(">4sIQ") # b"LTIX", エントリー数, インデックスの位置
+_FOOTER_MAGIC = b"LTIX"
+
+# コンテナの中の1つのセグメント。範囲指定で読めるプレーヤーにはファイルを書き出さずに渡す
+SegmentRange = namedtuple("SegmentRange", ["path", "offset", "length"])
+
+
+def _read_index(f, size):
+    """末尾のインデックスを読む。無い・壊れている場合は先頭からレコードをたどって作り直す
+
+    (セグメント番号 -> (位置, 長さ)) の辞書と、次のレコードを書き始める位置を返す。
+    """
+    if size >= len(_FILE_MAGIC) + _FOOTER.size:
+        f.seek(size - _FOOTER.size)
+        magic, count, index_offset = _FOOTER.unpack(f.read(_FOOTER.size))
+        if magic == _FOOTER_MAGIC and index_offset + count * _ENTRY.size + _FOOTER.size == size:
+            f.seek(index_offset)
+            data = f.read(count * _ENTRY.size)
+            entries = {index: (offset, length) for index, offset, length in _ENTRY.iter_unpack(data)}
+            return entries, index_offset
+
+    # 書き込み中に中断されたコンテナ: 完全に書かれたレコードだけを拾う
+    entries = {}
+    pos = len(_FILE_MAGIC)
+    f.seek(pos)
+    while pos + _RECORD.size <= size:
+        magic, index, length = _RECORD.unpack(f.read(_RECORD.size))
+        if magic != _RECORD_MAGIC or pos + _RECORD.size + length > size:
+            break
+        entries[index] = (pos + _RECORD.size, length)
+        pos += _RECORD.size + length
+        f.seek(pos)
+    return entries, pos
+
+
+class ContainerWriter:
+    """セッションのセグメントを1つのファイルに追記していく (追記のみ、末尾にインデックス)
+
+    レコードは [b"SEGM", 番号, 長さ, MP3データ] の形で順に追記し、close() で
+    各セグメントの位置と長さのインデックスを末尾に書く。インデックスを書く前に中断されても、
+    次に開いたときにレコードをたどって復元し、続きから追記できる。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        exists = os.path.exists(path)
+        self._f = open(path, "r+b" if exists else "w+b")
+        if exists:
+            size = os.fstat(self._f.fileno()).st_size
+            self._f.seek(0)
+            if self._f.read(len(_FILE_MAGIC)) != _FILE_MAGIC:
+                self._f.close()
+                raise ValueError(f"{path}: セッションコンテナではありません")
+            self.entries, end = _read_index(self._f, size)
+            self._f.truncate(end) # 古いインデックスを外して続きから追記する
+            self._f.seek(end)
+        else:
+            self.entries = {}
+            self._f.write(_FILE_MAGIC)
+
+    def append(self, index, data):
+        self._f.write(_RECORD.pack(_RECORD_MAGIC, index, len(data)))
+        self.entries[index] = (self._f.tell(), len(data))
+        self._f.write(data)
+
+    def append_file(self, index, path, chunk_size=64 * 1024):
+        """ファイルの内容を少しずつ読みながらレコードとして追記する"""
+        length = os.path.getsize(path)
+        self._f.write(_RECORD.pack(_RECORD_MAGIC, index, length))
+        self.entries[index] = (self._f.tell(), length)
+        with open(path, "rb") as src:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                self._f.write(chunk)
+
+    def close(self):
+        index_offset = self._f.tell()
+        for index in sorted(self.entries):
+            self._f.write(_ENTRY.pack(index, *self.entries[index]))
+        self._f.write(_FOOTER.pack(_FOOTER_MAGIC, len(self.entries), index_offset))
+        self._f.flush()
+        os.fsync(self._f.fileno()) # 書き終えたときに1回だけ
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ContainerReader:
+    """セッションコンテナをmmapで開き、セグメントのMP3データをコピーせずに取り出す"""
+
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, "rb")
+        size = os.fstat(self._f.fileno()).st_size
+        if self._f.read(len(_FILE_MAGIC)) != _FILE_MAGIC:
+            self._f.close()
+            raise ValueError(f"{path}: セッションコンテナではありません")
+        self.entries, _end = _read_index(self._f, size)
+        self._map = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def segment_range(self, index):
+        """セグメントのデータのファイル内の (位置, 長さ)。範囲指定で読めるプレーヤー向け"""
+        return self.entries[index]
+
+    def segment(self, index):
+        """セグメントのMP3データ (memoryview、コピーしない)"""
+        offset, length = self.entries[index]
+        return memoryview(self._map)[offset:offset + length]
+
+    def close(self):
+        self._map.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def pack_session(session_dir):
+    """セッションのセグメントのMP3をコンテナにまとめ、元のファイルを削除する
+
+    マニフェストの順に1つずつ追記する (すでにコンテナにあるセグメントは飛ばす)。
+    まとめたセグメントの数を返す。まとめるファイルが無ければコンテナには触らない。
+    """
+    manifest = read_manifest(session_dir)
+    if not manifest:
+        return 0
+    loose = [
+        (i, os.path.join(session_dir, segment["file"])) for i, segment in enumerate(manifest["segments"])
+        if os.path.exists(os.path.join(session_dir, segment["file"]))
+    ]
+    if not loose:
+        return 0 # まとめ済み (再生し直しても書き直さない)
+    with ContainerWriter(os.path.join(session_dir, CONTAINER_NAME)) as writer:
+        for i, path in loose:
+            if i not in writer.entries:
+                writer.append_file(i, path)
+    for _i, path in loose:
+        os.remove(path)
+    return len(loose)
+
+
+def unpack_session(session_dir):
+    """コンテナからセグメントごとのMP3ファイル (001.mp3 ...) を書き出し、従来の形に戻す
+
+    従来の形のフォルダを必要とするツール向けの書き出し (再生には使わない)。
+    コンテナはそのまま残す。書き出したファイルの数を返す。
+    """
+    path = os.path.join(session_dir, CONTAINER_NAME)
+    manifest = read_manifest(session_dir)
+    if not manifest or not os.path.exists(path):
+        return 0
+    count = 0
+    with ContainerReader(path) as reader:
+        for i, segment in enumerate(manifest["segments"]):
+            dest = os.path.join(session_dir, segment["file"])
+            if i in reader.entries and not os.path.exists(dest):
+                tmp = dest + ".tmp"
+                with open(tmp, "wb") as f:
+                    f.write(reader.segment(i))
+                os.replace(tmp, dest)
+                count += 1
+    return count
+
+
+def packed_segments(session_dir):
+    """コンテナにまとめたセグメントを {セグメント番号 (0始まり): SegmentRange} で返す (コンテナが無ければ空)"""
+    path = os.path.join(session_dir, CONTAINER_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "rb") as f:
+        if f.read(len(_FILE_MAGIC)) != _FILE_MAGIC:
+            raise ValueError(f"{path}: セッションコンテナではありません")
+        entries, _end = _read_index(f, os.fstat(f.fileno()).st_size)
+    return {i: SegmentRange(path, offset, length) for i, (offset, length) in entries.items()}
+
+
+def playable_segments(session_dir):
+    """再生用にセグメントを再生順に返す
+
+    コンテナにまとめたセグメントは SegmentRange (コンテナ内の位置と長さ)、
+    まとめていないセグメントはMP3ファイルのパス。コンテナからファイルは書き出さない。
+    """
+    if not os.path.exists(os.path.join(session_dir, CONTAINER_NAME)):
+        return session_segment_files(session_dir)
+    packed = packed_segments(session_dir)
+    manifest = read_manifest(session_dir)
+    if not manifest:
+        return [packed[i] for i in sorted(packed)]
+    sources = []
+    for i, segment in enumerate(manifest["segments"]):
+        if i in packed:
+            sources.append(packed[i])
+        elif os.path.exists(os.path.join(session_dir, segment["file"])):
+            sources.append(os.path.join(session_dir, segment["file"]))
+    return sources
+
+
+def read_segment(source):
+    """セグメントのMP3データを読む (SegmentRange ならその範囲だけを読む)"""
+    if not isinstance(source, SegmentRange):
+        with open(source, "rb") as f:
+            return f.read()
+    with open(source.path, "rb") as f:
+        f.seek(source.offset)
+        return f.read(source.length)
+
+
+def open_segment(source):
+    """セグメントを読み込み用のファイルオブジェクトとして開く (SegmentRange なら範囲だけをメモリに読む)"""
+    if isinstance(source, SegmentRange):
+        return io.BytesIO(read_segment(source))
+    return open(source, "rb")
@@ -0,0 +1,409 @@
+import asyncio
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from longtalker.ratelimit import DEFAULT_MAX_RETRIES, AdaptiveLimiter, backoff_delay, classify_error
+from longtalker.synthesis import DEFAULT_LOOKAHEAD, DEFAULT_SYNTH_WORKERS, fetch_cached_segment, synthesize_segment
+
+
+DEFAULT_PRIORITY = 0 # ジョブの優先度の既定値 (大きいほど先に同時実行の枠をもらう)
+
+
+class JobCancelled(Exception):
+    """ジョブが取り消されたことを待機中のスレッドに知らせる例外"""
+
+
+class SynthesisJob:
+    """SynthesisEngine に投入した1回分の合成ジョブ
+
+    完成したセグメントは番号順に次の3通りで受け取れる。
+    - エンジンのループ上のコルーチンからは ``async for index, filename in job``
+    - KivyのClockやTkinterのafterからは poll() (ブロックしない)
+    - 再生スレッドなどからは wait(index) (完成まで待つ)
+    消費側は advance(index) で再生位置を知らせる。合成はその位置 + lookahead までしか先行しない。
+    seek(index) は再生位置を飛ばしたときに呼び、index 番目から先を優先して合成させる。
+    pause() / resume() で新しいリクエストの送信を止めたり再開したりでき、priority は
+    エンジンの同時実行の枠を複数のジョブで分け合うときの優先度。
+    journal (SessionJournal) を渡すと、セグメントを保存するたびにワーカースレッドで記録し、
+    ジョブが終わったとき (完了・エラー・取り消し) に書き込む。
+    """
+
+    def __init__(self, engine, segments, lang_code, filenames, lookahead=DEFAULT_LOOKAHEAD, done=(), packing=False,
+                 priority=DEFAULT_PRIORITY, journal=None):
+        self.engine = engine
+        self.segments = list(segments)
+        self.lang_code = lang_code
+        self.filenames = list(filenames)
+        self.total = len(self.segments)
+        self.output_dir = os.path.dirname(self.filenames[0]) if self.filenames else None
+        self.lookahead = lookahead
+        self.packing = packing
+        self.error = None
+        self.cancelled = False
+        self.paused = False
+        self.priority = priority
+        self.journal = journal
+
+        self._lock = threading.Condition()
+        self._ready = set(done) # 完成済みのセグメント番号 (done は前回の音声を再利用したもの)
+        self._synthesized = 0 # 先頭から連続して完成したセグメント数
+        while self._synthesized in self._ready:
+            self._synthesized += 1
+        self._order = deque(i for i in range(self.total) if i not in self._ready) # まだ送っていないセグメント (送る順)
+        self._polled = 0 # poll() が次に返すセグメントの番号
+        self._consumed = 0
+        self._task = None
+        self._started = set()
+        self._cache_missed = set() # キャッシュを確認して無かったセグメント (ミスを2回数えない)
+        self._changed = None # asyncio.Condition (ループ上で作成する)
+        self._in_flight = 0 # このジョブが使っている同時実行の枠の数 (ループ上でだけ触る)
+        self._ended = threading.Event() # ループ上のタスクが終わった (マニフェストの書き込みも済んだ)
+
+    @property
+    def synthesized(self):
+        return self._synthesized
+
+    @property
+    def finished(self):
+        """すべて合成し終えたか、エラーまたは取り消しで終了したか"""
+        return self._synthesized == self.total or self.error is not None or self.cancelled
+
+    # --- エンジンのループ上で動く部分 ---
+
+    def _window_open(self, index):
+        return self.lookahead is None or index < self._consumed + self.lookahead
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        tasks = []
+        try:
+            while self._order:
+                # 再生位置から離れ過ぎないように待つ (バックプレッシャー)
+                async with self._changed:
+                    await self._changed.wait_for(lambda: self._window_open(self._order[0]) or self.error is not None)
+                if self.error is not None:
+                    break
+                # キャッシュにある音声は枠を取らずに取り出す (リクエスト数や応答時間に数えない)
+                index = self._order[0]
+                if index not in self._cache_missed:
+                    if await loop.run_in_executor(self.engine._executor, self._fetch_cached, index):
+                        if index in self._order: # 取り出している間に seek() で順番が変わっていてもよい
+                            self._order.remove(index)
+                        self._mark_ready(index)
+                        async with self._changed:
+                            self._changed.notify_all()
+                        continue
+                    # 枠を返して選び直したときに、同じセグメントをもう一度確認しない
+                    self._cache_missed.add(index)
+                # 同時に送るリクエスト数はエンジン全体で制御し、枠はジョブの間で公平に分ける
+                await self.engine._acquire_for(self)
+                if self.error is not None or not self._window_open(self._order[0]):
+                    # 枠を待っている間にエラーになったか、seek() で送る順番が変わった
+                    self._in_flight -= 1
+                    self.engine.limiter.give_back()
+                    continue
+                index = self._order.popleft()
+                task = loop.create_task(self._synthesize(index))
+                task.add_done_callback(lambda _task, index=index: self._release_unstarted(index, _task))
+                tasks.append(task)
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            self._mark_cancelled()
+            raise
+        finally:
+            if self.journal is not None:
+                await loop.run_in_executor(self.engine._executor, self._flush_journal)
+
+    def _flush_journal(self):
+        try:
+            self.journal.flush(abandoned=self.cancelled)
+        except OSError as e:
+            print(f"マニフェストの書き込みに失敗しました: {e}")
+
+    def _fetch_cached(self, index):
+        # ワーカースレッドで実行する
+        if not fetch_cached_segment(self.segments[index], self.lang_code, self.filenames[index], self.engine.cache):
+            return False
+        if self.journal is not None:
+            self.journal.record(index)
+        return True
+
+    def _synthesize_and_record(self, index):
+        # ワーカースレッドで実行する (キャッシュは _run で確認済み)
+        synthesize_segment(
+            self.segments[index], self.lang_code, self.filenames[index],
+            self.engine.cache, self.engine.transport, self.packing, use_cached=False,
+        )
+        if self.journal is not None:
+            self.journal.record(index)
+
+    def _mark_ready(self, index):
+        with self._lock:
+            self._ready.add(index)
+            while self._synthesized in self._ready:
+                self._synthesized += 1
+            self._lock.notify_all()
+
+    def _release_unstarted(self, index, task):
+        # 開始前に取り消されたタスクは、ランチャーが確保した枠を返せないのでここで返す
+        if task.cancelled() and index not in self._started:
+            self._in_flight -= 1
+            self.engine.limiter.give_back()
+
+    async def _synthesize(self, index):
+        """index番目を合成する。429/5xxや接続エラーの場合はこのセグメントだけを再試行する"""
+        self._started.add(index)
+        loop = asyncio.get_running_loop()
+        limiter = self.engine.limiter
+        holding = True # ランチャーが確保した枠を持った状態で始まる
+        attempt = 0
+        try:
+            while True:
+                if not holding:
+                    await self.engine._acquire_for(self)
+                    holding = True
+                started = time.monotonic()
+                try:
+                    await loop.run_in_executor(self.engine._executor, self._synthesize_and_record, index)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    retryable, throttled, retry_after = classify_error(e)
+                    holding = False
+                    self._in_flight -= 1
+                    limiter.release(throttled=throttled, retry_after=retry_after)
+                    if not retryable or attempt >= self.engine.max_retries:
+                        with self._lock:
+                            if self.error is None:
+                                self.error = e
+                            self._lock.notify_all()
+                        break
+                    attempt += 1
+                    limiter.record_retry()
+                    delay = backoff_delay(attempt, retry_after)
+                    print(f"セグメント {index+1} を {delay:.1f} 秒後に再試行します ({attempt}/{self.engine.max_retries}): {e}")
+                    await asyncio.sleep(delay)
+                else:
+                    holding = False
+                    self._in_flight -= 1
+                    limiter.release(latency=time.monotonic() - started)
+                    self._mark_ready(index)
+                    break
+        finally:
+            if holding:
+                # 合成中に取り消された: 終わっていないリクエストは数えずに枠だけを返す
+                self._in_flight -= 1
+                limiter.give_back()
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    def _reorder(self, index):
+        # まだ送っていないセグメントを index 番目から先、その前の順に並べ直す
+        ahead = [i for i in self._order if i >= index]
+        behind = [i for i in self._order if i < index]
+        self._order = deque(ahead + behind)
+        self.engine.loop.create_task(self._notify())
+
+    def _mark_cancelled(self):
+        with self._lock:
+            self.cancelled = True
+            self._lock.notify_all()
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for index in range(self.total):
+            async with self._changed:
+                await self._changed.wait_for(lambda: index in self._ready or self.finished)
+            self._raise_if_failed(index)
+            self.advance(index)
+            yield index, self.filenames[index]
+
+    # --- 他のスレッドから呼ぶ部分 ---
+
+    def _raise_if_failed(self, index):
+        if index in self._ready:
+            return
+        if self.error is not None:
+            raise self.error
+        if self.cancelled:
+            raise JobCancelled()
+
+    def poll(self):
+        """前回のpoll以降に番号順で完成したセグメントを [(index, filename), ...] で返す (ブロックしない)
+
+        seek(index) の後は index 番目から返す。
+        """
+        with self._lock:
+            start = self._polled
+            while self._polled in self._ready:
+                self._polled += 1
+        return [(i, self.filenames[i]) for i in range(start, self._polled)]
+
+    def seek(self, index):
+        """再生位置を index 番目に移す (文をタップして先や前に飛んだとき)
+
+        まだ送っていない index 番目以降のセグメントを先に合成し、その前のセグメントは後回しにする。
+        poll() は index 番目から返し直す。index 番目から続けて完成済みのセグメントを
+        [(index, filename), ...] で返すので、呼び出し側はそれをそのまま再生キューに入れればよい。
+        """
+        with self._lock:
+            self._consumed = index + 1
+            self._polled = index
+        ready = self.poll()
+        self.engine.loop.call_soon_threadsafe(self._reorder, index)
+        return ready
+
+    def wait(self, index, timeout=None):
+        """index番目の完成を待ってファイルパスを返す。失敗・取り消し時は例外を送出する"""
+        with self._lock:
+            self._lock.wait_for(lambda: index in self._ready or self.finished, timeout)
+            self._raise_if_failed(index)
+        return self.filenames[index]
+
+    def join(self, timeout=None):
+        """ジョブの実行が終わるまで待つ (journal の最後の書き込みも含む)。終わっていればTrue"""
+        return self._ended.wait(timeout)
+
+    def advance(self, index):
+        """消費側 (再生) が index 番目まで進んだことを知らせ、先の合成を許可する"""
+        with self._lock:
+            if index + 1 <= self._consumed:
+                return
+            self._consumed = index + 1
+        if self._changed is not None:
+            asyncio.run_coroutine_threadsafe(self._notify(), self.engine.loop)
+
+    def pause(self):
+        """新しいリクエストを送らないようにする (送信中のリクエストはそのまま完了させる)"""
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        self.engine.loop.call_soon_threadsafe(self.engine._wakeup.set)
+
+    def set_priority(self, priority):
+        self.priority = priority
+        self.engine.loop.call_soon_threadsafe(self.engine._wakeup.set)
+
+    def cancel(self):
+        """合成を取り消す。実行中のリクエストの結果は捨てられ、新しいリクエストは送られない"""
+        self._mark_cancelled()
+        if self._task is not None:
+            self.engine.loop.call_soon_threadsafe(self._task.cancel)
+
+
+class SynthesisEngine:
+    """1本の常駐スレッドで動くasyncioループ上で、合成ジョブを実行するエンジン
+
+    ボタンを押すたびにスレッドを作る代わりに、すべてのジョブをこのループで扱う。
+    gTTSの呼び出しはブロッキングなので、ループからスレッドプールに渡して実行する。
+    同時に実行中のリクエスト数は AdaptiveLimiter が max_in_flight を上限に増減させる
+    (adaptive=False なら常に max_in_flight)。
+    複数のジョブが枠を待っているときは、優先度の高いジョブから、同じ優先度なら使っている枠の
+    少ないジョブから順に渡すので、同時に動くジョブは枠を公平に分け合う。一時停止中のジョブには渡さない。
+    """
+
+    def __init__(self, max_in_flight=DEFAULT_SYNTH_WORKERS, cache=None, transport=None,
+                 adaptive=True, max_retries=DEFAULT_MAX_RETRIES):
+        self.max_in_flight = max(1, max_in_flight)
+        self.cache = cache
+        self.transport = transport
+        self.adaptive = adaptive
+        self.max_retries = max_retries
+        self.loop = asyncio.new_event_loop()
+        # リクエスト用の max_in_flight 個に加えて、キャッシュの取り出しとマニフェストの書き込み用に1つ
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight + 1, thread_name_prefix="longtalker-synth")
+        self.limiter = None
+        self._waiters = [] # 枠を待っている (到着順, ジョブ, Future)
+        self._arrivals = 0
+        self._wakeup = None # asyncio.Event (ループ上で作成する)
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, args=(started,), name="longtalker-engine")
+        self._thread.daemon = True
+        self._thread.start()
+        started.wait()
+
+    def _run_loop(self, started):
+        asyncio.set_event_loop(self.loop)
+        self.limiter = AdaptiveLimiter(self.max_in_flight, adaptive=self.adaptive)
+        self._wakeup = asyncio.Event()
+        self.loop.create_task(self._dispatch())
+        self.loop.call_soon(started.set)
+        self.loop.run_forever()
+
+    async def _acquire_for(self, job):
+        """job のために同時実行の枠を1つ確保する (渡す順番は _dispatch が決める)"""
+        future = self.loop.create_future()
+        self._arrivals += 1
+        self._waiters.append((self._arrivals, job, future))
+        self._wakeup.set()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 枠を渡された直後に取り消された
+                job._in_flight -= 1
+                self.limiter.give_back()
+            raise
+
+    def _next_waiter(self):
+        self._waiters = [w for w in self._waiters if not w[2].done()] # 取り消されたものを除く
+        ready = [w for w in self._waiters if not w[1].paused]
+        if not ready:
+            return None
+        return min(ready, key=lambda w: (-w[1].priority, w[1]._in_flight, w[0]))
+
+    async def _dispatch(self):
+        """枠が空くたびに、待っているジョブの中から次に渡すジョブを選ぶ"""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._next_waiter() is not None:
+                await self.limiter.acquire()
+                waiter = self._next_waiter() # 待っている間に状況が変わっていれば選び直す
+                if waiter is None:
+                    self.limiter.give_back()
+                    break
+                self._waiters.remove(waiter)
+                waiter[1]._in_flight += 1
+                waiter[2].set_result(None)
+
+    def submit(self, segments, lang_code, filenames, lookahead=DEFAULT_LOOKAHEAD, done=(), packing=False,
+               priority=DEFAULT_PRIORITY, journal=None):
+        """ジョブを投入してすぐに SynthesisJob を返す
+
+        lookahead=None なら先行数の制限なし。done には既にファイルがあるセグメントの番号を渡す。
+        packing=True はgTTSのリクエストを100文字ずつに詰める (SEGMENT_MODE_GTTS 用)。
+        priority は同時実行の枠を他のジョブと分け合うときの優先度 (大きいほど先)。
+        journal (SessionJournal) には合成し終えたセグメントを記録する。
+        """
+        job = SynthesisJob(
+            self, segments, lang_code, filenames, lookahead=lookahead, done=done, packing=packing,
+            priority=priority, journal=journal,
+        )
+
+        def start():
+            job._changed = asyncio.Condition()
+            job._task = self.loop.create_task(job._run())
+            job._task.add_done_callback(lambda _task: job._ended.set())
+            if job.cancelled:
+                job._task.cancel()
+
+        self.loop.call_soon_threadsafe(start)
+        return job
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self._executor.shutdown(wait=False, cancel_futures=True)
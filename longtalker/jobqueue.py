@@ -0,0 +1,272 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+QUEUE_STATE_NAME = ".job_queue.json" # 合成キューの状態を保存するファイル (AUDIO_DIR_NAME 直下)
+QUEUE_TEXT_DIR_NAME = ".job_queue" # キューに入れたテキストを1件ずつ保存するフォルダ (AUDIO_DIR_NAME 直下)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_PAUSED = "paused"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+JOB_STATE_LABELS = {
+    JOB_QUEUED: "待機中", JOB_RUNNING: "合成中", JOB_PAUSED: "一時停止",
+    JOB_DONE: "完了", JOB_FAILED: "失敗", JOB_CANCELLED: "取り消し",
+}
+_FINISHED_STATES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+
+class JobQueue:
+    """複数のテキストを順に合成する待ち行列 (優先度付き、状態はファイルに保存する)
+
+    add() で入れたテキストを、優先度の高い順 (同じなら入れた順) に max_active 個まで同時に
+    エンジンへ投入する。同時に動くジョブはエンジンの同時実行の枠を公平に分け合う。
+    start(entry) はエントリー (辞書) からセッションフォルダを作って (session_dir があればその続きを)
+    合成する SynthesisJob を返す関数、
+    on_finish(entry, job) は合成し終えたときに呼ぶ関数で、どちらもアプリ側が渡す。
+    start は分割やファイルの準備に時間がかかるので、キュー専用のスレッドで呼ぶ (UIには触らないこと)。
+    pump() をUIのスレッドから定期的に呼ぶと、終わったジョブを片付けて次のジョブを投入する。
+    状態は変わるたびに保存するので、アプリを終了しても次の起動で続きから合成する
+    (合成中だったジョブは待機中に戻し、作りかけのセッションフォルダの続きから合成する)。
+    テキストは状態のファイルに入れずに1件ずつ別のファイルに保存し (read_text で読む)、
+    セッションフォルダができたら (テキストはマニフェストに入るので) 削除する。
+    メソッドはすべてUIのスレッドから呼ぶ。
+    """
+
+    def __init__(self, audio_dir, start, on_finish=None, max_active=2):
+        self.path = os.path.join(audio_dir, QUEUE_STATE_NAME)
+        self.text_dir = os.path.join(audio_dir, QUEUE_TEXT_DIR_NAME)
+        self.start = start
+        self.on_finish = on_finish
+        self.max_active = max(1, max_active)
+        self.entries = []
+        self._jobs = {} # エントリーのid -> SynthesisJob
+        self._starting = {} # エントリーのid -> start() の Future (準備中のジョブ)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="longtalker-queue")
+        self._next_id = 1
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.entries = state.get("entries", [])
+        self._next_id = state.get("next_id", len(self.entries) + 1)
+        migrated = False
+        for entry in self.entries:
+            if entry["state"] == JOB_RUNNING:
+                entry["state"] = JOB_QUEUED # 前回の終了時に合成中だったもの
+            if "text" in entry:
+                # 以前の形式 (テキストを状態のファイルに入れていた) を移す
+                text = entry.pop("text")
+                entry["text_file"] = self._write_text(entry["id"], text) if text and not entry["session_dir"] else None
+                migrated = True
+        if migrated:
+            self._save()
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"next_id": self._next_id, "entries": self.entries}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
+
+    def _write_text(self, entry_id, text):
+        os.makedirs(self.text_dir, exist_ok=True)
+        name = f"{entry_id}.txt"
+        path = os.path.join(self.text_dir, name)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(path + ".tmp", path)
+        return name
+
+    def _discard_text(self, entry):
+        name, entry["text_file"] = entry.get("text_file"), None
+        if name:
+            try:
+                os.remove(os.path.join(self.text_dir, name))
+            except OSError:
+                pass
+
+    def read_text(self, entry):
+        """エントリーのテキストを読む (start から呼ぶ)。保存していなければ空文字列"""
+        if not entry.get("text_file"):
+            return ""
+        with open(os.path.join(self.text_dir, entry["text_file"]), encoding="utf-8") as f:
+            return f.read()
+
+    def get(self, entry_id):
+        for entry in self.entries:
+            if entry["id"] == entry_id:
+                return entry
+        raise KeyError(entry_id)
+
+    def add(self, text, lang_code, priority=0, title=None, session_dir=None):
+        """テキストをキューに入れてエントリーを返す (合成は次の pump() から。優先度は大きいほど先)"""
+        entry = {
+            "id": self._next_id,
+            "title": title or text[:40],
+            "text_file": self._write_text(self._next_id, text) if text else None,
+            "lang": lang_code,
+            "priority": priority,
+            "state": JOB_QUEUED,
+            "session_dir": session_dir,
+            "done": 0,
+            "total": 0,
+            "error": None,
+            "added": datetime.now().isoformat(timespec="seconds"),
+        }
+        self._next_id += 1
+        self.entries.append(entry)
+        self._save()
+        return entry
+
+    def resume_session(self, session_dir, title, priority=0):
+        """途中で終わったセッションの続きをキューに入れる (言語などはマニフェストから)。すでにキューにあればNone"""
+        path = os.path.abspath(session_dir)
+        for entry in self.entries:
+            if entry["session_dir"] and os.path.abspath(entry["session_dir"]) == path:
+                return None
+        return self.add("", None, priority=priority, title=title, session_dir=session_dir)
+
+    def pause(self, entry_id):
+        entry = self.get(entry_id)
+        if entry["state"] not in (JOB_QUEUED, JOB_RUNNING):
+            return False
+        job = self._jobs.get(entry_id)
+        if job is not None:
+            job.pause()
+        entry["state"] = JOB_PAUSED
+        self._save()
+        return True
+
+    def resume(self, entry_id):
+        entry = self.get(entry_id)
+        if entry["state"] != JOB_PAUSED:
+            return False
+        job = self._jobs.get(entry_id)
+        if job is not None:
+            job.resume()
+        entry["state"] = JOB_RUNNING if job is not None or entry_id in self._starting else JOB_QUEUED
+        self._save()
+        return True
+
+    def cancel(self, entry_id):
+        entry = self.get(entry_id)
+        if entry["state"] in _FINISHED_STATES:
+            return False
+        job = self._jobs.pop(entry_id, None)
+        if job is not None:
+            job.cancel()
+        entry["state"] = JOB_CANCELLED
+        if entry_id not in self._starting: # 準備中なら読み終わってから _started で消す
+            self._discard_text(entry)
+        self._save()
+        return True
+
+    def set_priority(self, entry_id, priority):
+        entry = self.get(entry_id)
+        entry["priority"] = priority
+        job = self._jobs.get(entry_id)
+        if job is not None:
+            job.set_priority(priority)
+        self._save()
+
+    def clear_finished(self):
+        """完了・失敗・取り消しのエントリーを一覧から除く"""
+        for entry in self.entries:
+            if entry["state"] in _FINISHED_STATES and entry["id"] not in self._starting:
+                self._discard_text(entry)
+        self.entries = [
+            entry for entry in self.entries
+            if entry["state"] not in _FINISHED_STATES or entry["id"] in self._starting
+        ]
+        self._save()
+
+    def session_dirs(self):
+        """まだ終わっていないジョブのセッションフォルダ (ストレージ管理のスレッドからも呼ばれる)
+
+        合成中のものだけでなく、待機中・一時停止中で続きを合成するフォルダも含める。
+        """
+        dirs = [job.output_dir for job in list(self._jobs.values())]
+        dirs.extend(
+            entry["session_dir"] for entry in list(self.entries)
+            if entry["session_dir"] and entry["state"] not in _FINISHED_STATES
+        )
+        return tuple(dict.fromkeys(dirs))
+
+    def pump(self):
+        """終わったジョブを片付けて、空いた分だけ次のジョブを投入する。表示に変化があればTrueを返す
+
+        保存するのは状態が変わったときだけ (進み具合だけの変化では書かない)。
+        """
+        changed = progressed = False
+        for entry_id, future in list(self._starting.items()):
+            if future.done():
+                del self._starting[entry_id]
+                self._started(self.get(entry_id), future)
+                changed = True
+
+        for entry_id, job in list(self._jobs.items()):
+            entry = self.get(entry_id)
+            if entry["done"] != job.synthesized:
+                entry["done"] = job.synthesized
+                progressed = True
+            if not job.finished:
+                continue
+            del self._jobs[entry_id]
+            if job.error is not None:
+                entry["state"], entry["error"] = JOB_FAILED, str(job.error)
+            elif job.cancelled:
+                entry["state"] = JOB_CANCELLED
+            else:
+                entry["state"] = JOB_DONE
+                if self.on_finish is not None:
+                    self.on_finish(entry, job)
+            changed = True
+
+        active = sum(1 for job in self._jobs.values() if not job.paused) + len(self._starting)
+        waiting = sorted(
+            (entry for entry in self.entries if entry["state"] == JOB_QUEUED),
+            key=lambda entry: (-entry["priority"], entry["id"]),
+        )
+        for entry in waiting[:max(0, self.max_active - active)]:
+            # 準備が終わるまでは合成中として扱い、もう一度投入しない
+            self._starting[entry["id"]] = self._executor.submit(self.start, dict(entry))
+            entry["state"] = JOB_RUNNING
+            changed = True
+
+        if changed:
+            self._save()
+        return changed or progressed
+
+    def _started(self, entry, future):
+        # 準備中に一時停止・取り消し・優先度の変更をされていれば、ここで反映する
+        try:
+            job = future.result()
+        except Exception as e:
+            if entry["state"] != JOB_CANCELLED:
+                entry["state"], entry["error"] = JOB_FAILED, str(e)
+            if entry["state"] == JOB_CANCELLED:
+                self._discard_text(entry)
+            return
+        entry["session_dir"] = job.output_dir
+        entry["done"], entry["total"] = job.synthesized, job.total
+        self._discard_text(entry) # 続きはセッションフォルダのマニフェストから合成する
+        if entry["state"] == JOB_CANCELLED:
+            job.cancel()
+            return
+        self._jobs[entry["id"]] = job
+        job.set_priority(entry["priority"])
+        if entry["state"] == JOB_PAUSED:
+            job.pause()
+
+    def describe(self, entry):
+        """一覧に表示する1行"""
+        progress = f" {entry['done']}/{entry['total']}" if entry["total"] else ""
+        return (f"[{JOB_STATE_LABELS.get(entry['state'], entry['state'])}]{progress} "
+                f"(優先度 {entry['priority']}) {entry['title']}")
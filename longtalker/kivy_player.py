@@ -0,0 +1,166 @@
+import os
+import tempfile
+from collections import deque
+
+from kivy.core.audio import SoundLoader
+
+from longtalker.container import SegmentRange, read_segment
+
+
+class KivySoundScheduler:
+    """Soundの on_stop イベントで次のセグメントへ進む再生スケジューラー (Kivyのメインスレッド専用)
+
+    再生が終わるまでスレッドを sleep させる代わりに、再生中に次のファイルを SoundLoader.load で
+    読み込んでおき、on_stop を受けたらすぐに再生を始める。一時停止・再開・スキップもその場で効く。
+    PlaybackQueue と同じく enqueue(job, index, filepath) で受け取り、
+    on_start(job, index, filepath) / on_finish(job, index) を呼ぶ。
+    enqueue の position (秒) を指定すると、そのセグメントを途中から再生する。
+    SoundLoader はファイル名でしか読めないので、コンテナ内のセグメント (SegmentRange) は
+    そのセグメントだけを一時ファイルに書き出して読み込み、再生し終えたら削除する。
+    """
+
+    def __init__(self, on_start=None, on_finish=None):
+        self.on_start = on_start
+        self.on_finish = on_finish
+        self._pending = deque() # まだ読み込んでいない (job, index, filepath, position)
+        self._current = None # 再生中の (job, index, filepath, sound)
+        self._next = None # 読み込み済みの次のセグメント
+        self._paused_pos = None
+        self._halting = False # 自分でstop()したときの on_stop を無視するためのフラグ
+        self._start_positions = {} # 読み込んだSound -> 再生を始める位置 (秒)
+        self._temp_files = {} # 読み込んだSound -> 一時ファイル (SegmentRange の場合)
+
+    @property
+    def paused(self):
+        return self._paused_pos is not None
+
+    def enqueue(self, job, index, filepath, position=0.0):
+        self._pending.append((job, index, filepath, position))
+        if self._current is None and not self.paused:
+            self._play_next()
+        else:
+            self._preload()
+
+    def _load(self):
+        while self._pending:
+            job, index, filepath, position = self._pending.popleft()
+            if job.cancelled:
+                continue
+            path = self._local_path(filepath)
+            sound = SoundLoader.load(path)
+            if sound:
+                self._start_positions[sound] = position
+                if path != filepath:
+                    self._temp_files[sound] = path
+                return job, index, filepath, sound
+            if path != filepath:
+                os.remove(path)
+            print(f"Error: Could not load sound file {filepath} with Kivy SoundLoader.")
+        return None
+
+    def _local_path(self, filepath):
+        if not isinstance(filepath, SegmentRange):
+            return filepath
+        fd, path = tempfile.mkstemp(prefix="longtalker-", suffix=".mp3")
+        with os.fdopen(fd, "wb") as f:
+            f.write(read_segment(filepath))
+        return path
+
+    def _unload(self, sound):
+        sound.unload()
+        self._start_positions.pop(sound, None)
+        path = self._temp_files.pop(sound, None)
+        if path is not None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _preload(self):
+        if self._next is None:
+            self._next = self._load()
+
+    def _play_next(self):
+        entry, self._next = self._next or self._load(), None
+        while entry is not None and entry[0].cancelled:
+            self._unload(entry[3])
+            entry = self._load()
+        self._current = entry
+        if entry is None:
+            return
+        job, index, filepath, sound = entry
+        job.advance(index)
+        sound.bind(on_stop=self._on_sound_stop)
+        sound.play()
+        position = self._start_positions.pop(sound, 0.0)
+        if position:
+            sound.seek(position)
+        print(f"Played with Kivy SoundLoader: {filepath}")
+        if self.on_start:
+            self.on_start(job, index, filepath)
+        self._preload()
+
+    def _on_sound_stop(self, sound):
+        if self._halting or self._current is None or sound is not self._current[3]:
+            return
+        self._finish_current()
+        self._play_next()
+
+    def _finish_current(self):
+        job, index, _filepath, sound = self._current
+        self._current = None
+        sound.unbind(on_stop=self._on_sound_stop)
+        self._unload(sound)
+        if self.on_finish and not job.cancelled:
+            self.on_finish(job, index)
+
+    def _halt(self, sound):
+        self._halting = True
+        try:
+            sound.stop()
+        finally:
+            self._halting = False
+
+    def pause(self):
+        """再生中のセグメントを一時停止する。一時停止できたらTrue"""
+        if self._current is None or self.paused:
+            return False
+        sound = self._current[3]
+        self._paused_pos = sound.get_pos()
+        self._halt(sound)
+        return True
+
+    def resume(self):
+        """一時停止した位置から再生を再開する。再開できたらTrue"""
+        if not self.paused:
+            return False
+        position, self._paused_pos = self._paused_pos, None
+        if self._current is None:
+            self._play_next()
+            return True
+        sound = self._current[3]
+        sound.play()
+        sound.seek(position)
+        return True
+
+    def skip(self):
+        """再生中のセグメントを飛ばして次へ進む"""
+        self._paused_pos = None
+        if self._current is not None:
+            self._halt(self._current[3])
+            self._finish_current()
+        self._play_next()
+
+    def stop(self):
+        """キューを空にし、再生中と読み込み済みのセグメントも破棄する"""
+        self._pending.clear()
+        self._paused_pos = None
+        if self._next is not None:
+            self._unload(self._next[3])
+            self._next = None
+        if self._current is not None:
+            _job, _index, _filepath, sound = self._current
+            self._current = None
+            self._halt(sound)
+            sound.unbind(on_stop=self._on_sound_stop)
+            self._unload(sound)
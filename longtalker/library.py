@@ -0,0 +1,169 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from longtalker.container import CONTAINER_NAME
+from longtalker.manifest import read_manifest
+from longtalker.timing import TimingIndex
+
+LIBRARY_DB_NAME = ".library.sqlite3" # AUDIO_DIR_NAME 直下に置くライブラリのインデックス
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    name TEXT PRIMARY KEY,
+    title TEXT,
+    source_hash TEXT,
+    lang TEXT,
+    segments INTEGER,
+    duration REAL,
+    bytes INTEGER,
+    created TEXT,
+    last_played TEXT,
+    dir_mtime REAL
+);
+CREATE INDEX IF NOT EXISTS sessions_created ON sessions (created);
+CREATE INDEX IF NOT EXISTS sessions_last_played ON sessions (last_played);
+"""
+
+_COLUMNS = ("name", "title", "source_hash", "lang", "segments", "duration", "bytes", "created", "last_played")
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _scan_session(path):
+    """セッションフォルダのMP3の数と、MP3とセッションコンテナの合計サイズを数える"""
+    count = size = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith(".mp3"):
+                count += 1
+                size += entry.stat().st_size
+            elif entry.is_file() and entry.name == CONTAINER_NAME:
+                size += entry.stat().st_size
+    return count, size
+
+
+class AudioLibrary:
+    """AUDIO_DIR_NAME 以下のセッションを記録するSQLite (WALモード) のインデックス
+
+    セッションを作ったとき・合成し終えたとき・再生したときに1行ずつ更新するので、
+    一覧や検索でフォルダを走査する必要はない。アプリの外で追加・削除されたフォルダは
+    reconcile() でフォルダの一覧 (scandir) と突き合わせて反映する。複数のスレッドから使える。
+    """
+
+    def __init__(self, audio_dir):
+        self.audio_dir = audio_dir
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(audio_dir, LIBRARY_DB_NAME), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def _name(self, session_dir):
+        return os.path.relpath(session_dir, self.audio_dir)
+
+    def session_dir(self, name):
+        return os.path.join(self.audio_dir, name)
+
+    def _upsert(self, name, **values):
+        columns = ", ".join(values)
+        placeholders = ", ".join("?" for _ in values)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in values)
+        with self._lock, self._db:
+            self._db.execute(
+                f"INSERT INTO sessions (name, {columns}) VALUES (?, {placeholders}) "
+                f"ON CONFLICT(name) DO UPDATE SET {updates}",
+                (name, *values.values()),
+            )
+
+    def record_session(self, session_dir, manifest, title=""):
+        """作成したセッションをマニフェストの内容で登録する"""
+        self._upsert(
+            self._name(session_dir), title=title, source_hash=manifest.get("source_hash"),
+            lang=manifest.get("lang"), segments=len(manifest.get("segments", [])),
+            created=manifest.get("created") or _now(),
+        )
+
+    def refresh_session(self, session_dir):
+        """セッションフォルダのサイズと再生時間 (timing.json があれば) を読み直す"""
+        segments, size = _scan_session(session_dir)
+        timing = TimingIndex.load(session_dir)
+        manifest = read_manifest(session_dir) or {}
+        self._upsert(
+            self._name(session_dir), segments=len(manifest.get("segments", [])) or segments, bytes=size,
+            duration=timing.duration if timing else None, dir_mtime=os.stat(session_dir).st_mtime,
+        )
+
+    def mark_played(self, session_dir):
+        self._upsert(self._name(session_dir), last_played=_now())
+
+    def forget(self, session_dir):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM sessions WHERE name = ?", (self._name(session_dir),))
+
+    def reconcile(self):
+        """フォルダの一覧と突き合わせ、外で追加・変更されたセッションを登録し、消えたものを削除する
+
+        各フォルダの更新時刻を記録しておき、変わっていないフォルダの中は読まない。
+        キャッシュなど "." で始まるフォルダは対象外。追加・更新・削除した数を返す。
+        """
+        with self._lock:
+            known = dict(self._db.execute("SELECT name, dir_mtime FROM sessions").fetchall())
+        found = {}
+        with os.scandir(self.audio_dir) as it:
+            for entry in it:
+                if entry.is_dir() and not entry.name.startswith("."):
+                    found[entry.name] = entry.stat().st_mtime
+
+        changed = 0
+        for name, mtime in found.items():
+            if name in known and known[name] == mtime:
+                continue
+            path = self.session_dir(name)
+            if name not in known:
+                manifest = read_manifest(path) or {}
+                created = manifest.get("created") or datetime.fromtimestamp(mtime).isoformat(timespec="seconds")
+                self._upsert(
+                    name, title=name.rsplit("_", 2)[0], source_hash=manifest.get("source_hash"),
+                    lang=manifest.get("lang"), created=created,
+                )
+            self.refresh_session(path)
+            changed += 1
+
+        removed = [name for name in known if name not in found]
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM sessions WHERE name = ?", [(name,) for name in removed])
+        return changed + len(removed)
+
+    def list_sessions(self, query=None, limit=200):
+        """セッションを新しい順に返す。query があればタイトルとフォルダ名を部分一致で絞り込む"""
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM sessions"
+        params = []
+        if query:
+            sql += " WHERE title LIKE ? OR name LIKE ?"
+            params = [f"%{query}%", f"%{query}%"]
+        sql += " ORDER BY created DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return [dict(row) for row in self._db.execute(sql, params).fetchall()]
+
+    def total_bytes(self):
+        """記録されているセッションの合計サイズ (フォルダは走査しない)"""
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM sessions").fetchone()[0]
+
+    def least_recently_played(self):
+        """セッションを最後に再生した (一度も再生していなければ作成した) のが古い順に返す"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT name, bytes FROM sessions ORDER BY COALESCE(last_played, created) ASC"
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
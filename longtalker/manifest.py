@@ -0,0 +1,284 @@
+import os
+import re
+import json
+import time
+import difflib
+import hashlib
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+from longtalker.cache import cache_key, link_or_copy
+
+MANIFEST_NAME = "manifest.json" # セッションフォルダ内のマニフェストのファイル名
+LAST_SESSION_NAME = ".last_session" # 直前のセッションフォルダを記録するファイル (AUDIO_DIR_NAME 直下)
+JOURNAL_FLUSH_SECONDS = 1.0 # 合成の進み具合をマニフェストに書く間隔の下限 (強制終了で失うのはこの間の記録だけ)
+
+SEGMENT_PENDING = "pending"
+SEGMENT_DONE = "done"
+
+
+def session_folder_name(text, timestamp=None):
+    """セッションフォルダの名前 (テキストの先頭20文字 + 作成日時。ファイル名に使えない文字は _ にする)"""
+    timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
+    folder_name_prefix = text[:20].replace(' ', '_').replace('　', '_')
+    folder_name_prefix = re.sub(r'[\\/:*?"<>|]', '_', folder_name_prefix)
+    return f"{folder_name_prefix}_{timestamp}"
+
+
+def create_session_dir(audio_dir, text):
+    """新しいセッションフォルダを作ってパスを返す
+
+    同じ秒に同じ書き出しのテキストのフォルダがあれば (一括合成など) -2, -3 ... を付けて別のフォルダにする。
+    フォルダの作成で確かめるので、複数のプロセスから同時に呼んでも重ならない。
+    """
+    name = session_folder_name(text)
+    path = os.path.join(audio_dir, name)
+    suffix = 2
+    while True:
+        try:
+            os.makedirs(path)
+            return path
+        except FileExistsError:
+            path = os.path.join(audio_dir, f"{name}-{suffix}")
+            suffix += 1
+
+
+def segment_filenames(session_dir, count):
+    """セッションのセグメントのMP3ファイル名 (001.mp3, 002.mp3, ...)"""
+    return [os.path.join(session_dir, f"{i+1:03d}.mp3") for i in range(count)]
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_manifest(original_text, segments, lang_code, filenames, tld="com", slow=False, packing=False):
+    """セッションの内容 (セグメントごとのテキスト・ハッシュ・出力ファイル・合成の状態) を辞書にまとめる
+
+    セグメントのテキストと合成のパラメータも記録するので、途中で終わったセッションは
+    このマニフェストだけから続きを合成できる (load_resume_plan)。
+    """
+    return {
+        "version": 2,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "source_hash": text_hash(original_text),
+        "lang": lang_code,
+        "tld": tld,
+        "slow": slow,
+        "packing": packing,
+        "complete": False,
+        "segments": [
+            {
+                "index": i + 1,
+                "file": os.path.basename(filename),
+                "hash": cache_key(segment, lang_code, tld, slow),
+                "chars": len(segment),
+                "text": segment,
+                "status": SEGMENT_PENDING,
+            }
+            for i, (segment, filename) in enumerate(zip(segments, filenames))
+        ],
+    }
+
+
+def write_manifest(session_dir, manifest):
+    """マニフェストを一時ファイルに書いてから置き換える (途中で終了しても古いか新しいかのどちらかが残る)"""
+    path = os.path.join(session_dir, MANIFEST_NAME)
+    tmp = f"{path}.tmp{threading.get_ident()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class SessionJournal:
+    """セッションの合成の進み具合を、セグメントごとの状態とチェックサムとしてマニフェストに記録する
+
+    record() は合成し終えたセグメントのチェックサム (SHA-256) を計算して状態を done にする。
+    どのスレッドから呼んでもよい。書き込みは JOURNAL_FLUSH_SECONDS に1回までにまとめ、
+    flush() で残りを書く。すべてのセグメントが done になると manifest["complete"] を True にする。
+    取り消したジョブは flush(abandoned=True) で記録し、起動時に自動では再開しない。
+    done には前回のセッションから再利用したセグメントの番号を渡す (作成時にすぐ書き込む)。
+    reuse_unchanged_segments がチェックサムを引き継いだセグメントは、ファイルを読み直さない。
+    """
+
+    def __init__(self, session_dir, manifest, done=()):
+        self.session_dir = session_dir
+        self.manifest = manifest
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_write = 0.0
+        for index in done:
+            if self.manifest["segments"][index].get("status") != SEGMENT_DONE:
+                self._mark_done(index)
+        self.flush()
+
+    def _mark_done(self, index):
+        segment = self.manifest["segments"][index]
+        path = os.path.join(self.session_dir, segment["file"])
+        checksum, size = file_checksum(path), os.path.getsize(path)
+        with self._lock:
+            segment.update(status=SEGMENT_DONE, sha256=checksum, bytes=size)
+            self._dirty = True
+
+    def record(self, index):
+        self._mark_done(index)
+        if time.monotonic() - self._last_write >= JOURNAL_FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self, abandoned=False):
+        with self._lock:
+            if abandoned and not self.manifest.get("abandoned"):
+                self.manifest["abandoned"] = True
+                self._dirty = True
+            if not self._dirty and self._last_write:
+                return
+            segments = self.manifest["segments"]
+            self.manifest["complete"] = all(s.get("status") == SEGMENT_DONE for s in segments)
+            write_manifest(self.session_dir, self.manifest)
+            self._dirty = False
+            self._last_write = time.monotonic()
+
+
+ResumePlan = namedtuple("ResumePlan", ["manifest", "segments", "filenames", "done"])
+
+
+def load_resume_plan(session_dir):
+    """途中で終わったセッションの続きを合成するための ResumePlan を返す (続きを合成できなければNone)
+
+    done になっているセグメントはファイルのサイズとチェックサムを確かめ、一致したものだけを
+    完成済み (done) とする。書きかけのファイルや記録の無いファイルは合成し直す。
+    """
+    manifest = read_manifest(session_dir)
+    if not manifest or manifest.get("version", 1) < 2:
+        return None # テキストを記録していない古いマニフェスト
+    segments = [s["text"] for s in manifest["segments"]]
+    filenames = [os.path.join(session_dir, s["file"]) for s in manifest["segments"]]
+    done = set()
+    for i, (segment, path) in enumerate(zip(manifest["segments"], filenames)):
+        if segment.get("status") != SEGMENT_DONE:
+            continue
+        try:
+            if os.path.getsize(path) == segment.get("bytes") and file_checksum(path) == segment.get("sha256"):
+                done.add(i)
+                continue
+        except OSError:
+            pass
+        segment["status"] = SEGMENT_PENDING
+    manifest.pop("abandoned", None) # 取り消したセッションでも、続きを合成するなら再開の対象に戻す
+    return ResumePlan(manifest, segments, filenames, done)
+
+
+def find_incomplete_sessions(audio_dir):
+    """合成が途中で終わった (強制終了やエラーで止まった) セッションフォルダを、作成した順に返す
+
+    取り消したセッションと、"." で始まるフォルダは対象外。
+    """
+    found = []
+    with os.scandir(audio_dir) as it:
+        for entry in it:
+            if not entry.is_dir() or entry.name.startswith("."):
+                continue
+            manifest = read_manifest(entry.path)
+            if manifest and manifest.get("version", 1) >= 2 and not manifest.get("complete", True) \
+                    and not manifest.get("abandoned"):
+                found.append((manifest.get("created", ""), entry.path))
+    return [path for _created, path in sorted(found)]
+
+
+def read_manifest(session_dir):
+    """セッションフォルダのマニフェストを読む。無い・壊れている場合はNone"""
+    try:
+        with open(os.path.join(session_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def session_segment_files(session_dir):
+    """セッションのセグメントのMP3ファイルを再生順に返す (マニフェストが無ければファイル名順)"""
+    manifest = read_manifest(session_dir)
+    if manifest:
+        names = [s["file"] for s in manifest["segments"]]
+    else:
+        names = sorted(n for n in os.listdir(session_dir) if n.endswith(".mp3"))
+    return [os.path.join(session_dir, n) for n in names if os.path.exists(os.path.join(session_dir, n))]
+
+
+def remember_last_session(audio_dir, session_dir):
+    with open(os.path.join(audio_dir, LAST_SESSION_NAME), "w", encoding="utf-8") as f:
+        f.write(os.path.relpath(session_dir, audio_dir))
+
+
+def last_session_dir(audio_dir):
+    """直前に作成したセッションフォルダのパス。記録が無ければNone"""
+    try:
+        with open(os.path.join(audio_dir, LAST_SESSION_NAME), encoding="utf-8") as f:
+            name = f.read().strip()
+    except OSError:
+        return None
+    path = os.path.join(audio_dir, name)
+    return path if name and os.path.isdir(path) else None
+
+
+def reuse_unchanged_segments(previous_dir, manifest, filenames):
+    """前回のセッションと新しいセグメント列を比較し、変わっていないセグメントの音声を再利用する
+
+    セグメントのハッシュ列をdifflibで突き合わせ、一致したセグメントは前回のファイルを
+    新しいセッションにハードリンク (またはコピー) する。前回のセッションをコンテナにまとめてあれば、
+    コンテナの中の範囲を新しいセッションのファイルに書き出す。再利用したセグメントの番号 (0始まり) の集合を返す。
+    言語などのパラメータはハッシュに含まれるので、変わっていれば一致しない。
+    前回のマニフェストにチェックサムがあれば、manifest の該当セグメントに引き継いで done にする
+    (内容は前回のファイルと同じなので、数千セグメントでもファイルを読み直さない)。
+    """
+    from longtalker.container import packed_segments, read_segment # container は manifest を読み込むのでここで
+    previous = read_manifest(previous_dir) if previous_dir else None
+    if not previous:
+        return set()
+    try:
+        packed = packed_segments(previous_dir)
+    except (OSError, ValueError):
+        packed = {} # コンテナが読めなければ、まとめていないファイルだけを使う
+    old_segments = previous.get("segments", [])
+    old_hashes = [s["hash"] for s in old_segments]
+    new_hashes = [s["hash"] for s in manifest["segments"]]
+    matcher = difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+
+    reused = set()
+    for old_start, new_start, size in matcher.get_matching_blocks():
+        for offset in range(size):
+            old_segment = old_segments[old_start + offset]
+            if old_segment.get("status", SEGMENT_DONE) != SEGMENT_DONE:
+                continue # 前回のセッションで合成し終えていない (書きかけかもしれない) ファイル
+            source = packed.get(old_start + offset)
+            dest = filenames[new_start + offset]
+            try:
+                if source is not None:
+                    nbytes = source.length
+                    if nbytes > 0:
+                        with open(dest, "wb") as f:
+                            f.write(read_segment(source))
+                else:
+                    src = os.path.join(previous_dir, old_segment["file"])
+                    nbytes = os.path.getsize(src)
+                    if nbytes > 0:
+                        link_or_copy(src, dest)
+                if nbytes > 0:
+                    reused.add(new_start + offset)
+                    if old_segment.get("sha256") and old_segment.get("bytes") == nbytes:
+                        manifest["segments"][new_start + offset].update(
+                            status=SEGMENT_DONE, sha256=old_segment["sha256"], bytes=nbytes,
+                        )
+            except OSError:
+                pass # 前回のファイルが消えていれば合成し直す
+    return reused
@@ -0,0 +1,397 @@
+import threading
+from collections import deque
+
+from longtalker.container import SegmentRange
+
+_listener_class = None
+
+
+def _get_listener_class():
+    """MediaPlayerのリスナーを実装したpyjniusクラス (jniusはAndroidでだけ読み込む)"""
+    global _listener_class
+    if _listener_class is None:
+        from jnius import PythonJavaClass, java_method
+
+        class MediaPlayerListener(PythonJavaClass):
+            __javainterfaces__ = [
+                'android/media/MediaPlayer$OnPreparedListener',
+                'android/media/MediaPlayer$OnCompletionListener',
+                'android/media/MediaPlayer$OnErrorListener',
+            ]
+            __javacontext__ = 'app'
+
+            def __init__(self, owner):
+                super().__init__()
+                self.owner = owner
+
+            @java_method('(Landroid/media/MediaPlayer;)V')
+            def onPrepared(self, mp):
+                self.owner.on_prepared(self.owner)
+
+            @java_method('(Landroid/media/MediaPlayer;)V')
+            def onCompletion(self, mp):
+                self.owner.on_completion(self.owner)
+
+            @java_method('(Landroid/media/MediaPlayer;II)Z')
+            def onError(self, mp, what, extra):
+                print(f"Android MediaPlayer error: what={what} extra={extra}")
+                self.owner.on_error(self.owner)
+                return True
+
+        _listener_class = MediaPlayerListener
+    return _listener_class
+
+
+class AndroidMediaPlayer:
+    """android.media.MediaPlayer を pyjnius で包んだプレーヤー
+
+    MediaPlayerChain が使うプレーヤーのインターフェース:
+    prepare_async(filepath) (SegmentRange ならコンテナの範囲をそのまま読ませる), start(), pause(), seek_to(ms), reset(), set_next(player), release()。
+    準備完了・再生終了・エラーはコンストラクタで渡した関数に、プレーヤー自身を引数にして知らせる。
+    """
+
+    def __init__(self, on_prepared, on_completion, on_error):
+        from jnius import autoclass
+
+        self.on_prepared = on_prepared
+        self.on_completion = on_completion
+        self.on_error = on_error
+        self._audio_stream = autoclass('android.media.AudioManager').STREAM_MUSIC
+        self._FileInputStream = autoclass('java.io.FileInputStream')
+        self._player = autoclass('android.media.MediaPlayer')()
+        self._listener = _get_listener_class()(self) # Java側から参照される間は保持しておく
+        self._player.setOnPreparedListener(self._listener)
+        self._player.setOnCompletionListener(self._listener)
+        self._player.setOnErrorListener(self._listener)
+
+    def prepare_async(self, filepath):
+        self._player.setAudioStreamType(self._audio_stream)
+        if isinstance(filepath, SegmentRange):
+            # setDataSource(fd, offset, length) でコンテナの中のセグメントだけを再生する
+            stream = self._FileInputStream(filepath.path)
+            try:
+                self._player.setDataSource(stream.getFD(), filepath.offset, filepath.length)
+            finally:
+                stream.close() # MediaPlayerはfdを複製するので、呼び出しの後すぐに閉じてよい
+        else:
+            self._player.setDataSource(filepath)
+        self._player.prepareAsync()
+
+    def start(self):
+        self._player.start()
+
+    def pause(self):
+        self._player.pause()
+
+    def seek_to(self, ms):
+        self._player.seekTo(ms)
+
+    def reset(self):
+        self._player.reset()
+
+    def set_next(self, player):
+        self._player.setNextMediaPlayer(player._player if player is not None else None)
+
+    def release(self):
+        self._player.release()
+
+
+class FakeMediaPlayer:
+    """AndroidMediaPlayer と同じインターフェースを持つ、Linuxでの確認用のプレーヤー
+
+    prepare_async はその場で準備完了を知らせる。再生の終了は finish()、エラーは fail() で起こす。
+    set_next で次のプレーヤーが設定されていれば、MediaPlayerと同じくそちらの再生が自動で始まる。
+    check_chain() (python -m longtalker.mediaplayer) で MediaPlayerChain の動きを確かめられる。
+    """
+
+    def __init__(self, on_prepared, on_completion, on_error):
+        self.on_prepared = on_prepared
+        self.on_completion = on_completion
+        self.on_error = on_error
+        self.filepath = None
+        self.playing = False
+        self.position_ms = 0
+        self.next_player = None
+
+    def prepare_async(self, filepath):
+        self.filepath = filepath
+        self.on_prepared(self)
+
+    def start(self):
+        self.playing = True
+
+    def pause(self):
+        self.playing = False
+
+    def seek_to(self, ms):
+        self.position_ms = ms
+
+    def reset(self):
+        self.filepath = None
+        self.playing = False
+        self.position_ms = 0
+        self.next_player = None
+
+    def set_next(self, player):
+        self.next_player = player
+
+    def release(self):
+        self.reset()
+
+    def finish(self):
+        self.playing = False
+        if self.next_player is not None:
+            self.next_player.start()
+        self.on_completion(self)
+
+    def fail(self):
+        self.playing = False
+        self.on_error(self)
+
+
+class _Slot:
+    def __init__(self, player, job, index, filepath, position=0.0):
+        self.player = player
+        self.job = job
+        self.index = index
+        self.filepath = filepath
+        self.position = position # 再生を始める位置 (秒)
+        self.prepared = False
+        self.chained = False # 再生中のプレーヤーに setNextMediaPlayer でつないだか
+
+
+class MediaPlayerChain:
+    """2つのプレーヤーを使い回してセグメントを隙間なく連続再生する
+
+    再生中に次のファイルを prepareAsync で準備し、setNextMediaPlayer でつないでおくので、
+    セグメントの切り替えはプレーヤー側で行われる。終了は OnCompletionListener で受け取り、
+    isPlaying() のポーリングはしない。終わったプレーヤーは reset() して次の次の準備に使う。
+    KivySoundScheduler と同じ enqueue (position でセグメントの途中から) /pause/resume/skip/stop を持ち、
+    on_start(job, index, filepath) / on_finish(job, index) はプレーヤーのコールバックのスレッドから呼ばれる。
+    """
+
+    def __init__(self, player_factory, on_start=None, on_finish=None, pool_size=2):
+        self.player_factory = player_factory
+        self.on_start = on_start
+        self.on_finish = on_finish
+        self.pool_size = pool_size
+        self._lock = threading.RLock()
+        self._pending = deque()
+        self._idle = []
+        self._created = 0
+        self._current = None
+        self._next = None
+        self._paused = False
+
+    @property
+    def paused(self):
+        return self._paused
+
+    def enqueue(self, job, index, filepath, position=0.0):
+        with self._lock:
+            self._pending.append((job, index, filepath, position))
+            self._fill()
+
+    def _take_player(self):
+        if self._idle:
+            return self._idle.pop()
+        if self._created < self.pool_size:
+            self._created += 1
+            return self.player_factory(
+                on_prepared=self._on_prepared, on_completion=self._on_completion, on_error=self._on_error
+            )
+        return None
+
+    def _recycle(self, player):
+        player.reset()
+        self._idle.append(player)
+
+    def _fill(self):
+        """次に再生するセグメントが未準備なら、空いているプレーヤーで準備を始める"""
+        while self._next is None and self._pending:
+            job, index, filepath, position = self._pending[0]
+            if job.cancelled:
+                self._pending.popleft()
+                continue
+            player = self._take_player()
+            if player is None:
+                return
+            self._pending.popleft()
+            self._next = _Slot(player, job, index, filepath, position)
+            try:
+                player.prepare_async(filepath)
+            except Exception as e:
+                print(f"Error preparing {filepath} with Android MediaPlayer: {e}")
+                self._next = None
+                self._recycle(player)
+
+    def _start_next(self):
+        slot, self._next = self._next, None
+        self._current = slot
+        if not slot.chained:
+            if slot.position:
+                slot.player.seek_to(int(slot.position * 1000))
+            slot.player.start()
+        slot.job.advance(slot.index)
+        print(f"Played with Android MediaPlayer: {slot.filepath}")
+        if self.on_start:
+            self.on_start(slot.job, slot.index, slot.filepath)
+        self._fill()
+
+    def _on_prepared(self, player):
+        with self._lock:
+            slot = self._next
+            if slot is None or slot.player is not player:
+                return
+            slot.prepared = True
+            if self._current is None:
+                if not self._paused:
+                    self._start_next()
+            else:
+                self._current.player.set_next(player)
+                slot.chained = True
+
+    def _finish_current(self):
+        slot, self._current = self._current, None
+        self._recycle(slot.player)
+        if self.on_finish and not slot.job.cancelled:
+            self.on_finish(slot.job, slot.index)
+
+    def _on_completion(self, player):
+        with self._lock:
+            if self._current is None or self._current.player is not player:
+                return
+            chained = self._next is not None and self._next.chained
+            self._finish_current()
+            if chained or (self._next is not None and self._next.prepared and not self._paused):
+                self._start_next()
+            else:
+                self._fill()
+
+    def _on_error(self, player):
+        with self._lock:
+            if self._next is not None and self._next.player is player:
+                if self._current is not None and self._next.chained:
+                    self._current.player.set_next(None)
+                self._next = None
+                self._recycle(player)
+                self._fill()
+            elif self._current is not None and self._current.player is player:
+                self._on_completion(player)
+
+    def pause(self):
+        with self._lock:
+            if self._current is None or self._paused:
+                return False
+            self._current.player.pause()
+            self._paused = True
+            return True
+
+    def resume(self):
+        with self._lock:
+            if not self._paused:
+                return False
+            self._paused = False
+            if self._current is not None:
+                self._current.player.start()
+            elif self._next is not None and self._next.prepared:
+                self._start_next()
+            return True
+
+    def skip(self):
+        """再生中のセグメントを飛ばして次へ進む"""
+        with self._lock:
+            self._paused = False
+            if self._current is not None:
+                self._finish_current()
+            if self._next is not None:
+                self._next.chained = False
+                if self._next.prepared:
+                    self._start_next()
+            else:
+                self._fill()
+
+    def stop(self):
+        """キューを空にし、再生中と準備中のセグメントも破棄する"""
+        with self._lock:
+            self._pending.clear()
+            self._paused = False
+            for slot in (self._current, self._next):
+                if slot is not None:
+                    self._recycle(slot.player)
+            self._current = self._next = None
+
+
+class _CheckJob:
+    def __init__(self):
+        self.cancelled = False
+        self.advanced = []
+
+    def advance(self, index):
+        self.advanced.append(index)
+
+
+def check_chain():
+    """FakeMediaPlayer で MediaPlayerChain を動かし、連続再生の振る舞いを確かめる (失敗すると AssertionError)
+
+    - 再生中に次のセグメントを準備して setNextMediaPlayer でつなぎ、終了時にそちらへ引き継ぐ
+    - skip と、stop してから途中の位置で enqueue し直す (文のタップ) でつなぎ直す
+    - 再生中・準備中のエラーで次のセグメントに進む
+    """
+    players = []
+    started, finished = [], []
+
+    def factory(**callbacks):
+        player = FakeMediaPlayer(**callbacks)
+        players.append(player)
+        return player
+
+    chain = MediaPlayerChain(
+        factory, on_start=lambda job, index, filepath: started.append(index),
+        on_finish=lambda job, index: finished.append(index),
+    )
+    job = _CheckJob()
+
+    def current():
+        return chain._current.player
+
+    # 1つ目はすぐに再生し、2つ目は準備してつないでおく
+    for i in range(5):
+        chain.enqueue(job, i, f"{i + 1:03d}.mp3")
+    assert started == [0] and current().filepath == "001.mp3" and current().playing
+    assert chain._next.chained and current().next_player is chain._next.player
+    # 終了すると、つないでおいたプレーヤーが再生を引き継ぎ、空いたプレーヤーで次を準備する
+    first = current()
+    first.finish()
+    assert finished == [0] and started == [0, 1] and current().playing and current() is not first
+    assert chain._next.filepath == "003.mp3" and current().next_player is chain._next.player
+    assert len(players) == 2 # プレーヤーは2つを使い回す
+
+    # skip: つないでいた次のセグメントを直接再生し、その次をつなぎ直す
+    chain.skip()
+    assert finished == [0, 1] and started == [0, 1, 2] and current().filepath == "003.mp3" and current().playing
+    assert chain._next.filepath == "004.mp3" and current().next_player is chain._next.player
+
+    # シーク (文のタップ): 止めてから、そのセグメントの途中の位置で入れ直す
+    chain.stop()
+    assert chain._current is None and chain._next is None
+    chain.enqueue(job, 3, "004.mp3", position=2.5)
+    chain.enqueue(job, 4, "005.mp3")
+    assert started[-1] == 3 and current().position_ms == 2500 and current().playing
+    assert chain._next.filepath == "005.mp3" and current().next_player is chain._next.player
+
+    # 準備中のプレーヤーのエラー: つなぎを外して、そのセグメントは飛ばす
+    chain.enqueue(job, 5, "006.mp3")
+    chain._next.player.fail()
+    assert current().next_player is chain._next.player and chain._next.filepath == "006.mp3"
+    # 再生中のプレーヤーのエラー: 終了と同じく次のセグメントに進む
+    current().fail()
+    assert finished[-1] == 3 and started[-1] == 5 and current().filepath == "006.mp3"
+    current().finish()
+    assert finished[-1] == 5 and chain._current is None and chain._next is None
+    assert job.advanced == started
+    print("MediaPlayerChain: OK")
+
+
+if __name__ == "__main__":
+    check_chain()
@@ -0,0 +1,189 @@
+import os
+import struct
+import threading
+from array import array
+from collections import namedtuple
+
+from longtalker.container import open_segment, playable_segments
+
+# ビットレート (kbps)。[MPEG1かどうか][レイヤー] ごとの表 (インデックス0はフリーフォーマット、15は不正)
+_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+_VERSION_BITS = {3: "1", 2: "2", 0: "2.5"}
+
+FrameHeader = namedtuple("FrameHeader", [
+    "raw", "version", "layer", "bitrate", "sample_rate", "padding", "mono", "length", "samples",
+])
+
+
+def parse_frame_header(data):
+    """4バイトのMPEGオーディオフレームヘッダーを解析する。ヘッダーでなければNone"""
+    if len(data) < 4 or data[0] != 0xFF or data[1] & 0xE0 != 0xE0:
+        return None
+    version_bits = (data[1] >> 3) & 0x03
+    layer_bits = (data[1] >> 1) & 0x03
+    bitrate_index = data[2] >> 4
+    rate_index = (data[2] >> 2) & 0x03
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None # 予約値とフリーフォーマットは扱わない
+    mpeg1 = version_bits == 3
+    layer = 4 - layer_bits
+    bitrate = _BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version_bits][rate_index]
+    padding = (data[2] >> 1) & 0x01
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 2 or mpeg1:
+        samples = 1152
+        length = 144 * bitrate // sample_rate + padding
+    else:
+        samples = 576
+        length = 72 * bitrate // sample_rate + padding
+    return FrameHeader(
+        struct.unpack(">I", bytes(data[:4]))[0], _VERSION_BITS[version_bits], layer, bitrate,
+        sample_rate, padding, (data[3] >> 6) == 3, length, samples,
+    )
+
+
+def _side_info_size(header):
+    if header.version == "1":
+        return 17 if header.mono else 32
+    return 9 if header.mono else 17
+
+
+def is_info_frame(header, frame):
+    """Xing/Info/VBRIヘッダーを入れたフレーム (音声を含まない) かどうか"""
+    if header.layer != 3:
+        return False
+    offset = 4 + _side_info_size(header)
+    return frame[offset:offset + 4] in (b"Xing", b"Info") or frame[36:40] == b"VBRI"
+
+
+def _id3v2_size(data):
+    """ID3v2タグのヘッダー (10バイト) からタグ全体のサイズを求める"""
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def iter_frames(f, skip_info=True):
+    """ファイルから (FrameHeader, フレームのバイト列) を1フレームずつ順に返す
+
+    ID3v2タグ (先頭以外にあるものも)、末尾のID3v1タグ、フレームでないバイト列は読み飛ばす。
+    skip_info=True なら Xing/Info/VBRI フレームも返さない。
+    一度に読むのは1フレーム分だけなので、ファイルの大きさによらずメモリ使用量は一定。
+    """
+    end = f.seek(0, os.SEEK_END) # コンテナから読んだセグメント (BytesIO) でも使える
+    if end >= 128:
+        f.seek(end - 128)
+        if f.read(3) == b"TAG":
+            end -= 128
+    pos = 0
+    f.seek(0)
+    while pos + 4 <= end:
+        data = f.read(min(10, end - pos))
+        if data[:3] == b"ID3" and len(data) == 10:
+            pos += _id3v2_size(data)
+            f.seek(pos)
+            continue
+        header = parse_frame_header(data)
+        if header is None or pos + header.length > end:
+            pos += 1 # 次の同期ワードを探す
+            f.seek(pos)
+            continue
+        frame = data + f.read(header.length - len(data)) # フレームは最短でも10バイトより長い
+        pos += header.length
+        if skip_info and is_info_frame(header, frame):
+            continue
+        yield header, frame
+
+
+def _build_info_frame(header, frame_count, total_bytes, toc, vbr):
+    """結合後のファイルの先頭に置くXing (可変ビットレート) / Info (固定ビットレート) フレームを作る"""
+    side_info = _side_info_size(header)
+    needed = 4 + side_info + 4 + 4 + 4 + 4 + 100
+    mpeg1 = header.version == "1"
+    for bitrate_index, kbps in enumerate(_BITRATES[(mpeg1, 3)]):
+        if bitrate_index == 0:
+            continue
+        length = (144 if mpeg1 else 72) * kbps * 1000 // header.sample_rate
+        if length >= needed:
+            break
+    # 元のヘッダーからビットレート・パディング・CRCだけを入れ替える
+    raw = (header.raw & ~0x0000F200) | 0x00010000 | (bitrate_index << 12)
+    frame = bytearray(length)
+    frame[:4] = struct.pack(">I", raw)
+    offset = 4 + side_info
+    frame[offset:offset + 4] = b"Xing" if vbr else b"Info"
+    frame[offset + 4:offset + 16] = struct.pack(">III", 0x07, frame_count, total_bytes) # フレーム数・バイト数・目次あり
+    frame[offset + 16:offset + 116] = bytes(toc)
+    return bytes(frame)
+
+
+def concatenate_mp3(paths, dest):
+    """MP3ファイル (またはコンテナ内のセグメント) を再エンコードせずにフレーム単位でつなぎ、1つのMP3ファイルにする
+
+    各ファイルのID3タグとXing/Infoフレームを取り除き、結合後の全体に対するXing/Infoフレーム
+    (フレーム数、バイト数、シーク用の目次) を先頭に書く。フレームは1つずつコピーするので、
+    メモリに載るのは目次を作るための各フレームの位置 (1フレーム4バイト、1時間で約55万バイト) だけ。
+    位置は32ビットで持つ (Xingヘッダーのバイト数も32ビットなので、4GiBを超えるMP3は作れない)。
+    サンプリングレートやチャンネル数が異なるファイルは無劣化ではつなげないので ValueError にする。
+    結合したフレーム数・バイト数・秒数を辞書で返す。
+    """
+    tmp = f"{dest}.tmp{threading.get_ident()}"
+    try:
+        with open(tmp, "wb") as out:
+            stats = _write_concatenated(paths, out)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, dest)
+    return stats
+
+
+def _write_concatenated(paths, out):
+    offsets = array("I") # "L" はLP64で8バイトになる
+    first = None
+    bitrates = set()
+    duration = 0.0
+    for path in paths:
+        with open_segment(path) as f:
+            for header, frame in iter_frames(f):
+                if first is None:
+                    first = header
+                    out.write(_build_info_frame(header, 0, 0, [0] * 100, False)) # 後で書き直す
+                elif (header.version, header.layer, header.sample_rate, header.mono) != \
+                        (first.version, first.layer, first.sample_rate, first.mono):
+                    raise ValueError(f"{path}: 形式が異なるMP3は結合できません")
+                offsets.append(out.tell())
+                bitrates.add(header.bitrate)
+                duration += header.samples / header.sample_rate
+                out.write(frame)
+    if first is None:
+        raise ValueError("結合できるMP3フレームがありません")
+    total_bytes = out.tell()
+    frame_count = len(offsets)
+    toc = [
+        min(255, offsets[min(frame_count - 1, frame_count * i // 100)] * 256 // total_bytes)
+        for i in range(100)
+    ]
+    out.seek(0)
+    out.write(_build_info_frame(first, frame_count, total_bytes, toc, len(bitrates) > 1))
+    return {"frames": frame_count, "bytes": total_bytes, "duration": duration}
+
+
+def export_session(session_dir, dest=None):
+    """セッションのセグメントを1つのMP3に書き出す (既定ではセッションフォルダと同じ名前の .mp3)"""
+    dest = dest or os.path.normpath(session_dir) + ".mp3"
+    stats = concatenate_mp3(playable_segments(session_dir), dest)
+    print(f"書き出しました: {dest} ({stats['frames']} フレーム, {stats['duration']:.1f} 秒)")
+    return dest
@@ -0,0 +1,86 @@
+import os
+import queue
+import threading
+
+
+class FileListJob:
+    """合成済みのファイルを再生するときに、合成ジョブの代わりに再生キューへ渡すもの
+
+    SynthesisJob と同じく total / output_dir / cancelled / advance() / seek() / cancel() を持つ。
+    filenames にはコンテナ内のセグメント (SegmentRange) も入るので、output_dir は呼び出し側から渡せる。
+    """
+
+    def __init__(self, filenames, output_dir=None):
+        self.filenames = list(filenames)
+        self.total = len(self.filenames)
+        self.synthesized = self.total
+        if output_dir is None and self.filenames:
+            output_dir = os.path.dirname(self.filenames[0])
+        self.output_dir = output_dir
+        self.cancelled = False
+
+    def advance(self, index):
+        pass
+
+    def seek(self, index):
+        return [(i, self.filenames[i]) for i in range(index, self.total)]
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class PlaybackQueue:
+    """1本の常駐スレッドで、キューに入ったセグメントを順番に再生する
+
+    play_func(filepath, stop_event) は再生が終わるまでブロックし、
+    stop_event がセットされたら途中で再生を止める関数。
+    on_start(job, index, filepath) は再生開始時、on_finish(job, index) は再生終了時に
+    再生スレッドから呼ばれる (取り消されたジョブについては呼ばれない)。
+    """
+
+    def __init__(self, play_func, on_start=None, on_finish=None):
+        self.play_func = play_func
+        self.on_start = on_start
+        self.on_finish = on_finish
+        self.stop_event = threading.Event()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="longtalker-playback")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def enqueue(self, job, index, filepath):
+        self._queue.put((job, index, filepath))
+
+    def stop(self):
+        """キューを空にし、再生中のセグメントも止める"""
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        self.stop_event.set()
+
+    def skip(self):
+        """再生中のセグメントだけを止め、次のセグメントへ進む"""
+        self.stop_event.set()
+
+    def pause(self):
+        # play_func は再生が終わるまでブロックするので、途中で一時停止はできない
+        return False
+
+    def resume(self):
+        return False
+
+    def _run(self):
+        while True:
+            job, index, filepath = self._queue.get()
+            self.stop_event.clear()
+            if job.cancelled:
+                continue
+            # 再生位置を合成側に知らせ、先の合成を進めてもらう
+            job.advance(index)
+            if self.on_start:
+                self.on_start(job, index, filepath)
+            self.play_func(filepath, self.stop_event)
+            if self.on_finish and not job.cancelled:
+                self.on_finish(job, index)
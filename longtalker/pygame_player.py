@@ -0,0 +1,134 @@
+from collections import deque
+
+import pygame
+
+from longtalker.container import SegmentRange, open_segment
+
+MUSIC_END_EVENT = pygame.USEREVENT + 1 # mixer.music の再生が終わったときに送られるイベント
+
+
+def _music_source(filepath):
+    # コンテナ内のセグメント (SegmentRange) はその範囲だけを読み、ファイルオブジェクトとして渡す
+    if isinstance(filepath, SegmentRange):
+        return open_segment(filepath), "mp3"
+    return filepath, ""
+
+
+class PygameMusicPlayer:
+    """pygame.mixer.music でセグメントをストリーミング再生する (Tkinterのメインスレッド専用)
+
+    mixer.Sound のようにファイル全体をPCMに展開せず、少しずつデコードしながら再生するので、
+    セグメントが長くてもメモリ使用量は増えない。再生中に次のファイルを mixer.music.queue で
+    予約しておくと、切り替えはSDL_mixer側で行われるので隙間ができない。
+    再生の終了は MUSIC_END_EVENT で受け取る。pump() を root.after などで定期的に呼ぶこと。
+    KivySoundScheduler と同じ enqueue/pause/resume/skip/stop を持つ。
+    """
+
+    def __init__(self, on_start=None, on_finish=None):
+        self.on_start = on_start
+        self.on_finish = on_finish
+        if not pygame.display.get_init():
+            pygame.display.init() # イベントを受け取るために必要 (ウィンドウは開かない)
+        pygame.mixer.music.set_endevent(MUSIC_END_EVENT)
+        self._pending = deque()
+        self._current = None # 再生中の (job, index, filepath)
+        self._queued = None # mixer.music.queue で予約した (job, index, filepath)
+        self._paused = False
+
+    @property
+    def paused(self):
+        return self._paused
+
+    def enqueue(self, job, index, filepath):
+        self._pending.append((job, index, filepath))
+        self._fill()
+
+    def _pop_pending(self):
+        while self._pending:
+            entry = self._pending.popleft()
+            if not entry[0].cancelled:
+                return entry
+        return None
+
+    def _fill(self):
+        if self._current is None and not self._paused:
+            entry = self._pop_pending()
+            if entry is None:
+                return
+            pygame.mixer.music.load(*_music_source(entry[2]))
+            pygame.mixer.music.play()
+            self._started(entry)
+        if self._current is not None and self._queued is None:
+            self._queued = self._pop_pending()
+            if self._queued is not None:
+                pygame.mixer.music.queue(*_music_source(self._queued[2]))
+
+    def _started(self, entry):
+        self._current = entry
+        job, index, filepath = entry
+        job.advance(index)
+        print(f"Pygameで再生 (ストリーミング): {filepath}")
+        if self.on_start:
+            self.on_start(job, index, filepath)
+
+    def _finish_current(self):
+        entry, self._current = self._current, None
+        job, index = entry[0], entry[1]
+        if self.on_finish and not job.cancelled:
+            self.on_finish(job, index)
+
+    def pump(self):
+        """終了イベントを処理し、次のセグメントを予約する"""
+        events = pygame.event.get(MUSIC_END_EVENT)
+        for n, _event in enumerate(events, 1):
+            if self._current is None:
+                continue
+            self._finish_current()
+            entry, self._queued = self._queued, None
+            if entry is None:
+                continue
+            if n < len(events) or pygame.mixer.music.get_busy():
+                self._started(entry) # 予約したファイルの再生がすでに始まっている (または終わっている)
+            else:
+                self._pending.appendleft(entry) # 予約が間に合わなかったので読み込み直す
+        self._fill()
+
+    def _halt(self):
+        """予約を含めて再生を止め、止めたことで送られる終了イベントを捨てる"""
+        pygame.mixer.music.stop()
+        pygame.mixer.music.unload()
+        pygame.event.clear(MUSIC_END_EVENT)
+        if self._queued is not None:
+            self._pending.appendleft(self._queued)
+            self._queued = None
+
+    def pause(self):
+        if self._current is None or self._paused:
+            return False
+        pygame.mixer.music.pause()
+        self._paused = True
+        return True
+
+    def resume(self):
+        if not self._paused:
+            return False
+        self._paused = False
+        if self._current is not None:
+            pygame.mixer.music.unpause()
+        self._fill()
+        return True
+
+    def skip(self):
+        """再生中のセグメントを飛ばして次へ進む"""
+        self._paused = False
+        if self._current is not None:
+            self._halt()
+            self._finish_current()
+        self._fill()
+
+    def stop(self):
+        """キューを空にし、再生中と予約済みのセグメントも破棄する"""
+        self._halt()
+        self._pending.clear()
+        self._current = None
+        self._paused = False
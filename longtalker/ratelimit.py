@@ -0,0 +1,140 @@
+import time
+import random
+import asyncio
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+from gtts.tts import gTTSError
+
+DEFAULT_MAX_RETRIES = 5 # 1つのセグメントを再試行する最大回数
+MAX_BACKOFF_SECONDS = 60.0
+
+
+def parse_retry_after(value):
+    """Retry-Afterヘッダー (秒数またはHTTP日付) を待ち秒数に変換する。解釈できなければNone"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(error):
+    """合成エラーを (再試行するか, 混雑による失敗か, Retry-Afterの秒数) に分類する
+
+    429と5xxは混雑とみなして同時実行数を下げる。接続エラーは同時実行数を変えずに再試行する。
+    それ以外 (403や言語の誤りなど) は再試行しても直らないのでそのまま失敗にする。
+    """
+    if not isinstance(error, gTTSError):
+        return False, False, None
+    response = error.rsp
+    if response is None:
+        return True, False, None
+    status = response.status_code
+    if status == 429 or status >= 500:
+        return True, True, parse_retry_after(response.headers.get("Retry-After"))
+    return False, False, None
+
+
+def backoff_delay(attempt, retry_after=None):
+    """attempt回目の再試行までの待ち時間 (指数バックオフ + ゆらぎ、Retry-Afterがあればそれ以上)"""
+    delay = min(MAX_BACKOFF_SECONDS, 0.5 * (2 ** (attempt - 1))) * random.uniform(0.5, 1.5)
+    return max(delay, retry_after or 0.0)
+
+
+class AdaptiveLimiter:
+    """合成リクエストの同時実行数を、応答に合わせて増減させるコントローラー (AIMD)
+
+    応答時間が安定している間は同時実行数を少しずつ増やし (加算増加)、
+    429/5xx を受けたら半分に減らす (乗算減少)。Retry-After を受けたら、その時刻まで新しい
+    リクエストを開始しない。asyncioのループ上でだけ使う (acquire/release はスレッドセーフではない)。
+    """
+
+    def __init__(self, maximum, initial=None, minimum=1, adaptive=True,
+                 decrease_factor=0.5, latency_tolerance=2.0):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.adaptive = adaptive
+        if initial is None:
+            initial = min(self.maximum, 2) if adaptive else self.maximum
+        self.limit = float(max(self.minimum, min(initial, self.maximum)))
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self._baseline_latency = None
+        self._completions = deque() # 直近の完了時刻 (実効レートの計算用)
+        self._changed = asyncio.Event()
+
+    async def acquire(self):
+        while True:
+            wait = self.blocked_until - time.monotonic()
+            if wait <= 0 and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), wait if wait > 0 else None)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, latency=None, throttled=False, retry_after=None):
+        """1件の実行が終わったことを知らせる。latency は成功時の所要秒数"""
+        now = time.monotonic()
+        self.in_flight -= 1
+        self.requests += 1
+        self._completions.append(now)
+        if throttled:
+            self.throttled += 1
+            if self.adaptive:
+                self.limit = max(self.minimum, self.limit * self.decrease_factor)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+        elif latency is not None:
+            self._on_success(latency)
+        self._changed.set()
+
+    def give_back(self):
+        """acquire したが使わなかった枠を返す (リクエスト数には数えない)"""
+        self.in_flight -= 1
+        self._changed.set()
+
+    def _on_success(self, latency):
+        baseline = self._baseline_latency
+        self._baseline_latency = latency if baseline is None else min(latency, baseline * 0.9 + latency * 0.1)
+        if self.adaptive and latency <= self._baseline_latency * self.latency_tolerance:
+            # 同時実行数ぶん成功するごとにおよそ1増える
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def record_retry(self):
+        self.retries += 1
+
+    def request_rate(self, window=30.0):
+        """直近window秒間の実効リクエストレート (件/秒)"""
+        now = time.monotonic()
+        while self._completions and self._completions[0] < now - window:
+            self._completions.popleft()
+        return len(self._completions) / window
+
+    def stats(self):
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "rate": round(self.request_rate(), 2),
+        }
+
+    def describe(self):
+        """ステータス表示用の短い文字列"""
+        s = self.stats()
+        return f"同時実行 {s['limit']} / 再試行 {s['retries']} / {s['rate']} 件/秒"
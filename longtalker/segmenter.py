@@ -0,0 +1,193 @@
+import re
+from functools import lru_cache
+
+MAX_CHARS_PER_AUDIO = 300
+GTTS_MAX_CHARS = 100 # gTTSが1リクエストで送る最大文字数 (gTTS.GOOGLE_TTS_MAX_CHARS)
+
+SEGMENT_MODE_SENTENCE = "sentence" # 従来どおり「。」区切りで MAX_CHARS_PER_AUDIO まで詰める
+SEGMENT_MODE_GTTS = "gtts" # gTTSの100文字リクエストに合わせて詰め、リクエスト数を最小にする
+
+_SENTENCE_END_RE = re.compile(r'。')
+_SENTENCE_SPAN_END_RE = re.compile(r'[。！？!?]+[」』）)]*|\.(?=\s|$)') # 文の終わり (英文のピリオドは後ろが空白のときだけ)
+
+
+def japanese_quotes():
+    """「の前と」の後で区切る (gTTSの区切り規則に無い日本語のかぎ括弧)"""
+    return re.compile(r"(?=「)|」")
+
+
+@lru_cache(maxsize=None)
+def _boundary_re():
+    """gTTSの既定の区切り規則 (トーン記号、ピリオド/カンマ、コロン、その他の句読点。。、！？を含む) + かぎ括弧
+
+    gTTSの読み込みは重いので、起動時ではなく最初に使うときに組み立てる。
+    """
+    from gtts.tokenizer import Tokenizer, tokenizer_cases
+    return Tokenizer([
+        tokenizer_cases.tone_marks,
+        tokenizer_cases.period_comma,
+        tokenizer_cases.colon,
+        tokenizer_cases.other_punctuation,
+        japanese_quotes,
+    ]).total_regex
+
+
+def _iter_sentences(text):
+    """「。」で区切った文を、前後の空白を除いて「。」を付けた形で順に返す (空の文は飛ばす)
+
+    re.split(r'(。)', text) と同じ区切り方を、分割結果のリストを作らずに行う。
+    """
+    pos = 0
+    for match in _SENTENCE_END_RE.finditer(text):
+        sentence = text[pos:match.start()].strip() + match.group()
+        pos = match.end()
+        yield sentence # 「。」が付くので空にはならない
+    sentence = text[pos:].strip()
+    if sentence:
+        yield sentence
+
+
+def iter_sentence_spans(text):
+    """テキスト中の文の (start, end) を順に返す (前後の空白は含めない、空の文は飛ばす)"""
+    pos = 0
+    for match in _SENTENCE_SPAN_END_RE.finditer(text):
+        yield from _strip_span(text, pos, match.end())
+        pos = match.end()
+    yield from _strip_span(text, pos, len(text))
+
+
+def _strip_span(text, start, end):
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    if start < end:
+        yield start, end
+
+
+def _iter_hard_split(segment, max_chars):
+    """max_charsを超えるセグメントを、なるべく空白の位置で max_chars 以下に切る
+
+    残りの文字列をコピーし直す代わりに、位置 (pos) を進めて1回の走査で切り出す。
+    """
+    pos = 0
+    end = len(segment)
+    while end - pos > max_chars:
+        split_point = max_chars
+        last_space_index = segment.rfind(' ', pos, pos + max_chars)
+        if last_space_index != -1 and last_space_index - pos > max_chars * 0.8:
+            split_point = last_space_index - pos
+        yield segment[pos:pos + split_point].strip()
+        pos += split_point
+        while pos < end and segment[pos].isspace():
+            pos += 1
+    if pos < end:
+        yield segment[pos:end]
+
+
+def iter_segments(text, max_chars=MAX_CHARS_PER_AUDIO):
+    """テキストを読み上げ用のセグメントに分けて順に返すジェネレーター
+
+    文 (「。」区切り) を max_chars 以内に詰め、それでも長いものは空白の位置などで切る。
+    結果は従来の _split_long_text と同じになる。入力の長さに比例する時間で動き、
+    セグメントは必要になった分だけ作られる。
+    """
+    parts = []
+    length = 0
+    for sentence in _iter_sentences(text):
+        if length + len(sentence) <= max_chars:
+            parts.append(sentence)
+            length += len(sentence)
+            continue
+        if parts:
+            yield from _iter_hard_split("".join(parts).strip(), max_chars)
+        parts = [sentence]
+        length = len(sentence)
+    if parts:
+        yield from _iter_hard_split("".join(parts).strip(), max_chars)
+
+
+def split_long_text(text, max_chars=MAX_CHARS_PER_AUDIO, mode=SEGMENT_MODE_SENTENCE):
+    """セグメント分割の結果をリストで返す (mode は SEGMENT_MODE_SENTENCE か SEGMENT_MODE_GTTS)"""
+    return list(iter_segments_for_mode(text, max_chars, mode))
+
+
+def _iter_unit_spans(text):
+    """gTTSが区切る位置でテキストを切った (start, end) を順に返す (区切りの文字は前の単位に含める)"""
+    pos = 0
+    for match in _boundary_re().finditer(text):
+        if match.end() > pos:
+            yield pos, match.end()
+            pos = match.end()
+    if pos < len(text):
+        yield pos, len(text)
+
+
+def _iter_chunk_spans(text, limit=GTTS_MAX_CHARS):
+    """区切りの単位を limit 文字以内に詰めたチャンクの (start, end) を順に返す
+
+    連続した単位を貪欲に詰めるのが、区切り位置を守ったままチャンク数を最小にする詰め方になる。
+    1つで limit を超える単位は、gTTSの _minimize と同じく空白の位置 (無ければ limit) で切る。
+    """
+    start = end = None
+    for unit_start, unit_end in _iter_unit_spans(text):
+        if start is not None and unit_end - start <= limit:
+            end = unit_end
+            continue
+        if start is not None:
+            yield start, end
+        start, end = unit_start, unit_end
+        while end - start > limit:
+            cut = text.rfind(" ", start + 1, start + limit)
+            cut = cut if cut != -1 else start + limit
+            yield start, cut
+            start = cut
+    if start is not None:
+        yield start, end
+
+
+def pack_for_gtts(text, limit=GTTS_MAX_CHARS):
+    """gTTSの tokenizer_func として使うチャンク分割 (区切りを守って limit 文字以内に詰める)"""
+    return [text[start:end] for start, end in _iter_chunk_spans(text, limit)]
+
+
+def _iter_gtts_segments(text, max_chars):
+    start = end = None
+    for chunk_start, chunk_end in _iter_chunk_spans(text):
+        if start is not None and chunk_end - start <= max_chars:
+            end = chunk_end
+            continue
+        if start is not None:
+            segment = text[start:end].strip()
+            if segment:
+                yield segment
+        start, end = chunk_start, chunk_end
+    if start is not None:
+        segment = text[start:end].strip()
+        if segment:
+            yield segment
+
+
+def iter_segments_for_mode(text, max_chars=MAX_CHARS_PER_AUDIO, mode=SEGMENT_MODE_SENTENCE):
+    """mode に応じたセグメント分割 (SEGMENT_MODE_GTTS ではチャンク境界でだけ切る)"""
+    if mode == SEGMENT_MODE_GTTS:
+        return _iter_gtts_segments(text, max_chars)
+    return iter_segments(text, max_chars)
+
+
+def predict_request_count(segments, lang_code, packing=False, batch_size=1):
+    """セグメントを合成するときに送るHTTPリクエストの数を、送る前に数える
+
+    gTTS自身の前処理と分割 (_tokenize) をそのまま使うので、100文字チャンクの数は実際の数と一致する。
+    packing=True なら pack_for_gtts を tokenizer_func に使った場合の数になる。
+    batch_size には BatchedTransport の batch_size を渡す (セグメントごとにチャンクを batch_size 個ずつ
+    1リクエストにまとめるので、その数を数える。1ならチャンクの数)。
+    """
+    from gtts import gTTS
+
+    kwargs = {"tokenizer_func": pack_for_gtts} if packing else {}
+    total = 0
+    for segment in segments:
+        tts = gTTS(text=segment, lang=lang_code, lang_check=False, **kwargs)
+        total += -(-len(tts._tokenize(segment)) // max(1, batch_size))
+    return total
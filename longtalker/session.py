@@ -0,0 +1,166 @@
+"""Kivy版とTkinter版に共通のセッションの準備・合成キュー・後処理
+
+UIに依存しない部分 (テキストの分割、セッションフォルダとマニフェストの作成、ライブラリ・容量管理・
+合成キューのつなぎ込み、合成後の後処理) をここにまとめ、どちらのアプリも SessionManager を使う。
+"""
+import os
+import threading
+
+from longtalker.container import pack_session
+from longtalker.jobqueue import JobQueue
+from longtalker.library import AudioLibrary
+from longtalker.manifest import (
+    SessionJournal, build_manifest, create_session_dir, find_incomplete_sessions, last_session_dir,
+    load_resume_plan, remember_last_session, reuse_unchanged_segments, segment_filenames,
+)
+from longtalker.mp3 import export_session
+from longtalker.segmenter import MAX_CHARS_PER_AUDIO, SEGMENT_MODE_GTTS, SEGMENT_MODE_SENTENCE, split_long_text
+from longtalker.storage import DEFAULT_STORAGE_MAX_BYTES, StorageManager
+from longtalker.timing import build_timing_index, write_timing_index
+
+
+class SessionManager:
+    """セッションの作成から後処理までと、ライブラリ・容量管理・合成キューをまとめて持つ
+
+    get_engine() は SynthesisEngine を返す関数 (Kivy版はエンジンを最初に使うときに作るので関数で渡す)、
+    current_job() は再生中のジョブ (無ければNone) を返す関数で、どちらもアプリ側が渡す。
+    on_queued_job_finished(entry, job) はキューのジョブの合成が終わって後処理を始めたあとに
+    UIのスレッドで呼ばれる (完了の表示などに使う)。
+    prepare() と reconcile() はUIのスレッド以外から、resume_incomplete_sessions() はUIのスレッドから呼ぶ。
+    """
+
+    def __init__(self, audio_dir, get_engine, current_job, max_chars=MAX_CHARS_PER_AUDIO, mode=SEGMENT_MODE_SENTENCE,
+                 storage_max_bytes=DEFAULT_STORAGE_MAX_BYTES, queue_max_active=2, export_single_mp3=False,
+                 on_queued_job_finished=None):
+        self.audio_dir = audio_dir
+        self.get_engine = get_engine
+        self.current_job = current_job
+        self.max_chars = max_chars
+        self.mode = mode
+        self.export_single_mp3 = export_single_mp3
+        self.on_queued_job_finished = on_queued_job_finished
+        os.makedirs(audio_dir, exist_ok=True)
+        # 作成したセッションの一覧 (起動時にアプリの外で追加・削除されたフォルダも反映する)
+        self.library = AudioLibrary(audio_dir)
+        # 合計サイズが storage_max_bytes を超えたら、再生していない古いセッションから削除する
+        self.storage = StorageManager(self.library, storage_max_bytes, in_use=self.sessions_in_use)
+        # 合成キュー (前回の終了時に残っていたジョブも続きから合成する)
+        self.job_queue = JobQueue(
+            audio_dir, start=self._start_queued_job, on_finish=self._queued_job_finished, max_active=queue_max_active,
+        )
+
+    @property
+    def packing(self):
+        """セグメントを gTTS の100文字リクエストに合わせて詰めているか"""
+        return self.mode == SEGMENT_MODE_GTTS
+
+    def split(self, text):
+        return split_long_text(text, self.max_chars, mode=self.mode)
+
+    def prepare(self, original_text, lang_code):
+        """テキストを分割し、セッションフォルダとマニフェストを作る (UIのスレッド以外から呼ぶ)
+
+        (セグメント, ファイル名, 前回から再利用したセグメントの番号, SessionJournal) を返す。
+        分割できなければセグメントは空。
+        """
+        segments = self.split(original_text)
+        if not segments:
+            return [], [], set(), None
+
+        # 音声ファイルを保存するフォルダの準備
+        session_dir = create_session_dir(self.audio_dir, original_text)
+        filenames = segment_filenames(session_dir, len(segments))
+
+        # 前回のセッションから変わっていないセグメントは音声を使い回し、変わった分だけ合成する
+        manifest = build_manifest(original_text, segments, lang_code, filenames, packing=self.packing)
+        reused = reuse_unchanged_segments(last_session_dir(self.audio_dir), manifest, filenames)
+        # 合成し終えたセグメントはマニフェストに記録し、途中で終了しても続きから合成できるようにする
+        journal = SessionJournal(session_dir, manifest, done=reused)
+        remember_last_session(self.audio_dir, session_dir)
+        self.library.record_session(session_dir, manifest, title=original_text[:40])
+        return segments, filenames, reused, journal
+
+    def sessions_in_use(self):
+        """再生中・合成中のセッションフォルダ (ストレージ管理のスレッドから呼ばれ、これらは削除しない)"""
+        job = self.current_job()
+        return ((job.output_dir,) if job is not None else ()) + self.job_queue.session_dirs()
+
+    def in_library(self, folder_path):
+        """audio_dir 直下のセッションフォルダか (フォルダから再生では外のフォルダも選べる)"""
+        parent = os.path.dirname(os.path.abspath(folder_path))
+        return parent == os.path.abspath(self.audio_dir)
+
+    def reconcile(self):
+        """ライブラリを実際のフォルダと突き合わせ、途中で終わったセッションフォルダのリストを返す"""
+        self.library.reconcile()
+        self.storage.request_eviction()
+        return find_incomplete_sessions(self.audio_dir)
+
+    def resume_incomplete_sessions(self, session_dirs):
+        """強制終了やエラーで合成が途中で終わったセッションを合成キューに入れ、入れた数を返す"""
+        in_use = {os.path.abspath(path) for path in self.sessions_in_use()}
+        resumed = 0
+        for session_dir in session_dirs:
+            if os.path.abspath(session_dir) in in_use:
+                continue
+            title = os.path.basename(session_dir).rsplit("_", 2)[0]
+            if self.job_queue.resume_session(session_dir, title) is not None:
+                resumed += 1
+        return resumed
+
+    def _start_queued_job(self, entry):
+        # 合成キューのスレッドで呼ばれる (UIには触らない)
+        session_dir = entry["session_dir"]
+        if session_dir:
+            # 作りかけのセッション: 記録が正しいセグメントは飛ばし、残りだけを合成する
+            plan = load_resume_plan(session_dir) if os.path.isdir(session_dir) else None
+            if plan is None:
+                raise ValueError(f"'{session_dir}' の続きを合成できません")
+            manifest = plan.manifest
+            return self.get_engine().submit(
+                plan.segments, manifest["lang"], plan.filenames, lookahead=None, done=plan.done,
+                packing=manifest.get("packing", False), priority=entry["priority"],
+                journal=SessionJournal(session_dir, manifest),
+            )
+        segments, filenames, reused, journal = self.prepare(self.job_queue.read_text(entry), entry["lang"])
+        if not segments:
+            raise ValueError("分割可能なテキストが見つかりません")
+        return self.get_engine().submit(
+            segments, entry["lang"], filenames, lookahead=None, done=reused,
+            packing=self.packing, priority=entry["priority"], journal=journal,
+        )
+
+    def _queued_job_finished(self, entry, job):
+        self.start_finalize_thread(job)
+        if self.on_queued_job_finished is not None:
+            self.on_queued_job_finished(entry, job)
+
+    def start_finalize_thread(self, job):
+        """合成が終わったセッションの後処理を、再生を妨げないように別スレッドで行う"""
+        thread = threading.Thread(target=self.finalize, args=(job,))
+        thread.daemon = True
+        thread.start()
+
+    def finalize(self, job):
+        """再生時間インデックスを書き、export_single_mp3 なら1つのMP3にも書き出す"""
+        try:
+            write_timing_index(job.output_dir, build_timing_index(job.segments, job.filenames))
+            self.library.refresh_session(job.output_dir)
+            self.storage.request_eviction()
+            if self.export_single_mp3:
+                export_session(job.output_dir)
+        except (OSError, ValueError) as e:
+            print(f"セッションの後処理に失敗しました: {e}")
+
+    def start_pack_thread(self, session_dir):
+        """再生し終えたセッションのMP3を、別スレッドで1つのコンテナにまとめる"""
+        thread = threading.Thread(target=self.pack, args=(session_dir,))
+        thread.daemon = True
+        thread.start()
+
+    def pack(self, session_dir):
+        try:
+            pack_session(session_dir)
+            self.library.refresh_session(session_dir)
+        except (OSError, ValueError) as e:
+            print(f"セッションコンテナの作成に失敗しました: {e}")
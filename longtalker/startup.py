@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+import threading
+from contextlib import contextmanager
+from importlib.abc import MetaPathFinder
+
+PROFILE_STARTUP_ENV = "LONGTALKER_PROFILE_STARTUP" # 1 にすると起動時のimportと初期化の時間を記録して表示する
+
+
+class _ImportTimer(MetaPathFinder):
+    """import するモジュールごとの時間を記録する (python -X importtime と同じ self / cumulative)
+
+    sys.meta_path の先頭に入り、他のファインダーが見つけたモジュールのローダーの
+    exec_module を包んで時間を測る。入れ子のimportの時間は親の cumulative に含まれる。
+    """
+
+    def __init__(self):
+        self.records = [] # (深さ, モジュール名, self [us], cumulative [us]) を終わった順に
+        self._local = threading.local()
+
+    def find_spec(self, fullname, path=None, target=None):
+        if getattr(self._local, "finding", False):
+            return None
+        self._local.finding = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._local.finding = False
+        loader = spec.loader
+        if loader is not None and hasattr(loader, "exec_module") and not getattr(loader, "_longtalker_timed", False):
+            spec.loader = _TimedLoader(self, loader)
+        return spec
+
+    def _enter(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0)
+        return len(stack) - 1
+
+    def _exit(self, depth, name, elapsed):
+        stack = self._local.stack
+        children = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        self.records.append((depth, name, int((elapsed - children) * 1e6), int(elapsed * 1e6)))
+
+
+class _TimedLoader:
+    _longtalker_timed = True
+
+    def __init__(self, timer, loader):
+        self._timer = timer
+        self._loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        depth = self._timer._enter()
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._timer._exit(depth, module.__name__, time.perf_counter() - start)
+
+
+class StartupTimeline:
+    """起動から最初のフレームまでのimportと初期化の時間の記録
+
+    mark() で区切りの時刻を、span() で処理にかかった時間を記録する。profile が真のときは
+    import するモジュールごとの時間も記録し、report() で -X importtime と同じ形式で返す。
+    """
+
+    def __init__(self, profile=False):
+        self.start = time.perf_counter()
+        self.profile = profile
+        self.events = [] # (ラベル, 起動からの秒数, かかった秒数 or None)
+        self._import_timer = None
+        if profile:
+            self._import_timer = _ImportTimer()
+            sys.meta_path.insert(0, self._import_timer)
+
+    @classmethod
+    def from_environ(cls):
+        return cls(profile=os.environ.get(PROFILE_STARTUP_ENV, "") not in ("", "0"))
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def mark(self, label):
+        self.events.append((label, self.elapsed(), None))
+
+    @contextmanager
+    def span(self, label):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.events.append((label, self.elapsed(), time.perf_counter() - start))
+
+    def stop_import_profile(self):
+        """import の記録をやめる (最初のフレームの後のimportは起動時間に含めない)"""
+        if self._import_timer is not None and self._import_timer in sys.meta_path:
+            sys.meta_path.remove(self._import_timer)
+
+    def report(self, import_limit=30):
+        """記録した内容を文字列にする。import は cumulative の大きい順に import_limit 件まで"""
+        lines = ["起動の記録 (起動からの経過 ms / かかった ms):"]
+        for label, at, duration in self.events:
+            took = f"  ({duration * 1000:.1f} ms)" if duration is not None else ""
+            lines.append(f"  {at * 1000:8.1f} ms  {label}{took}")
+        if self._import_timer is not None:
+            records = sorted(self._import_timer.records, key=lambda r: r[3], reverse=True)[:import_limit]
+            lines.append("import time: self [us] | cumulative | imported package")
+            for depth, name, self_us, cumulative_us in records:
+                lines.append(f"import time: {self_us:>9} | {cumulative_us:>10} | {'  ' * depth}{name}")
+        return "\n".join(lines)
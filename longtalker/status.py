@@ -0,0 +1,78 @@
+import time
+import threading
+from collections import namedtuple
+
+PHASE_SPLIT = "split"
+PHASE_SYNTHESIZE = "synthesize"
+PHASE_PLAY = "play"
+PHASE_LABELS = {PHASE_SPLIT: "分割", PHASE_SYNTHESIZE: "合成", PHASE_PLAY: "再生"}
+
+# ステータス表示の色 (RGBA)
+STATUS_COLORS = {
+    "red": (1, 0, 0, 1),
+    "blue": (0, 0, 1, 1),
+    "green": (0, 1, 0, 1),
+    "orange": (1, 0.5, 0, 1),
+    "purple": (0.5, 0, 0.5, 1),
+    "black": (0, 0, 0, 1),
+}
+
+Progress = namedtuple("Progress", ["phase", "done", "total", "eta"]) # eta は残りの秒数 (不明ならNone)
+
+
+def format_eta(seconds):
+    seconds = int(seconds + 0.5)
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+class StatusChannel:
+    """どのスレッドからでも送れる、最新の1件だけを保持するステータスの受け渡し口
+
+    post() は保持している内容を上書きするだけなので、何件送っても表示の更新は
+    UI側が take() で取り出した回数 (1フレームに1回まで) しか起きない。
+    notify は新しい内容が来たことをUIに知らせる関数 (KivyのClockのトリガーなど)。
+    進み具合は progress() で (フェーズ, 完了数, 総数) を送ると残り時間を見積もって文字列にし、
+    構造化した値は last_progress で参照できる。
+    """
+
+    def __init__(self, notify=None):
+        self.notify = notify
+        self.last_progress = None
+        self._lock = threading.Lock()
+        self._latest = None
+        self._phase_start = {} # (フェーズ, 総数) -> (開始時刻, 開始時の完了数)
+
+    def post(self, message, color_name="black"):
+        with self._lock:
+            pending = self._latest is not None
+            self._latest = (message, color_name)
+        if self.notify and not pending: # 未表示の内容があれば通知済みなので上書きするだけ
+            self.notify()
+
+    def progress(self, phase, done, total, detail="", color_name="purple"):
+        """フェーズの進み具合を送る。detail は後ろに付け足す文字列"""
+        now = time.monotonic()
+        with self._lock:
+            start, start_done = self._phase_start.setdefault((phase, total), (now, done))
+            eta = None
+            if done > start_done and done < total:
+                eta = (now - start) / (done - start_done) * (total - done)
+            self.last_progress = Progress(phase, done, total, eta)
+        message = f"{PHASE_LABELS.get(phase, phase)}: {done}/{total}"
+        if eta is not None:
+            message += f" (残り約 {format_eta(eta)})"
+        if detail:
+            message += f"  {detail}"
+        self.post(message, color_name)
+
+    def reset_progress(self):
+        """新しいジョブを始めるときに、残り時間の見積もりをやり直す"""
+        with self._lock:
+            self._phase_start.clear()
+            self.last_progress = None
+
+    def take(self):
+        """前回から新しい内容があれば (メッセージ, 色の名前) を返し、無ければNone"""
+        with self._lock:
+            latest, self._latest = self._latest, None
+        return latest
@@ -0,0 +1,68 @@
+import os
+import shutil
+import threading
+
+DEFAULT_STORAGE_MAX_BYTES = 1024 * 1024 * 1024 # セッションフォルダの合計の上限 (1GB)
+EVICTION_PAUSE_SECONDS = 0.2 # 1セッション削除するごとに休む秒数 (再生や合成のI/Oを優先する)
+
+
+class StorageManager:
+    """AUDIO_DIR_NAME のセッションの合計サイズを上限以下に保つ
+
+    サイズはライブラリ (AudioLibrary) に記録されたセッションごとの値の合計を使うので、
+    フォルダ全体を走査しない。上限を超えていたら、最後に再生したのが古いセッションから
+    1つずつ削除する。削除は常駐スレッドで、削除ごとに少し休みながら行う。
+    in_use() が返すセッションフォルダ (再生中・合成中のもの) は削除しない。
+    """
+
+    def __init__(self, library, max_bytes=DEFAULT_STORAGE_MAX_BYTES, in_use=None):
+        self.library = library
+        self.max_bytes = max_bytes
+        self.in_use = in_use or (lambda: ())
+        self.evicted = 0
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="longtalker-storage")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def request_eviction(self):
+        """セッションが増えたことを知らせる (必要なら削除を始める)"""
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                self.evict()
+            except Exception as e:
+                print(f"古いセッションの削除に失敗しました: {e}")
+
+    def evict(self):
+        """上限を超えている分だけ古いセッションを削除し、削除した数を返す"""
+        total = self.library.total_bytes()
+        if total <= self.max_bytes:
+            return 0
+        protected = {os.path.abspath(path) for path in self.in_use() if path}
+        removed = 0
+        for session in self.library.least_recently_played():
+            if total <= self.max_bytes:
+                break
+            session_dir = os.path.abspath(self.library.session_dir(session["name"]))
+            if session_dir in protected:
+                continue
+            self._remove(session_dir)
+            total -= session["bytes"] or 0
+            removed += 1
+            self._wakeup.wait(EVICTION_PAUSE_SECONDS)
+        self.evicted += removed
+        if removed:
+            print(f"容量の上限を超えたため、古いセッションを {removed} 個削除しました。")
+        return removed
+
+    def _remove(self, session_dir):
+        shutil.rmtree(session_dir, ignore_errors=True)
+        exported = session_dir + ".mp3" # export_session で書き出したファイル
+        if os.path.exists(exported):
+            os.remove(exported)
+        self.library.forget(session_dir)
@@ -0,0 +1,38 @@
+from gtts import gTTS
+
+from longtalker.cache import cache_key
+from longtalker.segmenter import pack_for_gtts
+
+# 同時に音声合成を行うワーカー数の既定値 (ネットワーク待ちが主なのでスレッドで十分)
+DEFAULT_SYNTH_WORKERS = 4
+# 再生位置より何セグメント先まで合成を進めておくかの既定値
+DEFAULT_LOOKAHEAD = 4
+
+
+def fetch_cached_segment(segment, lang_code, filename, cache):
+    """キャッシュに同じ内容の音声があれば filename に置いてTrueを返す (ネットワークは使わない)"""
+    return cache is not None and cache.fetch(cache_key(segment, lang_code), filename)
+
+
+def synthesize_segment(segment, lang_code, filename, cache=None, transport=None, packing=False, use_cached=True):
+    """1つのセグメントをgTTSで音声化してファイルに保存する
+
+    cache (SynthesisCache) が渡された場合、同じ内容の音声があればネットワークを使わずに再利用する。
+    use_cached=False ならキャッシュは合成した音声の保存にだけ使う (呼び出し側で確認済みの場合)。
+    transport (PooledTransport) が渡された場合、共有のkeep-alive接続でリクエストを送る。
+    packing=True なら区切りを守って100文字ずつに詰め、gTTSのリクエスト数を最小にする。
+    """
+    key = cache_key(segment, lang_code) if cache else None
+    if cache and use_cached and cache.fetch(key, filename):
+        return filename
+    if packing:
+        tts = gTTS(text=segment, lang=lang_code, tokenizer_func=pack_for_gtts)
+    else:
+        tts = gTTS(text=segment, lang=lang_code)
+    if transport:
+        transport.save(tts, filename)
+    else:
+        tts.save(filename)
+    if cache:
+        cache.store(key, filename)
+    return filename
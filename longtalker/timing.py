@@ -0,0 +1,82 @@
+import os
+import json
+from bisect import bisect_right
+
+from longtalker.mp3 import iter_frames
+from longtalker.segmenter import iter_sentence_spans
+
+TIMING_NAME = "timing.json" # セッションフォルダ内の再生時間インデックスのファイル名
+
+
+def mp3_duration(path):
+    """MP3ファイルの再生時間 (秒) をフレームヘッダーのサンプル数から求める (音声はデコードしない)"""
+    with open(path, "rb") as f:
+        return sum(header.samples / header.sample_rate for header, _frame in iter_frames(f))
+
+
+def build_timing_index(segments, filenames):
+    """セグメントと文ごとの開始時刻 (セッション先頭からの秒数) をまとめた辞書を作る
+
+    セグメントの開始時刻はMP3のフレームから求めた正確な値。セグメント内の文の開始時刻は
+    文字数に比例すると仮定して割り振る (gTTSは文ごとの時刻を返さないため)。
+    """
+    index = {"version": 1, "segments": [], "sentences": []}
+    start = 0.0
+    for i, (segment, filename) in enumerate(zip(segments, filenames)):
+        duration = mp3_duration(filename)
+        index["segments"].append({
+            "index": i + 1, "file": os.path.basename(filename),
+            "start": round(start, 3), "duration": round(duration, 3),
+        })
+        chars = sum(end - begin for begin, end in iter_sentence_spans(segment)) or 1
+        elapsed = 0
+        for begin, end in iter_sentence_spans(segment):
+            index["sentences"].append({
+                "segment": i + 1, "start": round(start + duration * elapsed / chars, 3),
+                "text": segment[begin:end],
+            })
+            elapsed += end - begin
+        start += duration
+    index["duration"] = round(start, 3)
+    return index
+
+
+def write_timing_index(session_dir, index):
+    tmp = os.path.join(session_dir, TIMING_NAME + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, os.path.join(session_dir, TIMING_NAME))
+
+
+class TimingIndex:
+    """timing.json を読み込み、時刻 ⇔ セグメント/文の対応を二分探索で引く"""
+
+    def __init__(self, index):
+        self.segments = index["segments"]
+        self.sentences = index["sentences"]
+        self.duration = index.get("duration", 0.0)
+        self._segment_starts = [s["start"] for s in self.segments]
+        self._sentence_starts = [s["start"] for s in self.sentences]
+
+    @classmethod
+    def load(cls, session_dir):
+        """セッションフォルダのインデックスを読む。無い・壊れている場合はNone"""
+        try:
+            with open(os.path.join(session_dir, TIMING_NAME), encoding="utf-8") as f:
+                return cls(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def locate(self, seconds):
+        """セッション先頭からの時刻を (セグメント番号 (0始まり), セグメント内の秒数) に変換する"""
+        i = max(0, bisect_right(self._segment_starts, seconds) - 1)
+        return i, max(0.0, seconds - self._segment_starts[i])
+
+    def sentence_at(self, seconds):
+        """その時刻に読み上げている文の番号 (0始まり)"""
+        return max(0, bisect_right(self._sentence_starts, seconds) - 1)
+
+    def sentence_position(self, sentence):
+        """文の番号 (0始まり) を、再生を始める (セグメント番号 (0始まり), セグメント内の秒数) に変換する"""
+        i = self.sentences[sentence]["segment"] - 1
+        return i, max(0.0, self._sentence_starts[sentence] - self._segment_starts[i])
@@ -0,0 +1,176 @@
+import re
+import json
+import base64
+import threading
+import urllib.parse
+import urllib.request
+
+import requests
+from requests.adapters import HTTPAdapter
+from gtts.tts import gTTSError
+from gtts.utils import _translate_url
+
+# 共有セッションが保持するkeep-alive接続数の既定値 (合成ワーカー数以上にしておく)
+DEFAULT_POOL_SIZE = 8
+# 1回のbatchexecute呼び出しにまとめる100文字チャンクの数の既定値
+# (1 = まとめ送りしない。応答の振り分けを実際のサーバーの応答で確かめるまでは既定では使わない)
+DEFAULT_BATCH_SIZE = 1
+
+_AUDIO_RE = re.compile(r'jQ1olc","\[\\"(.*)\\"]')
+
+
+def extract_audio(response, tts):
+    """batchexecuteの応答から音声データ (MP3バイト列) を取り出す。gTTS.stream() と同じ解釈"""
+    for line in response.iter_lines(chunk_size=1024):
+        decoded_line = line.decode("utf-8")
+        if "jQ1olc" in decoded_line:
+            audio_search = _AUDIO_RE.search(decoded_line)
+            if audio_search:
+                yield base64.b64decode(audio_search.group(1).encode("ascii"))
+            else:
+                # 応答は正常だが音声が含まれていない
+                raise gTTSError(tts=tts, response=response)
+
+
+class PooledTransport:
+    """gTTSの準備済みリクエストを、アプリ全体で共有するkeep-aliveセッションで送信する
+
+    gTTS.stream() は100文字ごとのリクエストのたびに requests.Session() を作り直すため、
+    毎回TCP+TLSのハンドシェイクが発生する。ここでは gTTS._prepare_requests() が作る
+    リクエストをそのまま使い、接続プール付きの1つのセッションから送る (ライブラリ自体は変更しない)。
+    urllib3の接続プールはスレッドセーフなので、複数の合成ワーカーから同時に使ってよい。
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=None):
+        self.timeout = timeout
+        self.requests_sent = 0
+        self._lock = threading.Lock()
+
+        # gTTSと同じく証明書検証を無効にしているので、urllib3の警告を抑える
+        try:
+            requests.packages.urllib3.disable_warnings(
+                requests.packages.urllib3.exceptions.InsecureRequestWarning
+            )
+        except Exception:
+            pass
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.verify = False
+        self.session.proxies.update(urllib.request.getproxies())
+
+    def send(self, prepared_request, tts):
+        """準備済みリクエストを1つ送り、応答を返す (失敗時は gTTSError)"""
+        response = None
+        try:
+            response = self.session.send(prepared_request, timeout=self.timeout)
+            with self._lock:
+                self.requests_sent += 1
+            response.raise_for_status()
+        except requests.exceptions.HTTPError:
+            raise gTTSError(tts=tts, response=response)
+        except requests.exceptions.RequestException:
+            raise gTTSError(tts=tts)
+        return response
+
+    def stream(self, tts):
+        """gTTS.stream() の代わりに、共有セッションで音声データを順に返す"""
+        for prepared_request in tts._prepare_requests():
+            response = self.send(prepared_request, tts)
+            yield from extract_audio(response, tts)
+
+    def save(self, tts, filename):
+        """gTTS.save() の代わりに、共有セッションで合成してファイルに保存する"""
+        with open(str(filename), "wb") as f:
+            for chunk in self.stream(tts):
+                f.write(chunk)
+            f.flush()
+
+    def close(self):
+        self.session.close()
+
+
+class BatchedTransport(PooledTransport):
+    """複数の100文字チャンクを1回のbatchexecute呼び出しにまとめて送る
+
+    gTTSはチャンクごとに jQ1olc のRPCを1つずつ送るが、batchexecuteは1リクエストに
+    複数のRPCを載せられる。各RPCに通し番号を付けて送り、応答の番号で音声を元の順番に並べ直す。
+    サーバーがまとめ送りを受け付けなかった場合は、以後そのチャンク単位の送信 (PooledTransport) に戻る。
+    応答の振り分け (_demultiplex) は実際のbatchexecuteの応答ではまだ確かめていないので、
+    既定の batch_size は1 (まとめ送りしない)。試すときだけ2以上を渡す。
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=None, batch_size=DEFAULT_BATCH_SIZE):
+        super().__init__(pool_size=pool_size, timeout=timeout)
+        self.batch_size = max(1, batch_size)
+        self.batching_disabled = self.batch_size == 1
+
+    @property
+    def chunks_per_request(self):
+        """1回のHTTPリクエストで送るチャンクの数 (チャンクごとの送信に切り替えた後は1)"""
+        return 1 if self.batching_disabled else self.batch_size
+
+    def _prepare(self, tts, body):
+        url = _translate_url(tld=tts.tld, path="_/TranslateWebserverUi/data/batchexecute")
+        return requests.Request(
+            method="POST", url=url, data=body, headers=tts.GOOGLE_TTS_HEADERS
+        ).prepare()
+
+    def _package_batch(self, tts, parts):
+        """チャンクのリストを、通し番号付きの複数RPCを含むリクエスト本文にする"""
+        rpcs = []
+        for idx, part in enumerate(parts):
+            parameter = json.dumps([part, tts.lang, tts.speed, "null"], separators=(",", ":"))
+            rpcs.append([tts.GOOGLE_TTS_RPC, parameter, None, str(idx + 1)])
+        escaped_rpc = json.dumps([rpcs], separators=(",", ":"))
+        return "f.req={}&".format(urllib.parse.quote(escaped_rpc))
+
+    def _demultiplex(self, response, count):
+        """まとめ送りの応答から、通し番号順の音声データのリストを取り出す (欠けがあればNone)"""
+        audio = {}
+        for line in response.iter_lines(chunk_size=1024):
+            try:
+                envelopes = json.loads(line.decode("utf-8"))
+            except ValueError:
+                continue # ")]}'" や長さの行は読み飛ばす
+            if not isinstance(envelopes, list):
+                continue
+            for envelope in envelopes:
+                if (isinstance(envelope, list) and len(envelope) > 6 and envelope[0] == "wrb.fr"
+                        and envelope[1] == "jQ1olc" and envelope[2]):
+                    payload = json.loads(envelope[2])
+                    if payload and payload[0]:
+                        audio[envelope[6]] = base64.b64decode(payload[0])
+        chunks = [audio.get(str(idx + 1)) for idx in range(count)]
+        return None if None in chunks else chunks
+
+    def _send_single(self, tts, part):
+        response = self.send(self._prepare(tts, tts._package_rpc(part)), tts)
+        return b"".join(extract_audio(response, tts))
+
+    def _send_batch(self, tts, parts):
+        """チャンクをまとめて送る。受け付けられなければNoneを返す"""
+        try:
+            response = self.send(self._prepare(tts, self._package_batch(tts, parts)), tts)
+        except gTTSError as e:
+            if e.rsp is not None and 400 <= e.rsp.status_code < 500 and e.rsp.status_code != 429:
+                return None # まとめ送り自体を拒否された
+            raise
+        return self._demultiplex(response, len(parts))
+
+    def stream(self, tts):
+        parts = tts._tokenize(tts.text)
+        assert parts, "No text to send to TTS API"
+        for start in range(0, len(parts), self.batch_size):
+            batch = parts[start:start + self.batch_size]
+            chunks = None
+            if not self.batching_disabled and len(batch) > 1:
+                chunks = self._send_batch(tts, batch)
+                if chunks is None:
+                    print("batchexecuteのまとめ送りが拒否されたため、チャンクごとの送信に切り替えます。")
+                    self.batching_disabled = True
+            if chunks is None:
+                chunks = [self._send_single(tts, part) for part in batch]
+            yield from chunks
@@ -1,87 +1,79 @@
+from longtalker.startup import StartupTimeline
+
+# LONGTALKER_PROFILE_STARTUP=1 で起動すると、importと初期化の時間を記録して最初のフレームの後に表示する
+startup = StartupTimeline.from_environ()
+
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
-from kivy.properties import StringProperty, ListProperty, ObjectProperty
+from kivy.uix.button import Button
+from kivy.uix.gridlayout import GridLayout
+from kivy.uix.label import Label
+from kivy.uix.popup import Popup
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.scrollview import ScrollView
+from kivy.uix.textinput import TextInput
+from kivy.properties import BooleanProperty, NumericProperty, StringProperty, ListProperty, ObjectProperty
+from kivy.uix.behaviors import ButtonBehavior
 from kivy.clock import Clock
 from kivy.lang import Builder
+from kivy.metrics import dp
 from kivy.utils import platform
 
-# gTTSとre、datetimeはTkinter版からそのまま利用
-from gtts import gTTS
+# gTTSの呼び出しは longtalker.synthesis、セッションフォルダの名前は longtalker.manifest に集約
 import os
+import importlib
 import threading
-import re
-from datetime import datetime
-import time
-
-# Kivy環境での音声再生のためのインポート (pyjniusとKivy SoundLoader)
-if platform == 'android':
-    try:
-        from jnius import autoclass
-        MediaPlayer = autoclass('android.media.MediaPlayer')
-        AudioManager = autoclass('android.media.AudioManager')
-        Context = autoclass('android.content.Context')
-        PythonActivity = autoclass('org.kivy.android.PythonActivity')
-        activity = PythonActivity.mActivity
-        print("Android MediaPlayerを初期化しました。")
-        AUDIO_PLAYBACK_METHOD = 'android_mediaplayer'
-    except Exception as e:
-        print(f"Android MediaPlayerの初期化に失敗しました: {e}. Kivy SoundLoaderを代替として使用します。")
-        from kivy.core.audio import SoundLoader
-        AUDIO_PLAYBACK_METHOD = 'kivy_soundloader'
-else:
-    # PC (Linux/Windows) 環境ではKivy SoundLoaderを使用
-    from kivy.core.audio import SoundLoader
-    AUDIO_PLAYBACK_METHOD = 'kivy_soundloader'
-    print("PC環境なのでKivy SoundLoaderを使用します。")
+
+# gTTS/requests を読み込む合成エンジンと、pyjnius/SoundLoader を使うプレーヤーは
+# 起動を速くするため最初に使うときに読み込む (LongTalkerLayout.engine / playback)
+from longtalker.container import playable_segments
+from longtalker.jobqueue import JOB_PAUSED
+from longtalker.playback import FileListJob
+from longtalker.segmenter import iter_sentence_spans, predict_request_count
+from longtalker.session import SessionManager
+from longtalker.status import PHASE_PLAY, PHASE_SYNTHESIZE, STATUS_COLORS, StatusChannel
+from longtalker.timing import TimingIndex
+
+# Android ではMediaPlayer (pyjnius)、PC (Linux/Windows) 環境ではKivy SoundLoaderで再生する
+AUDIO_PLAYBACK_METHOD = 'android_mediaplayer' if platform == 'android' else 'kivy_soundloader'
+
+startup.mark("モジュールのimport")
 
 # --- 関数定義 ---
 
 MAX_CHARS_PER_AUDIO = 300
+SEGMENT_MODE = "sentence" # "sentence": 「。」区切り (従来どおり) / "gtts": gTTSの100文字リクエストに合わせて詰める
 AUDIO_DIR_NAME = "generated_audio"
-
-# Kivy/Android環境での音声再生関数
-def play_mp3_kivy_android(filepath):
-    if not os.path.exists(filepath):
-        print(f"Error: Audio file not found at {filepath}")
-        return False
-
-    if AUDIO_PLAYBACK_METHOD == 'android_mediaplayer':
-        try:
-            player = MediaPlayer()
-            player.setAudioStreamType(AudioManager.STREAM_MUSIC)
-            player.setDataSource(filepath)
-            player.prepare()
-            player.start()
-            while player.isPlaying():
-                time.sleep(0.1)
-            player.release()
-            print(f"Played with Android MediaPlayer: {filepath}")
-            return True
-        except Exception as e:
-            print(f"Error playing with Android MediaPlayer: {e}. Falling back to Kivy SoundLoader.")
-            return play_mp3_kivy(filepath) # Kivy SoundLoaderでの再生を試みる
-    
-    elif AUDIO_PLAYBACK_METHOD == 'kivy_soundloader':
-        return play_mp3_kivy(filepath)
-    
-    return False
-
-def play_mp3_kivy(filepath):
-    """KivyのSoundLoaderでMP3ファイルを再生する (PC環境やFallback用)"""
-    sound = SoundLoader.load(filepath)
-    if sound:
-        print(f"Played with Kivy SoundLoader: {filepath}")
-        sound.play()
-        duration = sound.length
-        if duration > 0:
-            time.sleep(duration + 0.5)
-        else:
-            time.sleep(2)
-        sound.unload()
-        return True
-    else:
-        print(f"Error: Could not load sound file {filepath} with Kivy SoundLoader.")
-        return False
+SYNTH_WORKERS = 4 # 同時に音声合成するセグメント数の上限 (1にすると従来どおり逐次処理)
+ADAPTIVE_CONCURRENCY = True # Trueなら応答に合わせて同時合成数を増減し、429/5xxで減らす
+SYNTH_MAX_RETRIES = 5 # 429/5xx/接続エラーのとき1セグメントを再試行する回数
+PIPELINE_PLAYBACK = True # Trueなら合成しながら再生する (Falseなら全セグメント作成後に再生)
+PLAYBACK_LOOKAHEAD = 4 # パイプライン再生時に再生位置より先行して合成するセグメント数
+CACHE_MAX_BYTES = 200 * 1024 * 1024 # 合成キャッシュ (AUDIO_DIR_NAME/.synth_cache) の上限サイズ
+HTTP_POOL_SIZE = 8 # Google TTSへのkeep-alive接続数 (SYNTH_WORKERS以上にする)
+BATCH_RPC_SIZE = 1 # 1回のHTTPリクエストにまとめる100文字チャンク数 (1ならまとめ送りしない。2以上は試験的)
+STORAGE_MAX_BYTES = 1024 * 1024 * 1024 # セッションフォルダの合計の上限 (超えたら最後に再生したのが古いものから削除)
+SESSION_CONTAINER = False # Trueなら再生し終えたセッションのMP3を1つのファイル (session.ltc) にまとめる
+EXPORT_SINGLE_MP3 = False # Trueなら合成後にセッションを1つのMP3 (AUDIO_DIR_NAME/<フォルダ名>.mp3) に書き出す
+PLAYBACK_PRIORITY = 100 # 再生しながら合成するジョブの優先度 (キューのジョブより先に同時実行の枠をもらう)
+QUEUE_MAX_ACTIVE = 2 # 合成キューから同時に合成するジョブの数 (枠は SYNTH_WORKERS を分け合う)
+QUEUE_POLL_INTERVAL = 0.5 # 合成キューの進み具合を確認する間隔 (秒)
+TEXT_INPUT_MAX_CHARS = 20000 # これより長い貼り付けは TextInput に入れず、読み上げ表示 (RecycleView) に直接入れる
+STARTUP_WARMUP = True # Trueなら最初のフレームを表示した後に、合成エンジンと再生のモジュールを裏で読み込んでおく
+
+
+# --- 読み上げ表示の1行 (1文) ---
+class SentenceRow(ButtonBehavior, Label):
+    sentence = NumericProperty(0)
+    segment = NumericProperty(0)
+    playing = BooleanProperty(False)
+
+    def on_release(self):
+        App.get_running_app().root.jump_to_sentence(self.sentence)
+
+
+class DocumentView(RecycleView):
+    pass
 
 
 # --- KivyのUI部分とロジックを統合したルートウィジェットクラス ---
@@ -98,9 +90,100 @@ class LongTalkerLayout(BoxLayout):
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        # ステータスは最新の1件だけを保持し、表示の更新は1フレームに1回までにする
+        self.status = StatusChannel(notify=Clock.create_trigger(self._flush_status))
         self.lang_code = 'ja'
         self.set_lang_code(self.selected_lang_display)
-        os.makedirs(AUDIO_DIR_NAME, exist_ok=True)
+        self.synth_cache = None
+        self.transport = None
+        self._engine = None
+        self._engine_lock = threading.Lock()
+        self._playback = None
+        self.current_job = None
+        # セッションの作成・ライブラリ・容量管理・合成キュー (Tkinter版と共通の SessionManager)
+        self.session_manager = SessionManager(
+            AUDIO_DIR_NAME, get_engine=lambda: self.engine, current_job=lambda: self.current_job,
+            max_chars=MAX_CHARS_PER_AUDIO, mode=SEGMENT_MODE, storage_max_bytes=STORAGE_MAX_BYTES,
+            queue_max_active=QUEUE_MAX_ACTIVE, export_single_mp3=EXPORT_SINGLE_MP3,
+            on_queued_job_finished=self._on_queued_job_finished,
+        )
+        self.library = self.session_manager.library
+        self.job_queue = self.session_manager.job_queue
+        self._queue_popup = None
+        Clock.schedule_interval(self._pump_job_queue, QUEUE_POLL_INTERVAL)
+        self._job_poll_event = None
+        self._prepare_generation = 0 # 準備中のセッションの番号 (取り消されたら結果を捨てる)
+        self._document_text = None # 入力欄に入れずに読み上げ表示だけで扱っている長いテキスト
+        self._play_position = 0
+        self._start_position = None # 文をタップしたときの (セグメント番号, セグメント内の秒数)
+        self._timing = None # 再生中のセッションの TimingIndex (読み込んだら保持する)
+        self._segment_rows = [] # セグメントごとの、読み上げ表示の行の範囲 (start, end)
+        self._highlighted = None
+        # ライブラリを実際のフォルダと突き合わせ、途中で終わったセッションを探す
+        thread = threading.Thread(target=self._reconcile_library)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def engine(self):
+        """合成エンジン (gTTS/requests の読み込みが重いので、最初の合成か事前読み込みのときに作る)"""
+        with self._engine_lock:
+            if self._engine is None:
+                from longtalker.cache import SynthesisCache
+                from longtalker.engine import SynthesisEngine
+                from longtalker.transport import BatchedTransport
+                self.synth_cache = SynthesisCache(AUDIO_DIR_NAME, max_bytes=CACHE_MAX_BYTES)
+                # アプリ実行中はひとつの接続プールを使い回し、チャンクごとのハンドシェイクを省く
+                self.transport = BatchedTransport(pool_size=HTTP_POOL_SIZE, batch_size=BATCH_RPC_SIZE)
+                # 合成はアプリ全体で1つのasyncioループで行う
+                self._engine = SynthesisEngine(
+                    max_in_flight=SYNTH_WORKERS, cache=self.synth_cache, transport=self.transport,
+                    adaptive=ADAPTIVE_CONCURRENCY, max_retries=SYNTH_MAX_RETRIES,
+                )
+            return self._engine
+
+    @property
+    def playback(self):
+        """プレーヤー (pyjnius/SoundLoader は最初の再生のときに読み込む。メインスレッドから使う)"""
+        if self._playback is None:
+            self._playback = self._create_playback()
+        return self._playback
+
+    def _create_playback(self):
+        if AUDIO_PLAYBACK_METHOD == 'android_mediaplayer':
+            try:
+                from jnius import autoclass
+                autoclass('android.media.MediaPlayer')
+                from longtalker.mediaplayer import AndroidMediaPlayer, MediaPlayerChain
+                print("Android MediaPlayerを初期化しました。")
+                # 2つのMediaPlayerを使い回し、prepareAsync と setNextMediaPlayer で隙間なくつなぐ
+                return MediaPlayerChain(
+                    AndroidMediaPlayer, on_start=self._on_playback_start, on_finish=self._on_playback_finish
+                )
+            except Exception as e:
+                print(f"Android MediaPlayerの初期化に失敗しました: {e}. Kivy SoundLoaderを代替として使用します。")
+        else:
+            print("PC環境なのでKivy SoundLoaderを使用します。")
+        from longtalker.kivy_player import KivySoundScheduler
+        # Soundの on_stop で次のセグメントへ進み、次のファイルは再生中に読み込んでおく
+        return KivySoundScheduler(on_start=self._on_playback_start, on_finish=self._on_playback_finish)
+
+    def warm_up(self):
+        """最初の合成・再生で待たないように、重いモジュールを先に読み込む (別スレッドで呼ぶ)"""
+        try:
+            self.engine # 読むと作られる
+            if AUDIO_PLAYBACK_METHOD == 'android_mediaplayer':
+                importlib.import_module('longtalker.mediaplayer')
+            else:
+                importlib.import_module('longtalker.kivy_player')
+        except Exception as e:
+            print(f"事前読み込みに失敗しました: {e}")
+
+    def _reconcile_library(self):
+        # 別スレッドで呼ばれる
+        incomplete = self.session_manager.reconcile()
+        if incomplete:
+            Clock.schedule_once(lambda dt: self._resume_incomplete_sessions(incomplete))
 
     def set_lang_code(self, full_lang_name):
         if '(' in full_lang_name and ')' in full_lang_name:
@@ -111,161 +194,465 @@ class LongTalkerLayout(BoxLayout):
         print(f"言語コードを {self.lang_code} に設定しました。")
 
     def start_audio_process_threaded(self):
-        original_text = self.ids.text_input.text.strip()
+        """テキストを分割して合成ジョブを投入する (実行中のジョブがあれば取り消して置き換える)"""
+        original_text = self._source_text()
         
         if not original_text:
             self.update_status_on_main_thread("テキストが入力されていません", "red")
             return
 
-        self.set_ui_state(False)
-        self.update_status_on_main_thread("処理を開始します...", "blue")
-
-        thread = threading.Thread(target=self._create_and_play_audio_logic, args=(original_text, self.lang_code))
+        self.cancel_current_job()
+        self.update_status_on_main_thread("テキストを分割中...", "blue")
+        # 分割・フォルダの準備・ライブラリへの記録は別スレッドで行い、結果をClockで受け取る
+        thread = threading.Thread(
+            target=self._prepare_in_background, args=(self._prepare_generation, original_text, self.lang_code)
+        )
         thread.daemon = True
         thread.start()
 
-    def _create_and_play_audio_logic(self, original_text, lang_code):
+    def _prepare_in_background(self, generation, original_text, lang_code):
+        # 別スレッドで呼ばれる
         try:
-            self.update_status_on_main_thread("テキストを分割中...", "blue")
-            segments = self._split_long_text(original_text)
-
-            if not segments:
-                self.update_status_on_main_thread("分割可能なテキストが見つかりません", "red")
-                return
-
-            self.update_status_on_main_thread(f"テキストを {len(segments)} 個のセグメントに分割しました。", "green")
-            
-            # 音声ファイルを保存するフォルダの準備
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            folder_name_prefix = original_text[:20].replace(' ', '_').replace('　', '_')
-            folder_name_prefix = re.sub(r'[\\/:*?"<>|]', '_', folder_name_prefix)
-            audio_sub_dir = f"{folder_name_prefix}_{timestamp}"
-            
-            full_audio_path = os.path.join(AUDIO_DIR_NAME, audio_sub_dir)
-            os.makedirs(full_audio_path, exist_ok=True)
-            
-            audio_files_to_play = []
-
-            for i, segment in enumerate(segments):
-                filename = os.path.join(full_audio_path, f"{i+1:03d}.mp3")
-                self.update_status_on_main_thread(f"音声ファイル {i+1}/{len(segments)} を作成中...", "blue")
-
-                tts = gTTS(text=segment, lang=lang_code)
-                tts.save(filename)
-                audio_files_to_play.append(filename)
-
-            self.update_status_on_main_thread(f"{len(audio_files_to_play)} 個の音声ファイルを作成しました。連続再生します...", "green")
-            
-            # --- 音声の連続再生 ---
-            for i, audio_file in enumerate(audio_files_to_play):
-                self.update_status_on_main_thread(f"再生中: {i+1}/{len(audio_files_to_play)} - '{os.path.basename(audio_file)}'", "purple")
-                play_mp3_kivy_android(audio_file)
-            
-            self.update_status_on_main_thread(f"すべての音声ファイルの再生が完了しました。フォルダ: '{full_audio_path}'", "green")
-    
+            segments, filenames, reused, journal = self.session_manager.prepare(original_text, lang_code)
+            self.engine # 初回はここでエンジンを作っておく
+            # 表示するのはHTTPリクエストの数 (まとめ送りなら複数のチャンクで1リクエスト)
+            request_count = predict_request_count(
+                [segment for i, segment in enumerate(segments) if i not in reused], lang_code,
+                packing=self.session_manager.packing, batch_size=self.transport.chunks_per_request,
+            )
+            rows = self._document_rows(segments)
         except Exception as e:
-            self.update_status_on_main_thread(f"エラー: {e}", "red")
-        
-        finally:
-            self.update_ui_state_on_main_thread(True)
-
-    def start_folder_playback_threaded(self):
-        """フォルダを選択し、その中のMP3ファイルを連続再生する (別スレッド)"""
-        if platform == 'android':
-            self.update_status_on_main_thread("Android版のフォルダ選択再生は現在サポートしていません。", "orange")
-            self.set_ui_state(True)
+            message = f"エラー: {e}"
+            Clock.schedule_once(lambda dt: self._on_session_prepared(generation, message=message))
+            return
+        prepared = (lang_code, segments, filenames, reused, journal, request_count, rows)
+        Clock.schedule_once(lambda dt: self._on_session_prepared(generation, prepared=prepared))
+
+    def _on_session_prepared(self, generation, prepared=None, message=None):
+        if generation != self._prepare_generation:
+            return # 準備している間に取り消されたか、別のテキストの合成が始まった
+        if prepared is None:
+            self.update_status_on_main_thread(message, "red")
+            return
+        lang_code, segments, filenames, reused, journal, request_count, rows = prepared
+        if not segments:
+            self.update_status_on_main_thread("分割可能なテキストが見つかりません", "red")
             return
-        
-        # PC環境 (Linux/Windows) でKivyのファイルダイアログを使用する場合
-        # kivy.garden.filebrowser などの外部ライブラリが必要になる。
-        # または、tkinter.filedialogをKivyアプリ内で実行するトリッキーな方法もあるが、
-        # Kivyのイベントループと競合する可能性があり推奨されない。
-        # 今回は、APK化を優先し、PC上でのKivy実行時もこの機能は制限する。
-        # もしPC上でKivyでファイルダイアログを表示したい場合は、kivy_filebrowserなどを導入検討。
-        self.update_status_on_main_thread("PC環境でのフォルダ選択再生は、現在Kivyでは未実装です。Kivy Gardenライブラリが必要です。", "orange")
-        self.set_ui_state(True)
-
-
-    def _split_long_text(self, original_text):
-        segments = []
-        sentences = re.split(r'(。)', original_text)
-        current_segment = ""
-
-        for i in range(0, len(sentences), 2):
-            sentence = sentences[i].strip()
-            if i + 1 < len(sentences):
-                sentence += sentences[i+1]
-            if not sentence:
-                continue
 
-            if len(current_segment) + len(sentence) <= MAX_CHARS_PER_AUDIO:
-                current_segment += sentence
+        self.update_status_on_main_thread(f"テキストを {len(segments)} 個のセグメントに分割しました。(前回から再利用: {len(reused)} 個、予測リクエスト数: {request_count})", "green")
+        lookahead = PLAYBACK_LOOKAHEAD if PIPELINE_PLAYBACK else None
+        self.status.reset_progress()
+        self.current_job = self.engine.submit(
+            segments, lang_code, filenames, lookahead=lookahead, done=reused,
+            packing=self.session_manager.packing, priority=PLAYBACK_PRIORITY, journal=journal,
+        )
+        self._play_position = 0
+        self._load_document_rows(rows, len(segments))
+        # 完成したセグメントはClockで毎フレーム受け取る (UIスレッドはブロックしない)
+        self._job_poll_event = Clock.schedule_interval(self._poll_current_job, 0)
+
+    def cancel_current_job(self):
+        """実行中の合成ジョブと再生を取り消す"""
+        self._prepare_generation += 1
+        if self._job_poll_event is not None:
+            self._job_poll_event.cancel()
+            self._job_poll_event = None
+        if self.current_job is not None:
+            self.current_job.cancel()
+            self.current_job = None
+        if self._playback is not None:
+            self._playback.stop()
+        self._start_position = None
+        self._timing = None
+        self.ids.pause_button.text = '一時停止'
+
+    def _enqueue(self, job, index, filename):
+        # タップした文のセグメントは、その文の位置から再生する
+        position = 0.0
+        if self._start_position is not None and self._start_position[0] == index:
+            position, self._start_position = self._start_position[1], None
+        self.playback.enqueue(job, index, filename, position)
+
+    def _poll_current_job(self, dt):
+        job = self.current_job
+        if job is None:
+            return False
+        ready = job.poll()
+        if PIPELINE_PLAYBACK:
+            for index, filename in ready:
+                self._enqueue(job, index, filename)
+        if job.error is not None:
+            self.update_status_on_main_thread(f"エラー: {job.error} ({self.engine.limiter.describe()})", "red")
+            self.cancel_current_job()
+            return False
+        if ready:
+            self._report_positions(job)
+        if job.synthesized == job.total:
+            if not PIPELINE_PLAYBACK:
+                self.update_status_on_main_thread(f"{job.total} 個の音声ファイルを作成しました。連続再生します...", "green")
+                for index, filename in enumerate(job.filenames):
+                    self._enqueue(job, index, filename)
+            self.session_manager.start_finalize_thread(job)
+            self._job_poll_event = None
+            return False
+
+    def _report_positions(self, job):
+        # 合成中は合成の進み具合、合成し終えたら再生の進み具合 (残り時間の見積もり付き) を表示する
+        if job.synthesized < job.total:
+            self.status.progress(
+                PHASE_SYNTHESIZE, job.synthesized, job.total, detail=f"再生中: {self._play_position}/{job.total}"
+            )
+        else:
+            self.status.progress(PHASE_PLAY, self._play_position, job.total)
+
+    def _on_playback_start(self, job, index, filename):
+        # MediaPlayerのコールバック (Androidの場合) またはメインスレッドから呼ばれる
+        self._play_position = index + 1
+        Clock.schedule_once(lambda dt: self._highlight_segment(index))
+        self._report_positions(job)
+        if index == 0:
+            self.library.mark_played(job.output_dir)
+
+    def _on_playback_finish(self, job, index):
+        # MediaPlayerのコールバック (Androidの場合) またはメインスレッドから呼ばれる
+        if index + 1 == job.total:
+            if self._engine is not None:
+                self.update_status_on_main_thread(f"すべての音声ファイルの再生が完了しました。フォルダ: '{job.output_dir}' ({self.synth_cache.describe()}, {self._engine.limiter.describe()})", "green")
+                print(f"合成キャッシュ: {self.synth_cache.stats()} / リクエスト: {self._engine.limiter.stats()}")
             else:
-                if current_segment:
-                    segments.append(current_segment.strip())
-                current_segment = sentence
-        
-        if current_segment:
-            segments.append(current_segment.strip())
-        
-        final_segments = []
-        for segment in segments:
-            while len(segment) > MAX_CHARS_PER_AUDIO:
-                split_point = MAX_CHARS_PER_AUDIO
-                temp_split_segment = segment[:split_point]
-                last_space_index = temp_split_segment.rfind(' ')
-                if last_space_index != -1 and last_space_index > split_point * 0.8:
-                     split_point = last_space_index
-                
-                final_segments.append(segment[:split_point].strip())
-                segment = segment[split_point:].strip()
-            if segment:
-                final_segments.append(segment.strip())
-        return final_segments
+                self.update_status_on_main_thread(f"すべての音声ファイルの再生が完了しました。フォルダ: '{job.output_dir}'", "green")
+            if SESSION_CONTAINER:
+                self.session_manager.start_pack_thread(job.output_dir)
+
+    # --- 読み上げ表示 (RecycleViewで見えている行だけを描画する) ---
+
+    @staticmethod
+    def _document_rows(segments):
+        """セグメントを読み上げ表示の (文, セグメント番号) の列にする (どのスレッドからでも呼べる)"""
+        rows = []
+        for i, segment in enumerate(segments):
+            rows.extend((segment[start:end], i) for start, end in iter_sentence_spans(segment))
+        return rows
+
+    def _load_document_rows(self, rows, segment_count):
+        """(文, セグメント番号) の列を読み上げ表示に入れ、表示を読み上げ表示に切り替える"""
+        self._segment_rows = [(0, 0)] * segment_count
+        for row, (_text, segment) in enumerate(rows):
+            start, end = self._segment_rows[segment]
+            self._segment_rows[segment] = (start if end > start else row, row + 1)
+        self._highlighted = None
+        self.ids.doc_view.data = [
+            {'text': text, 'sentence': row, 'segment': segment, 'playing': False}
+            for row, (text, segment) in enumerate(rows)
+        ]
+        self.ids.doc_view.scroll_y = 1
+        self._show_document_view(bool(rows))
+
+    def _show_document_view(self, show):
+        doc_view, text_input = self.ids.doc_view, self.ids.text_input
+        for widget, visible in ((doc_view, show), (text_input, not show)):
+            widget.size_hint_y = 1 if visible else None
+            widget.height = widget.height if visible else 0
+            widget.opacity = 1 if visible else 0
+            widget.disabled = not visible
+        self.ids.view_button.text = '本文を編集' if show else '読み上げ表示'
+
+    def toggle_document_view(self):
+        if self._document_text is not None and self.ids.doc_view.opacity != 0:
+            self.update_status_on_main_thread("貼り付けた長いテキストは読み上げ表示だけで扱います (クリアで入力欄に戻ります)", "orange")
+            return
+        self._show_document_view(self.ids.doc_view.opacity == 0 and bool(self.ids.doc_view.data))
+
+    def _highlight_segment(self, index):
+        """再生中のセグメントの行を強調し、見える位置までスクロールする (変わった行だけを更新)"""
+        data = self.ids.doc_view.data
+        for segment, playing in ((self._highlighted, False), (index, True)):
+            if segment is None or segment >= len(self._segment_rows):
+                continue
+            start, end = self._segment_rows[segment]
+            for row in range(start, end):
+                data[row] = dict(data[row], playing=playing)
+        self._highlighted = index
+        if index < len(self._segment_rows) and len(data) > 1:
+            self.ids.doc_view.scroll_y = 1 - self._segment_rows[index][0] / (len(data) - 1)
+
+    def jump_to_sentence(self, row):
+        """タップした文から再生し直す (再生時間インデックスが無ければ、その文のセグメントの先頭から)"""
+        job = self.current_job
+        data = self.ids.doc_view.data
+        if job is None or row >= len(data) or data[row]['segment'] >= job.total:
+            return
+        index, position = data[row]['segment'], 0.0
+        timing = self._timing_index(job)
+        if timing is not None and row < len(timing.sentences) and timing.sentences[row]['segment'] - 1 == index:
+            index, position = timing.sentence_position(row)
+        self.playback.stop()
+        self.ids.pause_button.text = '一時停止'
+        self._start_position = (index, position)
+        # 合成もその位置から先に進める (完成済みの分はすぐに、残りは _poll_current_job で再生キューに入る)
+        ready = job.seek(index)
+        if PIPELINE_PLAYBACK or job.synthesized == job.total:
+            for i, filename in ready:
+                self._enqueue(job, i, filename)
+        self.update_status_on_main_thread(f"セグメント {index + 1}/{job.total} から再生します", "purple")
+
+    def _timing_index(self, job):
+        # 合成し終えたセッションは timing.json (SessionManager.finalize で書く) から文の開始時刻を引く
+        if self._timing is None and job.synthesized == job.total:
+            self._timing = TimingIndex.load(job.output_dir)
+        return self._timing
+
+    def toggle_pause(self):
+        """再生中のセグメントを一時停止、または一時停止した位置から再開する"""
+        if self.playback.resume():
+            self.ids.pause_button.text = '一時停止'
+            self.update_status_on_main_thread("再生を再開しました", "purple")
+        elif self.playback.pause():
+            self.ids.pause_button.text = '再開'
+            self.update_status_on_main_thread("再生を一時停止しました", "purple")
+        else:
+            self.update_status_on_main_thread("一時停止できる再生がありません", "orange")
+
+    def skip_segment(self):
+        """再生中のセグメントを飛ばして次のセグメントを再生する"""
+        self.ids.pause_button.text = '一時停止'
+        self.playback.skip()
+
+    def open_library(self):
+        """作成済みのセッションの一覧を表示し、選んだセッションを連続再生する (タイトルとフォルダ名で検索できる)"""
+        if not self.library.list_sessions(limit=1):
+            self.update_status_on_main_thread("再生できるセッションがありません", "orange")
+            return
+
+        content = BoxLayout(orientation='vertical', spacing=dp(5))
+        popup = Popup(title='ライブラリから再生', content=content, size_hint=(0.95, 0.9))
+        search = TextInput(hint_text='検索 (タイトル・フォルダ名)', multiline=False, size_hint_y=None, height=dp(40))
+        content.add_widget(search)
+        grid = GridLayout(cols=1, spacing=dp(4), size_hint_y=None)
+        grid.bind(minimum_height=grid.setter('height'))
+
+        def show_sessions(query):
+            grid.clear_widgets()
+            for session in self.library.list_sessions(query=query.strip() or None):
+                button = Button(text=self._describe_session(session), size_hint_y=None, height=dp(48))
+                button.bind(on_release=lambda _button, name=session['name']: self._play_from_library(popup, name))
+                grid.add_widget(button)
+
+        search.bind(text=lambda _input, text: show_sessions(text))
+        show_sessions('')
+        scroll = ScrollView()
+        scroll.add_widget(grid)
+        content.add_widget(scroll)
+        close_button = Button(text='閉じる', size_hint_y=None, height=dp(48))
+        close_button.bind(on_release=popup.dismiss)
+        content.add_widget(close_button)
+        popup.open()
+
+    def _describe_session(self, session):
+        duration = session['duration']
+        length = f"{int(duration) // 60}:{int(duration) % 60:02d}" if duration else "--:--"
+        return f"{session['title']}  [{session['lang'] or '?'}] {session['segments'] or 0}個 {length}"
+
+    def _play_from_library(self, popup, name):
+        popup.dismiss()
+        self.cancel_current_job()
+        session_dir = self.library.session_dir(name)
+        try:
+            # コンテナにまとめたセッションはファイルを書き出さずに、コンテナの中の範囲を再生する
+            filenames = playable_segments(session_dir) if os.path.isdir(session_dir) else []
+        except (OSError, ValueError) as e:
+            self.update_status_on_main_thread(f"エラー: {e}", "red")
+            return
+        if not filenames:
+            self.update_status_on_main_thread(f"'{name}' に再生できるMP3ファイルがありません", "red")
+            return
+        self.update_status_on_main_thread(f"{len(filenames)} 個のMP3ファイルを再生します...", "green")
+        self._play_position = 0
+        timing = self._timing = TimingIndex.load(session_dir)
+        self._load_document_rows(
+            [(s['text'], s['segment'] - 1) for s in timing.sentences] if timing else [], len(filenames)
+        )
+        self.current_job = FileListJob(filenames, output_dir=session_dir)
+        for index, filename in enumerate(filenames):
+            self.playback.enqueue(self.current_job, index, filename)
+
+    # --- 合成キュー (再生せずに合成だけしておくジョブ) ---
+
+    def _resume_incomplete_sessions(self, session_dirs):
+        """強制終了やエラーで合成が途中で終わったセッションを、合成キューで続きから合成する"""
+        resumed = self.session_manager.resume_incomplete_sessions(session_dirs)
+        if resumed:
+            self.update_status_on_main_thread(f"途中で終わったセッションを {resumed} 個、合成キューで再開します", "blue")
+            self._refresh_job_queue()
+
+    def _on_queued_job_finished(self, entry, job):
+        # 後処理は SessionManager が別スレッドで始めている
+        self.update_status_on_main_thread(f"キューのジョブ '{entry['title']}' の合成が完了しました", "green")
+
+    def _pump_job_queue(self, dt):
+        if self.job_queue.pump() and self._queue_popup is not None:
+            self._refresh_job_queue()
+
+    def add_to_job_queue(self):
+        """入力中のテキストを合成キューに入れる (再生中のジョブはそのまま続ける)"""
+        text = self._source_text()
+        if not text:
+            self.update_status_on_main_thread("テキストが入力されていません", "red")
+            return
+        entry = self.job_queue.add(text, self.lang_code)
+        self.update_status_on_main_thread(f"'{entry['title']}' を合成キューに入れました", "green")
+        self._refresh_job_queue()
+
+    def open_job_queue(self):
+        """合成キューの一覧を表示する (優先度の変更・一時停止・再開・取り消し)"""
+        content = BoxLayout(orientation='vertical', spacing=dp(5))
+        popup = Popup(title='合成キュー', content=content, size_hint=(0.95, 0.9))
+        self._queue_grid = GridLayout(cols=1, spacing=dp(4), size_hint_y=None)
+        self._queue_grid.bind(minimum_height=self._queue_grid.setter('height'))
+        scroll = ScrollView()
+        scroll.add_widget(self._queue_grid)
+        content.add_widget(scroll)
+        buttons = BoxLayout(size_hint_y=None, height=dp(48), spacing=dp(5))
+        for text, callback in (
+            ('入力中のテキストを追加', lambda _button: self.add_to_job_queue()),
+            ('終わったものを片付け', lambda _button: self._clear_finished_jobs()),
+            ('閉じる', lambda _button: popup.dismiss()),
+        ):
+            button = Button(text=text)
+            button.bind(on_release=callback)
+            buttons.add_widget(button)
+        content.add_widget(buttons)
+        popup.bind(on_dismiss=lambda _popup: setattr(self, '_queue_popup', None))
+        self._queue_popup = popup
+        self._refresh_job_queue()
+        popup.open()
+
+    def _clear_finished_jobs(self):
+        self.job_queue.clear_finished()
+        self._refresh_job_queue()
+
+    def _refresh_job_queue(self):
+        if self._queue_popup is None:
+            return
+        grid = self._queue_grid
+        grid.clear_widgets()
+        for entry in self.job_queue.entries:
+            row = BoxLayout(size_hint_y=None, height=dp(48), spacing=dp(4))
+            row.add_widget(Label(text=self.job_queue.describe(entry)))
+            paused = entry['state'] == JOB_PAUSED
+            for text, callback in (
+                ('優先↑', lambda _button, entry=entry: self._change_job_priority(entry, 1)),
+                ('優先↓', lambda _button, entry=entry: self._change_job_priority(entry, -1)),
+                ('再開' if paused else '一時停止', lambda _button, entry=entry: self._toggle_job_pause(entry)),
+                ('取消', lambda _button, entry=entry: self._cancel_queued_job(entry)),
+            ):
+                button = Button(text=text, size_hint_x=None, width=dp(72))
+                button.bind(on_release=callback)
+                row.add_widget(button)
+            grid.add_widget(row)
+
+    def _change_job_priority(self, entry, delta):
+        self.job_queue.set_priority(entry['id'], entry['priority'] + delta)
+        self._refresh_job_queue()
+
+    def _toggle_job_pause(self, entry):
+        if not self.job_queue.resume(entry['id']):
+            self.job_queue.pause(entry['id'])
+        self._refresh_job_queue()
+
+    def _cancel_queued_job(self, entry):
+        self.job_queue.cancel(entry['id'])
+        self._refresh_job_queue()
 
     def update_status_on_main_thread(self, message, color_name="black"):
-        Clock.schedule_once(lambda dt: self._set_status_text_and_color(message, color_name))
+        # どのスレッドからでも呼べる (表示は次のフレームで最新の1件だけ)
+        self.status.post(message, color_name)
+
+    def _flush_status(self, dt):
+        latest = self.status.take()
+        if latest is not None:
+            self._set_status_text_and_color(*latest)
 
     def _set_status_text_and_color(self, message, color_name):
-        self.ids.status_label.text = message
-        color_map = {
-            "red": (1, 0, 0, 1),
-            "blue": (0, 0, 1, 1),
-            "green": (0, 1, 0, 1),
-            "orange": (1, 0.5, 0, 1),
-            "purple": (0.5, 0, 0.5, 1),
-            "black": (0, 0, 0, 1),
-        }
-        self.ids.status_label.color = color_map.get(color_name, (0, 0, 0, 1))
-
-    def update_ui_state_on_main_thread(self, enable):
-        Clock.schedule_once(lambda dt: self._set_all_ui_state(enable))
-
-    def _set_all_ui_state(self, enable):
-        self.ids.create_button.disabled = not enable
-        self.ids.paste_button.disabled = not enable
-        self.ids.clear_button.disabled = not enable
-        self.ids.lang_spinner.disabled = not enable
-        self.ids.play_folder_button.disabled = not enable
+        label = self.ids.status_label
+        if label.text != message:
+            label.text = message
+        label.color = STATUS_COLORS.get(color_name, STATUS_COLORS["black"])
+
 
+    def _source_text(self):
+        """合成するテキスト (長いテキストを貼り付けた場合は入力欄ではなくそちら)"""
+        if self._document_text is not None:
+            return self._document_text
+        return self.ids.text_input.text.strip()
 
     def paste_text(self):
         from kivy.core.clipboard import Clipboard
         try:
             text = Clipboard.get()
-            self.ids.text_input.text = text
-            self.update_status_on_main_thread("クリップボードから貼り付けました", "black")
         except Exception as e:
             self.update_status_on_main_thread(f"クリップボードエラー: {e}", "orange")
+            return
+        if len(text) <= TEXT_INPUT_MAX_CHARS:
+            self._document_text = None
+            self.ids.text_input.text = text
+            self.update_status_on_main_thread("クリップボードから貼り付けました", "black")
+            return
+        # 長いテキストを TextInput に入れると全体を折り返して描画するまでUIが止まるので、
+        # 入力欄には入れずに、別スレッドで文に分けて読み上げ表示 (見えている行だけを描画) に入れる
+        self.cancel_current_job()
+        self._document_text = text.strip()
+        self.ids.text_input.text = ""
+        self.update_status_on_main_thread(f"長いテキスト ({len(text)} 文字) を読み上げ表示に貼り付けています...", "blue")
+        thread = threading.Thread(
+            target=self._split_in_background, args=(self._prepare_generation, self._document_text)
+        )
+        thread.daemon = True
+        thread.start()
+
+    def _split_in_background(self, generation, text):
+        # 別スレッドで呼ばれる
+        segments = self.session_manager.split(text)
+        rows = self._document_rows(segments)
+        Clock.schedule_once(lambda dt: self._on_document_split(generation, rows, len(segments)))
+
+    def _on_document_split(self, generation, rows, segment_count):
+        if generation != self._prepare_generation:
+            return # 分け終わる前に合成が始まったか、クリアされた
+        if not rows:
+            self._document_text = None
+            self.update_status_on_main_thread("分割可能なテキストが見つかりません", "red")
+            return
+        self._load_document_rows(rows, segment_count)
+        self.update_status_on_main_thread(f"{len(rows)} 文を読み上げ表示に貼り付けました", "black")
 
     def clear_text(self):
+        self.cancel_current_job()
+        self._document_text = None
         self.ids.text_input.text = ""
+        self._load_document_rows([], 0)
         self.update_status_on_main_thread("テキスト入力欄をクリアしました", "black")
 
 # --- Kivyのメインアプリケーションクラス ---
 class LongTalkerApp(App):
     def build(self):
-        return Builder.load_file('longtalker.kv')
+        with startup.span("build (longtalker.kv の読み込み)"):
+            return Builder.load_file('longtalker.kv')
+
+    def on_start(self):
+        # タイムアウト0のコールバックは次のフレームを描いた後に呼ばれる
+        Clock.schedule_once(self._on_first_frame, 0)
+
+    def _on_first_frame(self, dt):
+        startup.mark("最初のフレーム")
+        startup.stop_import_profile()
+        print(f"起動から最初のフレームまで: {startup.elapsed() * 1000:.0f} ms")
+        if startup.profile:
+            print(startup.report())
+        if STARTUP_WARMUP and self.root is not None:
+            thread = threading.Thread(target=self.root.warm_up)
+            thread.daemon = True
+            thread.start()
 
 if __name__ == '__main__':
     LongTalkerApp().run()
\ No newline at end of file
@@ -1,12 +1,20 @@
 import tkinter as tk
 from tkinter import ttk, filedialog # filedialogを追加
-from gtts import gTTS
 import os
+import queue
 import threading
-import re
-from datetime import datetime
 import pygame.mixer as mixer # pygameはTkinter版では常に使用
-import glob # フォルダ内のファイルリスト取得に使用
+
+from longtalker.cache import SynthesisCache
+from longtalker.container import playable_segments
+from longtalker.engine import SynthesisEngine
+from longtalker.jobqueue import JOB_PAUSED
+from longtalker.playback import FileListJob, PlaybackQueue
+from longtalker.pygame_player import PygameMusicPlayer
+from longtalker.segmenter import predict_request_count
+from longtalker.session import SessionManager
+from longtalker.status import PHASE_PLAY, PHASE_SYNTHESIZE, StatusChannel
+from longtalker.transport import BatchedTransport
 
 # --- pygameミキサーを初期化 (スクリプトの先頭で) ---
 try:
@@ -21,169 +29,392 @@ except Exception as e:
 # --- 関数定義 ---
 
 MAX_CHARS_PER_AUDIO = 300
+SEGMENT_MODE = "sentence" # "sentence": 「。」区切り (従来どおり) / "gtts": gTTSの100文字リクエストに合わせて詰める
 AUDIO_DIR_NAME = "generated_audio" # 音声ファイルを保存するルートフォルダ名
-
-def play_mp3_threaded(filepath):
-    """MP3ファイルを別スレッドで再生する (Tkinter向け、Pygame使用)"""
-    if PLAYBACK_METHOD == 'pygame':
+SYNTH_WORKERS = 4 # 同時に音声合成するセグメント数の上限 (1にすると従来どおり逐次処理)
+ADAPTIVE_CONCURRENCY = True # Trueなら応答に合わせて同時合成数を増減し、429/5xxで減らす
+SYNTH_MAX_RETRIES = 5 # 429/5xx/接続エラーのとき1セグメントを再試行する回数
+PIPELINE_PLAYBACK = True # Trueなら合成しながら再生する (Falseなら全セグメント作成後に再生)
+PLAYBACK_LOOKAHEAD = 4 # パイプライン再生時に再生位置より先行して合成するセグメント数
+CACHE_MAX_BYTES = 200 * 1024 * 1024 # 合成キャッシュ (AUDIO_DIR_NAME/.synth_cache) の上限サイズ
+HTTP_POOL_SIZE = 8 # Google TTSへのkeep-alive接続数 (SYNTH_WORKERS以上にする)
+BATCH_RPC_SIZE = 1 # 1回のHTTPリクエストにまとめる100文字チャンク数 (1ならまとめ送りしない。2以上は試験的)
+STORAGE_MAX_BYTES = 1024 * 1024 * 1024 # セッションフォルダの合計の上限 (超えたら最後に再生したのが古いものから削除)
+SESSION_CONTAINER = False # Trueなら再生し終えたセッションのMP3を1つのファイル (session.ltc) にまとめる
+EXPORT_SINGLE_MP3 = False # Trueなら合成後にセッションを1つのMP3 (AUDIO_DIR_NAME/<フォルダ名>.mp3) に書き出す
+JOB_POLL_INTERVAL_MS = 50 # 合成ジョブの進捗 (と再生の終了イベント) を受け取る間隔 (ミリ秒)
+UI_PUMP_INTERVAL_MS = 50 # 他のスレッドからのUI更新をまとめて反映する間隔 (ミリ秒)
+PLAYBACK_PRIORITY = 100 # 再生しながら合成するジョブの優先度 (キューのジョブより先に同時実行の枠をもらう)
+QUEUE_MAX_ACTIVE = 2 # 合成キューから同時に合成するジョブの数 (枠は SYNTH_WORKERS を分け合う)
+QUEUE_POLL_INTERVAL_MS = 500 # 合成キューの進み具合を確認する間隔 (ミリ秒)
+
+# --- 他のスレッドからUIへの受け渡し (Tkのウィジェットはメインスレッドからだけ触る) ---
+ui_calls = queue.SimpleQueue() # メインスレッドで実行する (関数, 引数)
+status_channel = StatusChannel() # ステータスは最新の1件だけを保持する
+
+def call_on_ui(func, *args):
+    """どのスレッドからでも呼べる。func は次のポンプでメインスレッドから呼ばれる"""
+    ui_calls.put((func, args))
+
+def set_status(message, color_name="black"):
+    """どのスレッドからでも呼べる。表示は次のポンプで最新の1件だけ反映される"""
+    status_channel.post(message, color_name)
+
+def pump_ui():
+    """たまったUIへの呼び出しをまとめて実行し、ステータス表示を1回だけ更新する"""
+    while True:
         try:
-            sound = mixer.Sound(filepath)
-            sound.play()
-            while mixer.get_busy(): # 再生が終了するまで待機
-                threading.Event().wait(0.1) # 0.1秒待つ
-        except Exception as e:
-            print(f"Pygame再生エラー: {e}")
-    else:
-        print(f"Tkinter環境で音声再生が有効ではありません。ファイル: {filepath}")
+            func, args = ui_calls.get_nowait()
+        except queue.Empty:
+            break
+        func(*args)
+    latest = status_channel.take()
+    if latest is not None:
+        message, color_name = latest
+        status_label.config(text=message, fg=color_name)
+    root.after(UI_PUMP_INTERVAL_MS, pump_ui)
+
+def play_mp3_threaded(filepath, stop_event=None):
+    """音声を再生できない環境 (pygame.mixer の初期化に失敗した場合) で PlaybackQueue に渡す再生関数
+
+    再生はせずにファイル名を表示してすぐに戻るので、セグメントの順番と進み具合の表示はそのまま動く。
+    pygame が使える場合は PygameMusicPlayer が mixer.music で再生するので、この関数は使わない。
+    """
+    print(f"Tkinter環境で音声再生が有効ではありません。ファイル: {filepath}")
 
 def create_and_play_audio():
-    """音声を作成して再生する一連の処理を行う関数"""
+    """テキストを分割して合成ジョブを投入する (実行中のジョブがあれば取り消して置き換える)"""
     original_text = text_entry.get("1.0", tk.END).strip()
-    lang = lang_combobox.get()
-
-    if '(' in lang and ')' in lang:
-        lang_code = lang.split('(')[1][:-1]
-    else:
-        lang_code = lang
+    lang_code = selected_lang_code()
 
     if not original_text:
-        status_label.config(text="テキストが入力されていません", fg="red")
-        set_buttons_state(tk.NORMAL)
+        set_status("テキストが入力されていません", "red")
         return
 
-    set_buttons_state(tk.DISABLED)
-    status_label.config(text="テキストを分割中...", fg="blue")
-    root.update_idletasks()
+    cancel_current_job()
+    set_status("テキストを分割中...", "blue")
+    # 分割・フォルダの準備・ライブラリへの記録は別スレッドで行い、結果を call_on_ui で受け取る
+    threading.Thread(
+        target=prepare_in_background, args=(prepare_generation["value"], original_text, lang_code), daemon=True
+    ).start()
 
+def prepare_in_background(generation, original_text, lang_code):
+    # 別スレッドで呼ばれる
     try:
-        segments = []
-        sentences = re.split(r'(。)', original_text)
-        current_segment = ""
-
-        for i in range(0, len(sentences), 2):
-            sentence = sentences[i].strip()
-            if i + 1 < len(sentences):
-                sentence += sentences[i+1]
-            if not sentence:
-                continue
-
-            if len(current_segment) + len(sentence) <= MAX_CHARS_PER_AUDIO:
-                current_segment += sentence
-            else:
-                if current_segment:
-                    segments.append(current_segment.strip())
-                current_segment = sentence
-        
-        if current_segment:
-            segments.append(current_segment.strip())
-        
-        final_segments = []
-        for segment in segments:
-            while len(segment) > MAX_CHARS_PER_AUDIO:
-                split_point = MAX_CHARS_PER_AUDIO
-                temp_split_segment = segment[:split_point]
-                last_space_index = temp_split_segment.rfind(' ')
-                if last_space_index != -1 and last_space_index > split_point * 0.8:
-                     split_point = last_space_index
-                
-                final_segments.append(segment[:split_point].strip())
-                segment = segment[split_point:].strip()
-            if segment:
-                final_segments.append(segment.strip())
-
-        if not final_segments:
-            status_label.config(text="分割可能なテキストが見つかりません", fg="red")
-            set_buttons_state(tk.NORMAL)
-            return
-
-        status_label.config(text=f"テキストを {len(final_segments)} 個のセグメントに分割しました。", fg="green")
-        root.update_idletasks()
-        
-        # 音声ファイルを保存するフォルダの準備
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        folder_name_prefix = original_text[:20].replace(' ', '_').replace('　', '_')
-        folder_name_prefix = re.sub(r'[\\/:*?"<>|]', '_', folder_name_prefix)
-        audio_sub_dir = f"{folder_name_prefix}_{timestamp}"
-        
-        full_audio_path = os.path.join(AUDIO_DIR_NAME, audio_sub_dir)
-        os.makedirs(full_audio_path, exist_ok=True)
-        
-        audio_files_to_play = []
-
-        for i, segment in enumerate(final_segments):
-            filename = os.path.join(full_audio_path, f"{i+1:03d}.mp3")
-            status_label.config(text=f"音声ファイル {i+1}/{len(final_segments)} を作成中...", fg="blue")
-            root.update_idletasks()
-
-            tts = gTTS(text=segment, lang=lang_code)
-            tts.save(filename)
-            audio_files_to_play.append(filename)
-
-        status_label.config(text=f"{len(audio_files_to_play)} 個の音声ファイルを作成しました。連続再生します...", fg="green")
-        root.update_idletasks()
-        
-        # --- 音声の連続再生 ---
-        for i, audio_file in enumerate(audio_files_to_play):
-            status_label.config(text=f"再生中: {i+1}/{len(audio_files_to_play)} - '{os.path.basename(audio_file)}'", fg="purple")
-            root.update_idletasks()
-            play_mp3_threaded(audio_file)
-        
-        status_label.config(text=f"すべての音声ファイルの再生が完了しました。フォルダ: '{full_audio_path}'", fg="green")
-    
+        final_segments, filenames, reused, journal = session_manager.prepare(original_text, lang_code)
+        # 表示するのはHTTPリクエストの数 (まとめ送りなら複数のチャンクで1リクエスト)
+        request_count = predict_request_count(
+            [segment for i, segment in enumerate(final_segments) if i not in reused], lang_code,
+            packing=session_manager.packing, batch_size=transport.chunks_per_request,
+        )
     except Exception as e:
-        status_label.config(text=f"エラー: {e}", fg="red")
-    
-    finally:
-        set_buttons_state(tk.NORMAL)
+        call_on_ui(on_session_prepared, generation, None, f"エラー: {e}")
+        return
+    call_on_ui(on_session_prepared, generation, (lang_code, final_segments, filenames, reused, journal, request_count), None)
+
+def on_session_prepared(generation, prepared, message):
+    global current_job
+    if generation != prepare_generation["value"]:
+        return # 準備している間に取り消されたか、別のテキストの合成が始まった
+    if prepared is None:
+        set_status(message, "red")
+        return
+    lang_code, final_segments, filenames, reused, journal, request_count = prepared
+    if not final_segments:
+        set_status("分割可能なテキストが見つかりません", "red")
+        return
 
+    set_status(f"テキストを {len(final_segments)} 個のセグメントに分割しました。(前回から再利用: {len(reused)} 個、予測リクエスト数: {request_count})", "green")
+    lookahead = PLAYBACK_LOOKAHEAD if PIPELINE_PLAYBACK else None
+    status_channel.reset_progress()
+    current_job = engine.submit(
+        final_segments, lang_code, filenames, lookahead=lookahead, done=reused,
+        packing=session_manager.packing, priority=PLAYBACK_PRIORITY, journal=journal,
+    )
+    play_position["index"] = 0
+    # 完成したセグメントはafterで定期的に受け取る (UIスレッドはブロックしない)
+    root.after(JOB_POLL_INTERVAL_MS, poll_current_job, current_job)
+
+def selected_lang_code():
+    lang = lang_combobox.get()
+    if '(' in lang and ')' in lang:
+        return lang.split('(')[1][:-1]
+    return lang
+
+def cancel_current_job():
+    """実行中の合成ジョブと再生を取り消す"""
+    global current_job
+    prepare_generation["value"] += 1
+    if current_job is not None:
+        current_job.cancel()
+        current_job = None
+    playback.stop()
+
+def poll_current_job(job):
+    """合成ジョブの進み具合を受け取り、完成したセグメントを再生キューに渡す"""
+    if job is not current_job:
+        return # 取り消されたジョブ
+    ready = job.poll()
+    if PIPELINE_PLAYBACK:
+        for index, filename in ready:
+            playback.enqueue(job, index, filename)
+    if job.error is not None:
+        set_status(f"エラー: {job.error} ({engine.limiter.describe()})", "red")
+        cancel_current_job()
+        return
+    if ready:
+        report_positions(job)
+    if job.synthesized == job.total:
+        if not PIPELINE_PLAYBACK:
+            set_status(f"{job.total} 個の音声ファイルを作成しました。連続再生します...", "green")
+            for index, filename in enumerate(job.filenames):
+                playback.enqueue(job, index, filename)
+        session_manager.start_finalize_thread(job)
+        return
+    root.after(JOB_POLL_INTERVAL_MS, poll_current_job, job)
+
+def pump_playback():
+    """再生の終了イベントを処理し、次のセグメントを予約する (ストリーミング再生時)"""
+    playback.pump()
+    root.after(JOB_POLL_INTERVAL_MS, pump_playback)
+
+def reconcile_library():
+    # 別スレッドで呼ばれる
+    incomplete = session_manager.reconcile()
+    if incomplete:
+        call_on_ui(resume_incomplete_sessions, incomplete)
+
+def report_positions(job):
+    # 合成中は合成の進み具合、合成し終えたら再生の進み具合 (残り時間の見積もり付き) を表示する
+    if job.synthesized < job.total:
+        status_channel.progress(
+            PHASE_SYNTHESIZE, job.synthesized, job.total, detail=f"再生中: {play_position['index']}/{job.total}"
+        )
+    else:
+        status_channel.progress(PHASE_PLAY, play_position["index"], job.total)
+
+def on_playback_start(job, index, filename):
+    # メインスレッドで呼ばれる (再生スレッドからは call_on_ui 経由)
+    play_position["index"] = index + 1
+    report_positions(job)
+    if index == 0 and session_manager.in_library(job.output_dir):
+        library.mark_played(job.output_dir)
+
+def on_playback_finish(job, index):
+    # メインスレッドで呼ばれる (再生スレッドからは call_on_ui 経由)
+    if index + 1 == job.total:
+        set_status(f"すべての音声ファイルの再生が完了しました。フォルダ: '{job.output_dir}' ({synth_cache.describe()}, {engine.limiter.describe()})", "green")
+        print(f"合成キャッシュ: {synth_cache.stats()} / リクエスト: {engine.limiter.stats()}")
+        if SESSION_CONTAINER:
+            session_manager.start_pack_thread(job.output_dir)
+
+# --- 合成キュー (再生せずに合成だけしておくジョブ) ---
+
+def resume_incomplete_sessions(session_dirs):
+    """強制終了やエラーで合成が途中で終わったセッションを、合成キューで続きから合成する"""
+    resumed = session_manager.resume_incomplete_sessions(session_dirs)
+    if resumed:
+        set_status(f"途中で終わったセッションを {resumed} 個、合成キューで再開します", "blue")
+        refresh_job_queue()
+
+def on_queued_job_finished(entry, job):
+    # 後処理は SessionManager が別スレッドで始めている
+    set_status(f"キューのジョブ '{entry['title']}' の合成が完了しました", "green")
+
+def pump_job_queue():
+    if job_queue.pump():
+        refresh_job_queue()
+    root.after(QUEUE_POLL_INTERVAL_MS, pump_job_queue)
+
+def add_text_to_queue():
+    """入力中のテキストを合成キューに入れる (再生中のジョブはそのまま続ける)"""
+    text = text_entry.get("1.0", tk.END).strip()
+    if not text:
+        set_status("テキストが入力されていません", "red")
+        return
+    entry = job_queue.add(text, selected_lang_code())
+    set_status(f"'{entry['title']}' を合成キューに入れました", "green")
+    refresh_job_queue()
+
+def add_files_to_queue():
+    """選んだテキストファイルを1つずつ合成キューに入れる"""
+    paths = filedialog.askopenfilenames(
+        title="合成するテキストファイルを選択してください", filetypes=[("テキスト", "*.txt"), ("すべて", "*")]
+    )
+    added = 0
+    for path in paths:
+        try:
+            with open(path, encoding="utf-8") as f:
+                text = f.read().strip()
+        except (OSError, UnicodeDecodeError) as e:
+            set_status(f"エラー: {e}", "red")
+            continue
+        if text:
+            job_queue.add(text, selected_lang_code(), title=os.path.basename(path))
+            added += 1
+    if added:
+        set_status(f"{added} 個のファイルを合成キューに入れました", "green")
+    refresh_job_queue()
+
+def open_job_queue():
+    """合成キューの一覧を表示する (優先度の変更・一時停止・再開・取り消し)"""
+    if queue_window["window"] is not None:
+        queue_window["window"].lift()
+        return
+    window = tk.Toplevel(root)
+    window.title("合成キュー")
+    listbox = tk.Listbox(window, width=60, height=12)
+    listbox.pack(padx=10, pady=(10, 5), fill=tk.BOTH, expand=True)
+    buttons = tk.Frame(window)
+    buttons.pack(padx=10, pady=(0, 10), fill=tk.X)
+    for text, command in (
+        ("優先↑", lambda: change_job_priority(1)),
+        ("優先↓", lambda: change_job_priority(-1)),
+        ("一時停止/再開", toggle_job_pause),
+        ("取消", cancel_queued_job),
+        ("テキストを追加", add_text_to_queue),
+        ("ファイルを追加", add_files_to_queue),
+        ("片付け", clear_finished_jobs),
+    ):
+        tk.Button(buttons, text=text, command=command).pack(side=tk.LEFT, padx=2)
+
+    def close():
+        queue_window["window"] = queue_window["listbox"] = None
+        window.destroy()
+
+    window.protocol("WM_DELETE_WINDOW", close)
+    queue_window["window"], queue_window["listbox"] = window, listbox
+    refresh_job_queue()
+
+def refresh_job_queue():
+    listbox = queue_window["listbox"]
+    if listbox is None:
+        return
+    selection = listbox.curselection()
+    listbox.delete(0, tk.END)
+    for entry in job_queue.entries:
+        listbox.insert(tk.END, job_queue.describe(entry))
+    if selection and selection[0] < listbox.size():
+        listbox.selection_set(selection[0])
+
+def selected_queue_entry():
+    listbox = queue_window["listbox"]
+    selection = listbox.curselection() if listbox is not None else ()
+    if not selection or selection[0] >= len(job_queue.entries):
+        set_status("キューのジョブが選択されていません", "orange")
+        return None
+    return job_queue.entries[selection[0]]
+
+def change_job_priority(delta):
+    entry = selected_queue_entry()
+    if entry is not None:
+        job_queue.set_priority(entry["id"], entry["priority"] + delta)
+        refresh_job_queue()
+
+def toggle_job_pause():
+    entry = selected_queue_entry()
+    if entry is not None:
+        if entry["state"] == JOB_PAUSED:
+            job_queue.resume(entry["id"])
+        else:
+            job_queue.pause(entry["id"])
+        refresh_job_queue()
+
+def cancel_queued_job():
+    entry = selected_queue_entry()
+    if entry is not None:
+        job_queue.cancel(entry["id"])
+        refresh_job_queue()
+
+def clear_finished_jobs():
+    job_queue.clear_finished()
+    refresh_job_queue()
+
+
+def open_library():
+    """作成済みのセッションの一覧を表示し、選んだセッションを連続再生する (タイトルとフォルダ名で検索できる)"""
+    if library_window["window"] is not None:
+        library_window["window"].lift()
+        return
+    window = tk.Toplevel(root)
+    window.title("ライブラリから再生")
+    query = tk.StringVar()
+    search_frame = tk.Frame(window)
+    search_frame.pack(padx=10, pady=(10, 5), fill=tk.X)
+    tk.Label(search_frame, text="検索:").pack(side=tk.LEFT, padx=(0, 5))
+    tk.Entry(search_frame, textvariable=query).pack(side=tk.LEFT, fill=tk.X, expand=True)
+    listbox = tk.Listbox(window, width=60, height=12)
+    listbox.pack(padx=10, pady=5, fill=tk.BOTH, expand=True)
+    listbox.bind("<Double-Button-1>", lambda _event: play_selected_session())
+    buttons = tk.Frame(window)
+    buttons.pack(padx=10, pady=(0, 10), fill=tk.X)
+    for text, command in (
+        ("再生", play_selected_session),
+        ("フォルダを選択", play_audio_folder),
+    ):
+        tk.Button(buttons, text=text, command=command).pack(side=tk.LEFT, padx=2)
+
+    def close():
+        library_window["window"] = library_window["listbox"] = library_window["query"] = None
+        window.destroy()
+
+    window.protocol("WM_DELETE_WINDOW", close)
+    library_window["window"], library_window["listbox"], library_window["query"] = window, listbox, query
+    query.trace_add("write", lambda *_args: refresh_library())
+    refresh_library()
+
+def refresh_library():
+    listbox = library_window["listbox"]
+    if listbox is None:
+        return
+    sessions = library_window["sessions"] = library.list_sessions(query=library_window["query"].get().strip() or None)
+    listbox.delete(0, tk.END)
+    for session in sessions:
+        listbox.insert(tk.END, describe_session(session))
+
+def describe_session(session):
+    duration = session["duration"]
+    length = f"{int(duration) // 60}:{int(duration) % 60:02d}" if duration else "--:--"
+    return f"{session['title']}  [{session['lang'] or '?'}] {session['segments'] or 0}個 {length}"
+
+def play_selected_session():
+    listbox = library_window["listbox"]
+    selection = listbox.curselection() if listbox is not None else ()
+    if not selection or selection[0] >= len(library_window["sessions"]):
+        set_status("セッションが選択されていません", "orange")
+        return
+    play_session_folder(library.session_dir(library_window["sessions"][selection[0]]["name"]))
 
-def select_and_play_audio_folder():
-    """フォルダを選択し、その中のMP3ファイルを連続再生する関数"""
+def play_audio_folder():
+    """ライブラリにないフォルダを選択し、その中のMP3ファイルを再生キューで連続再生する"""
     folder_path = filedialog.askdirectory(initialdir=AUDIO_DIR_NAME, title="再生する音声フォルダを選択してください")
 
     if not folder_path:
-        status_label.config(text="フォルダが選択されていません", fg="orange")
+        set_status("フォルダが選択されていません", "orange")
         return
+    play_session_folder(folder_path)
 
-    set_buttons_state(tk.DISABLED)
-    status_label.config(text=f"フォルダ '{os.path.basename(folder_path)}' を読み込み中...", fg="blue")
-    root.update_idletasks()
-
+def play_session_folder(folder_path):
+    """フォルダの中のMP3ファイルを再生キューで連続再生する"""
+    global current_job
+    cancel_current_job()
     try:
-        # フォルダ内のMP3ファイルをリストアップし、ソートする
-        mp3_files = sorted(glob.glob(os.path.join(folder_path, "*.mp3")))
-
-        if not mp3_files:
-            status_label.config(text="選択されたフォルダにMP3ファイルが見つかりません", fg="red")
-            return
-
-        status_label.config(text=f"{len(mp3_files)} 個のMP3ファイルを再生します...", fg="green")
-        root.update_idletasks()
-
-        for i, audio_file in enumerate(mp3_files):
-            status_label.config(text=f"再生中: {i+1}/{len(mp3_files)} - '{os.path.basename(audio_file)}'", fg="purple")
-            root.update_idletasks()
-            play_mp3_threaded(audio_file)
-        
-        status_label.config(text=f"すべての音声ファイルの再生が完了しました。フォルダ: '{os.path.basename(folder_path)}'", fg="green")
-
-    except Exception as e:
-        status_label.config(text=f"エラー: {e}", fg="red")
-    finally:
-        set_buttons_state(tk.NORMAL)
-
+        # マニフェストの順 (無ければファイル名順) にMP3ファイルを並べる (コンテナにまとめてあればその中の範囲)
+        mp3_files = playable_segments(folder_path)
+    except (OSError, ValueError) as e:
+        set_status(f"エラー: {e}", "red")
+        return
 
-def start_audio_thread():
-    """UIが固まらないように、別スレッドで音声作成処理を開始する"""
-    thread = threading.Thread(target=create_and_play_audio)
-    thread.daemon = True
-    thread.start()
+    if not mp3_files:
+        set_status("選択されたフォルダにMP3ファイルが見つかりません", "red")
+        return
 
-def start_folder_playback_thread():
-    """UIが固まらないように、別スレッドでフォルダ再生処理を開始する"""
-    thread = threading.Thread(target=select_and_play_audio_folder)
-    thread.daemon = True
-    thread.start()
+    set_status(f"{len(mp3_files)} 個のMP3ファイルを再生します...", "green")
+    status_channel.reset_progress()
+    play_position["index"] = 0
+    current_job = FileListJob(mp3_files, output_dir=folder_path)
+    for index, filename in enumerate(mp3_files):
+        playback.enqueue(current_job, index, filename)
 
 def paste_text():
     """クリップボードからテキストを貼り付ける"""
@@ -192,25 +423,17 @@ def paste_text():
         text_entry.delete("1.0", tk.END)
         text_entry.insert(tk.END, text)
     except tk.TclError:
-        status_label.config(text="クリップボードが空です", fg="orange")
+        set_status("クリップボードが空です", "orange")
 
 def clear_text():
-    """テキスト入力欄とステータス表示をクリアする"""
+    """テキスト入力欄とステータス表示をクリアする (実行中のジョブも取り消す)"""
+    cancel_current_job()
     text_entry.delete("1.0", tk.END)
-    status_label.config(text="")
+    set_status("")
     # 音声ファイルが保存されるルートフォルダがあれば作成 (初回起動時など)
     os.makedirs(AUDIO_DIR_NAME, exist_ok=True)
 
 
-def set_buttons_state(state):
-    """すべてのボタンの状態を一括で変更する関数"""
-    create_button.config(state=state)
-    paste_button.config(state=state)
-    clear_button.config(state=state)
-    lang_combobox.config(state=state)
-    play_folder_button.config(state=state) # 新しいボタンも制御
-
-
 # --- Tkinterウィンドウのセットアップ ---
 root = tk.Tk()
 root.title("LongTalker App")
@@ -241,13 +464,16 @@ clear_button = tk.Button(button_frame, text="クリア", command=clear_text)
 clear_button.pack(side=tk.LEFT)
 
 # メインの実行ボタン
-create_button = tk.Button(main_frame, text="音声ファイルを作成して再生", command=start_audio_thread, font=("IPAexGothic", 11, "bold"), bg="#4CAF50", fg="white")
+create_button = tk.Button(main_frame, text="音声ファイルを作成して再生", command=create_and_play_audio, font=("IPAexGothic", 11, "bold"), bg="#4CAF50", fg="white")
 create_button.pack(pady=(10,5), fill=tk.X) # padyを調整
 
 # ★★★ 新しい再生ボタン ★★★
-play_folder_button = tk.Button(main_frame, text="フォルダから再生", command=start_folder_playback_thread, font=("IPAexGothic", 11, "bold"), bg="#2196F3", fg="white") # 青系の色に
+play_folder_button = tk.Button(main_frame, text="ライブラリから再生", command=open_library, font=("IPAexGothic", 11, "bold"), bg="#2196F3", fg="white") # 青系の色に
 play_folder_button.pack(pady=(5,10), fill=tk.X) # padyを調整
 
+queue_button = tk.Button(main_frame, text="合成キュー", command=open_job_queue)
+queue_button.pack(pady=(0, 5), fill=tk.X)
+
 status_label = tk.Label(main_frame, text="ここにステータスが表示されます", anchor="w", justify=tk.LEFT)
 status_label.pack(pady=(5, 0), fill=tk.X)
 
@@ -255,6 +481,45 @@ status_label.pack(pady=(5, 0), fill=tk.X)
 if not os.path.exists(AUDIO_DIR_NAME):
     os.makedirs(AUDIO_DIR_NAME)
 
+# --- 合成キャッシュ (同じテキストの再合成でネットワークを使わないようにする) ---
+synth_cache = SynthesisCache(AUDIO_DIR_NAME, max_bytes=CACHE_MAX_BYTES)
+# アプリ実行中はひとつの接続プールを使い回し、チャンクごとのハンドシェイクを省く
+transport = BatchedTransport(pool_size=HTTP_POOL_SIZE, batch_size=BATCH_RPC_SIZE)
+# 合成はアプリ全体で1つのasyncioループで行う
+engine = SynthesisEngine(
+    max_in_flight=SYNTH_WORKERS, cache=synth_cache, transport=transport,
+    adaptive=ADAPTIVE_CONCURRENCY, max_retries=SYNTH_MAX_RETRIES,
+)
+if PLAYBACK_METHOD == 'pygame':
+    # mixer.music でストリーミング再生し、次のセグメントは queue で予約して隙間なくつなぐ
+    playback = PygameMusicPlayer(on_start=on_playback_start, on_finish=on_playback_finish)
+    root.after(JOB_POLL_INTERVAL_MS, pump_playback)
+else:
+    # 音声は出せないが、再生スレッドで順番に進める (コールバックはUIのポンプでメインスレッドに渡す)
+    playback = PlaybackQueue(
+        play_mp3_threaded,
+        on_start=lambda *args: call_on_ui(on_playback_start, *args),
+        on_finish=lambda *args: call_on_ui(on_playback_finish, *args),
+    )
+# セッションの作成・ライブラリ・容量管理・合成キュー (Kivy版と共通の SessionManager)
+session_manager = SessionManager(
+    AUDIO_DIR_NAME, get_engine=lambda: engine, current_job=lambda: current_job,
+    max_chars=MAX_CHARS_PER_AUDIO, mode=SEGMENT_MODE, storage_max_bytes=STORAGE_MAX_BYTES,
+    queue_max_active=QUEUE_MAX_ACTIVE, export_single_mp3=EXPORT_SINGLE_MP3,
+    on_queued_job_finished=on_queued_job_finished,
+)
+library = session_manager.library
+job_queue = session_manager.job_queue
+queue_window = {"window": None, "listbox": None} # 開いている合成キューのウィンドウ
+library_window = {"window": None, "listbox": None, "query": None, "sessions": []} # 開いているライブラリのウィンドウ
+current_job = None
+prepare_generation = {"value": 0} # 準備中のセッションの番号 (取り消されたら結果を捨てる)
+play_position = {"index": 0}
+# ライブラリを実際のフォルダと突き合わせ、途中で終わったセッションを探す
+threading.Thread(target=reconcile_library, daemon=True).start()
+root.after(UI_PUMP_INTERVAL_MS, pump_ui)
+root.after(QUEUE_POLL_INTERVAL_MS, pump_job_queue)
+
 
 # --- ウィンドウのメインループ ---
 root.mainloop()
\ No newline at end of file